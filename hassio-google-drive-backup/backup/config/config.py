@@ -44,6 +44,7 @@ NON_UI_SETTING = {
     Setting.CACHE_WARMUP_MAX_SECONDS,
     Setting.CACHE_WARMUP_ERROR_TIMEOUT_SECONDS,
     Setting.WATCH_BACKUP_DIRECTORY,
+    Setting.WATCH_BACKUP_EVENTS,
     Setting.TRACE_REQUESTS,
     Setting.MAX_BACKOFF_SECONDS
 }
@@ -72,6 +72,7 @@ class Setting(Enum):
     CONFIRM_MULTIPLE_DELETES = "confirm_multiple_deletes"
     ENABLE_DRIVE_UPLOAD = "enable_drive_upload"
     WATCH_BACKUP_DIRECTORY = "watch_backup_directory"
+    WATCH_BACKUP_EVENTS = "watch_backup_events"
     TRACE_REQUESTS = "trace_requests"
 
     # Theme Settings
@@ -100,6 +101,7 @@ class Setting(Enum):
     CONFIG_FILE_PATH = "config_file_path"
     ID_FILE_PATH = "id_file_path"
     DATA_CACHE_FILE_PATH = "data_cache_file_path"
+    RESTORE_SPOOL_FILE_PATH = "restore_spool_file_path"
 
     # endpoints
     AUTHORIZATION_HOST = "authorization_host"
@@ -153,6 +155,13 @@ class Setting(Enum):
     DEPRECTAED_ENABLE_BACKUP_STATE_SENSOR = "enable_snapshot_state_sensor"
 
     UPLOAD_LIMIT_BYTES_PER_SECOND = "upload_limit_bytes_per_second"
+    MAXIMUM_CONCURRENT_UPLOADS = "maximum_concurrent_uploads"
+    BANDWIDTH_LIMIT_BYTES_PER_SECOND = "bandwidth_limit_bytes_per_second"
+    BANDWIDTH_LIMIT_HOURS = "bandwidth_limit_hours"
+    DEDUPLICATE_UPLOADS = "deduplicate_uploads"
+    DOWNLOAD_CONNECTIONS = "download_connections"
+    DOWNLOAD_PART_BYTES = "download_part_bytes"
+    DOWNLOAD_READ_AHEAD_BYTES = "download_read_ahead_bytes"
 
     def default(self):
         if "staging" in VERSION and self in _STAGING_DEFAULTS:
@@ -183,6 +192,7 @@ _DEFAULTS = {
     Setting.BACKUP_PASSWORD: "",
     Setting.BACKUP_STORAGE: "",
     Setting.WATCH_BACKUP_DIRECTORY: True,
+    Setting.WATCH_BACKUP_EVENTS: True,
     Setting.TRACE_REQUESTS: False,
 
     # Basic backup settings
@@ -275,6 +285,7 @@ _DEFAULTS = {
     Setting.ID_FILE_PATH: "/data/id.json",
     Setting.STOP_ADDON_STATE_PATH: '/data/stop_addon_state.json',
     Setting.DATA_CACHE_FILE_PATH: '/data/data_cache.json',
+    Setting.RESTORE_SPOOL_FILE_PATH: '/data/restore_spool.tar',
 
     # Various timeouts and intervals
     Setting.BACKUP_STALE_SECONDS: 60 * 60 * 3,
@@ -302,6 +313,13 @@ _DEFAULTS = {
     Setting.MAX_BACKOFF_SECONDS: 60 * 60 * 2,  # 2 hours
 
     Setting.UPLOAD_LIMIT_BYTES_PER_SECOND: 0,
+    Setting.MAXIMUM_CONCURRENT_UPLOADS: 1,
+    Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND: 0,
+    Setting.BANDWIDTH_LIMIT_HOURS: "",
+    Setting.DEDUPLICATE_UPLOADS: False,
+    Setting.DOWNLOAD_CONNECTIONS: 4,
+    Setting.DOWNLOAD_PART_BYTES: 4 * 1024 * 1024,
+    Setting.DOWNLOAD_READ_AHEAD_BYTES: 8 * 1024 * 1024,
 }
 
 _STAGING_DEFAULTS = {
@@ -327,6 +345,7 @@ _CONFIG = {
     Setting.BACKUP_PASSWORD: "str?",
     Setting.BACKUP_STORAGE: "str?",
     Setting.WATCH_BACKUP_DIRECTORY: "bool?",
+    Setting.WATCH_BACKUP_EVENTS: "bool?",
     Setting.TRACE_REQUESTS: "bool?",
 
     # Basic backup settings
@@ -418,6 +437,7 @@ _CONFIG = {
     Setting.ID_FILE_PATH: "str?",
     Setting.STOP_ADDON_STATE_PATH: "str?",
     Setting.DATA_CACHE_FILE_PATH: "str?",
+    Setting.RESTORE_SPOOL_FILE_PATH: "str?",
 
     # Various timeouts and intervals
     Setting.BACKUP_STALE_SECONDS: "float(0,)?",
@@ -445,6 +465,13 @@ _CONFIG = {
     Setting.MAX_BACKOFF_SECONDS: "int(3600,)?",
 
     Setting.UPLOAD_LIMIT_BYTES_PER_SECOND: "float(0,)?",
+    Setting.MAXIMUM_CONCURRENT_UPLOADS: "int(1,)?",
+    Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND: "float(0,)?",
+    Setting.BANDWIDTH_LIMIT_HOURS: "match(^([01]\\d|2[0-3]):[0-5]\\d-([01]\\d|2[0-3]):[0-5]\\d$)?",
+    Setting.DEDUPLICATE_UPLOADS: "bool?",
+    Setting.DOWNLOAD_CONNECTIONS: "int(1,)?",
+    Setting.DOWNLOAD_PART_BYTES: f"float({1024 * 256},)?",
+    Setting.DOWNLOAD_READ_AHEAD_BYTES: "float(0,)?",
 }
 
 PRIVATE = [
@@ -520,8 +547,11 @@ _VALIDATORS[Setting.MAX_SYNC_INTERVAL_SECONDS] = DurationAsStringValidator(Setti
 _VALIDATORS[Setting.HA_REPORTING_INTERVAL_SECONDS] = DurationAsStringValidator(Setting.HA_REPORTING_INTERVAL_SECONDS.value, minimum=1, maximum=None)
 _VALIDATORS[Setting.DELETE_IGNORED_AFTER_DAYS] = DurationAsStringValidator(Setting.DELETE_IGNORED_AFTER_DAYS.value, minimum=0, maximum=None, base_seconds=60 * 60 * 24, default_as_empty=0)
 _VALIDATORS[Setting.MAXIMUM_UPLOAD_CHUNK_BYTES] = BytesizeAsStringValidator(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES.value, minimum=256 * 1024)
+_VALIDATORS[Setting.DOWNLOAD_PART_BYTES] = BytesizeAsStringValidator(Setting.DOWNLOAD_PART_BYTES.value, minimum=256 * 1024)
+_VALIDATORS[Setting.DOWNLOAD_READ_AHEAD_BYTES] = BytesizeAsStringValidator(Setting.DOWNLOAD_READ_AHEAD_BYTES.value, minimum=0)
 _VALIDATORS[Setting.PENDING_BACKUP_TIMEOUT_SECONDS] = DurationAsStringValidator(Setting.PENDING_BACKUP_TIMEOUT_SECONDS.value, minimum=1, maximum=None)
 _VALIDATORS[Setting.UPLOAD_LIMIT_BYTES_PER_SECOND] = BytesizeAsStringValidator(Setting.UPLOAD_LIMIT_BYTES_PER_SECOND.value, minimum=0)
+_VALIDATORS[Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND] = BytesizeAsStringValidator(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND.value, minimum=0)
 VERSION = addon_config["version"]
 
 
@@ -19,6 +19,7 @@ ERROR_GOOGLE_INTERNAL = "google_server_error"
 ERROR_GOOGLE_SESSION = "google_session_expired"
 ERROR_GOOGLE_TIMEOUT = "google_timeout"
 ERROR_GOOGLE_UNEXPECTED = "google_unexpected"
+ERROR_UPLOAD_CHECKSUM = "upload_checksum_mismatch"
 ERROR_HA_DELETE_ERROR = "delete_error"
 ERROR_MULTIPLE_DELETES = "multiple_deletes"
 ERROR_SUPERVISOR_UNEXPECTED = "supervisor_unexpected"
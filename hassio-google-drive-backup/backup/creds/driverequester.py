@@ -1,7 +1,11 @@
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
 from aiohttp import ClientSession, ContentTypeError, ClientConnectorError, ClientTimeout, ClientResponse
 from aiohttp.client_exceptions import ServerTimeoutError, ServerDisconnectedError, ClientOSError
 from backup.exceptions import GoogleUnexpectedError, GoogleInternalError, GoogleRateLimitError, GoogleCredentialsExpired, CredRefreshGoogleError, DriveQuotaExceeded, GoogleDrivePermissionDenied, GoogleDnsFailure, GoogleCantConnect, GoogleTimeoutError
-from backup.util import Resolver
+from backup.util import Resolver, AdaptiveLimiter
+from backup.time import Time
 from backup.logger import getLogger
 from backup.config import Config, Setting
 from injector import singleton, inject
@@ -13,22 +17,44 @@ INTERNAL_ERROR = [500, 503]
 PERMISSION_DENIED = [401]
 REQUEST_TIMEOUT = [408]
 
+# Bounds on how many requests can be sent to Google at once.  The limit starts at the top and drops when Google
+# says too many requests are being made.
+MIN_CONCURRENT_REQUESTS = 1
+MAX_CONCURRENT_REQUESTS = 10
+
+# Don't trust a Retry-After header that says to wait longer than this
+MAX_RETRY_AFTER_SECONDS = 60 * 60
+
 logger = getLogger(__name__)
 
 
 @singleton
 class DriveRequester():
     @inject
-    def __init__(self, config: Config, session: ClientSession, resolver: Resolver):
+    def __init__(self, config: Config, session: ClientSession, resolver: Resolver, time: Time):
         self.session = session
         self.resolver = resolver
         self.config = config
+        self.time = time
+        self.limiter = AdaptiveLimiter(time, MIN_CONCURRENT_REQUESTS, MAX_CONCURRENT_REQUESTS)
         self.all_resposnes: list[ClientResponse] = []
 
         # This is just kept around for debugging purposes
         self.track_response = False
 
     async def request(self, method, url, headers={}, json=None, data=None) -> ClientResponse:
+        generation = await self.limiter.acquire()
+        try:
+            response = await self._request(method, url, headers=headers, json=json, data=data)
+            self.limiter.succeeded()
+            return response
+        except GoogleRateLimitError as e:
+            self.limiter.rateLimited(generation, e.retry_after)
+            raise
+        finally:
+            self.limiter.release()
+
+    async def _request(self, method, url, headers={}, json=None, data=None) -> ClientResponse:
         try:
             response = await self.session.request(method, url, headers=headers, json=json, timeout=self.buildTimeout(), data=data)
             if self.track_response:
@@ -43,8 +69,9 @@ class DriveRequester():
                 response.release()
                 raise GoogleInternalError()
             elif response.status in RATE_LIMIT_EXCEEDED or response.status in TOO_MANY_REQUESTS:
+                retry_after = self._retryAfter(response)
                 response.release()
-                raise GoogleRateLimitError()
+                raise GoogleRateLimitError(retry_after)
             elif response.status in REQUEST_TIMEOUT:
                 response.release()
                 raise GoogleTimeoutError()
@@ -83,6 +110,24 @@ class DriveRequester():
             self.resolver.toggle()
             raise GoogleDnsFailure()
 
+    def _retryAfter(self, response: ClientResponse) -> Optional[float]:
+        """Parses the Retry-After header, which can be either a number of seconds or a date"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(value) - self.time.now()).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        if seconds <= 0:
+            # "Try again now" (or a date that's already passed) gives nothing to wait on, so treat it like Google
+            # didn't say and back off the usual way instead.
+            return None
+        return min(seconds, MAX_RETRY_AFTER_SECONDS)
+
     def buildTimeout(self):
         return ClientTimeout(
             sock_connect=self.config.get(
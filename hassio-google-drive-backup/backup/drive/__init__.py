@@ -2,4 +2,5 @@
 from .driverequests import DriveRequests, RETRY_SESSION_ATTEMPTS, UPLOAD_SESSION_EXPIRATION_DURATION, URL_START_UPLOAD, OOB_CRED_CUTOFF
 from .drivesource import DriveSource, SOURCE_GOOGLE_DRIVE
 from .folderfinder import FolderFinder
+from .folderindex import FolderIndex
 from .authcodequery import AuthCodeQuery
\ No newline at end of file
@@ -0,0 +1,78 @@
+import math
+
+BASE_CHUNK_SIZE = 256 * 1024  # Google's api requires uploading chunks in multiples of 256kb
+
+# During upload, chunks get sized to complete upload after 10s so we can give status updates on progress.
+CHUNK_UPLOAD_TARGET_SECONDS = 10
+
+# Chunks are made big enough that the fixed cost of each request (its round trip latency) is at most this
+# share of the time spent sending a chunk, even if that means progress gets reported less often.
+CHUNK_OVERHEAD_TARGET = 0.1
+
+# How much weight each new measurement gets in the smoothed throughput and latency estimates.
+SMOOTHING_FACTOR = 0.25
+
+# Chunks that take less time than this after accounting for latency are too quick to measure meaningfully.
+MINIMUM_MEASURABLE_SECONDS = 0.001
+
+
+class ChunkSizer():
+    """
+    Picks the size of the chunks used to upload to Google Drive.  It keeps smoothed estimates of the upload
+    throughput and of the latency of each request, and sizes chunks so they take about
+    CHUNK_UPLOAD_TARGET_SECONDS to send without the latency ever being more than CHUNK_OVERHEAD_TARGET of
+    the request.  The estimates are kept between uploads, so an upload can start with a chunk size that
+    worked last time instead of working its way up from the minimum again.
+
+    Chunk sizes are given in multiples of BASE_CHUNK_SIZE.
+    """
+
+    def __init__(self, target_seconds: float = CHUNK_UPLOAD_TARGET_SECONDS, overhead_target: float = CHUNK_OVERHEAD_TARGET, smoothing: float = SMOOTHING_FACTOR):
+        self.target_seconds = target_seconds
+        self.overhead_target = overhead_target
+        self.smoothing = smoothing
+
+        # Smoothed upload throughput in bytes/second, or None before any chunk has been sent
+        self.throughput: float = None
+
+        # Smoothed latency of a request in seconds, measured from requests without a body
+        self.latency: float = None
+
+        # Whether the last upload ended in an error, in which case the next one starts small
+        self._failed = False
+
+    def recordLatency(self, seconds: float):
+        self.latency = self._smooth(self.latency, max(seconds, 0))
+
+    def recordChunk(self, size: int, seconds: float):
+        """Records that a chunk of size bytes took the given number of seconds to upload"""
+        transfer_seconds = max(seconds - (self.latency or 0), MINIMUM_MEASURABLE_SECONDS)
+        self.throughput = self._smooth(self.throughput, size / transfer_seconds)
+        self._failed = False
+
+    def recordFailure(self):
+        self._failed = True
+
+    def initialSize(self, max_chunks: int) -> int:
+        if self._failed or self.throughput is None:
+            # Start with the minimum chunk size and work up from there in case the last attempt
+            # failed due to connectivity errors or ... whatever.
+            return 1
+        return self.nextSize(max_chunks)
+
+    def nextSize(self, max_chunks: int) -> int:
+        if self.throughput is None:
+            return 1
+        # Small tolerances keep rounding errors in the estimates from changing the chunk size
+        chunks = math.floor(self.throughput * self.target_seconds / BASE_CHUNK_SIZE + 1e-6)
+        latency = self.latency or 0
+        if latency > 0:
+            # The smallest chunk whose transfer time makes latency at most overhead_target of the request
+            minimum = self.throughput * latency * (1 - self.overhead_target) / self.overhead_target
+            chunks = max(chunks, math.ceil(minimum / BASE_CHUNK_SIZE - 1e-6))
+        return max(min(chunks, max_chunks), 1)
+
+    def _smooth(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.smoothing * (sample - current)
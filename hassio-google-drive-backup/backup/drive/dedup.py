@@ -0,0 +1,220 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+from functools import partial
+from typing import Any, Dict, List
+
+from injector import inject, singleton
+
+from ..exceptions import LogicError, ProtocolError, ensureKey
+from ..logger import getLogger
+from ..model.backups import PROP_DEDUP_BLOB, PROP_DEDUP_SIZE, PROP_SHA256
+from ..time import Time
+from ..util import CompositeStream, RangeStream, StreamSegment, TarSegment, scanTarLayout
+from .driverequests import DriveRequests
+
+logger = getLogger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_MIME_TYPE = "application/json"
+ARCHIVE_MIME_TYPE = "application/octet-stream"
+ARCHIVE_DESCRIPTION = "Part of one or more Home Assistant backups uploaded by Home Assistant Google Drive Backup. Deleting it will make those backups impossible to restore."
+MANIFEST_KEY_TEXT = "deduplicated backup manifest"
+
+# Files in a backup smaller than this get kept in the manifest rather than stored on their own
+MINIMUM_DEDUP_SIZE = 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@singleton
+class Deduplicator():
+    """
+    Uploads backups to Google Drive so the archives inside them (one for each addon and folder) are each stored
+    once, in a file named by its SHA-256, and uploaded only if no earlier backup already stored the same
+    archive.  The backup itself gets stored as a manifest that lists the archives and holds everything else
+    in the tar (headers, backup.json, etc), which is enough to stream the original tar back out byte for byte.
+    """
+    @inject
+    def __init__(self, drive_requests: DriveRequests, time: Time):
+        self._drive = drive_requests
+        self._time = time
+
+        # Archives and manifests in the backup folder as of the last time it was listed, by SHA-256 and id.
+        self._archives: Dict[str, Dict[str, Any]] = {}
+        self._manifests: Dict[str, Dict[str, Any]] = {}
+        self._listed = False
+
+        # How many uploads in progress use each archive, which mustn't be cleaned up out from under them.
+        self._in_use: Dict[str, int] = {}
+
+        # Held while an archive gets uploaded, so another upload of a backup with the same archive waits for it
+        # and uses it instead of uploading it again.
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+
+    def update(self, items: List[Dict[str, Any]]):
+        """Updates the known archives and manifests from a listing of every file in the backup folder"""
+        self._archives = {}
+        self._manifests = {}
+        for item in items:
+            properties = item.get('appProperties') or {}
+            if PROP_DEDUP_SIZE in properties:
+                # A manifest in the trash can still be restored from it, so it keeps using its archives
+                self._manifests[item['id']] = item
+            elif item.get('trashed', False):
+                continue
+            elif PROP_DEDUP_BLOB in properties:
+                self._archives[properties[PROP_DEDUP_BLOB]] = item
+        self._listed = True
+
+    async def save(self, source, metadata: Dict[str, Any], mime_type: str):
+        """
+        Uploads a backup, yielding progress like DriveRequests.create and then the manifest's Drive item.  Files
+        that aren't tars or don't have any archives worth splitting out get uploaded whole.
+        """
+        layout = await scanTarLayout(source, MINIMUM_DEDUP_SIZE)
+        if layout is None or not any(segment.isFile() for segment in layout):
+            logger.info("Backup doesn't have any archives to deduplicate, so it will be uploaded as a single file")
+            source.position(0)
+            async for progress in self._drive.create(source, metadata, mime_type):
+                yield progress
+            return
+
+        hashes = {}
+        for segment in layout:
+            if segment.isFile():
+                hashes[segment.start] = await self._hash(source, segment)
+        for sha in hashes.values():
+            self._in_use[sha] = self._in_use.get(sha, 0) + 1
+            self._upload_locks.setdefault(sha, asyncio.Lock())
+        try:
+            missing = [segment for segment in layout if segment.isFile() and hashes[segment.start] not in self._archives]
+            to_upload = sum(segment.size for segment in missing)
+            logger.info("Uploading {0} of the backup's {1} archives, the rest are already in Google Drive".format(
+                len(missing), len(hashes)))
+
+            uploaded = 0
+            manifest = []
+            for segment in layout:
+                if not segment.isFile():
+                    source.position(segment.start)
+                    data = (await source.read(segment.size)).getvalue()
+                    manifest.append({'data': base64.b64encode(data).decode()})
+                    continue
+                sha = hashes[segment.start]
+                async with self._upload_locks[sha]:
+                    if sha not in self._archives:
+                        async for progress in self._uploadArchive(source, segment, sha, metadata['parents']):
+                            if isinstance(progress, float):
+                                yield (uploaded + progress * segment.size) / (to_upload + 1)
+                            else:
+                                self._archives[sha] = progress
+                        uploaded += segment.size
+                manifest.append({'sha256': sha, 'size': segment.size, 'id': self._archives[sha]['id']})
+
+            data = json.dumps({'version': MANIFEST_VERSION, 'segments': manifest}).encode()
+            stream = CompositeStream([StreamSegment(len(data), data=data)], self._time)
+            async for progress in self._drive.create(stream, self._manifestMetadata(metadata, source.size()), MANIFEST_MIME_TYPE):
+                if not isinstance(progress, float):
+                    self._manifests[progress['id']] = progress
+                    yield progress
+        finally:
+            for sha in hashes.values():
+                self._in_use[sha] -= 1
+                if self._in_use[sha] <= 0:
+                    del self._in_use[sha]
+                    del self._upload_locks[sha]
+
+    async def read(self, manifest_id: str, manifest_size: int) -> CompositeStream:
+        """Returns a stream of the original tar file a manifest describes"""
+        manifest = await self._readManifest(manifest_id, manifest_size)
+        segments = []
+        for segment in ensureKey('segments', manifest, MANIFEST_KEY_TEXT):
+            if 'data' in segment:
+                data = base64.b64decode(segment['data'])
+                segments.append(StreamSegment(len(data), data=data))
+            else:
+                size = ensureKey('size', segment, MANIFEST_KEY_TEXT)
+                segments.append(StreamSegment(size, opener=partial(self._drive.download, ensureKey('id', segment, MANIFEST_KEY_TEXT), size, parallel=True)))
+        return CompositeStream(segments, self._time)
+
+    async def collectGarbage(self, deleted_ids: List[str]):
+        """
+        Deletes archives that aren't used by any manifest anymore, after the manifests with deleted_ids were deleted.
+        Every remaining manifest gets downloaded to find out, so deleting several backups should collect once at the end.
+        """
+        for deleted_id in deleted_ids:
+            self._manifests.pop(deleted_id, None)
+        if not self._listed:
+            # Without a listing there's no way to know which archives are still needed
+            return
+        used = set(self._in_use.keys())
+        for manifest_item in list(self._manifests.values()):
+            try:
+                manifest = await self._readManifest(manifest_item['id'], int(ensureKey('size', manifest_item, MANIFEST_KEY_TEXT)))
+            except Exception as e:
+                logger.warning("Unable to read the manifest '{0}', so unused archives won't be cleaned up: {1}".format(
+                    manifest_item.get('name'), logger.formatException(e)))
+                return
+            for segment in manifest.get('segments', []):
+                if 'sha256' in segment:
+                    used.add(segment['sha256'])
+        unused = [(sha, item) for sha, item in self._archives.items() if sha not in used]
+        for sha, item in unused:
+            # Forgetting them first keeps a collection running at the same time from deleting them again
+            logger.info("Deleting archive '{0}' from Google Drive since no backups use it anymore".format(item.get('name')))
+            del self._archives[sha]
+        results = await asyncio.gather(*[self._drive.delete(item['id']) for sha, item in unused], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _uploadArchive(self, source, segment: TarSegment, sha: str, parents):
+        metadata = {
+            'name': "{0}-{1}".format(sha[:16], os.path.basename(segment.name)),
+            'parents': parents,
+            'description': ARCHIVE_DESCRIPTION,
+            'appProperties': {
+                PROP_DEDUP_BLOB: sha,
+            },
+        }
+        logger.info("Uploading archive '{0}' to Google Drive".format(segment.name))
+        async for progress in self._drive.create(RangeStream(source, segment.start, segment.size), metadata, ARCHIVE_MIME_TYPE):
+            if not isinstance(progress, float) and progress.get('appProperties', {}).get(PROP_SHA256, sha) != sha:
+                # The checksum computed while uploading doesn't match the one computed before, so the backup changed.
+                await self._drive.delete(progress['id'])
+                raise LogicError("The backup changed while it was being uploaded to Google Drive")
+            yield progress
+
+    async def _hash(self, source, segment: TarSegment) -> str:
+        sha = hashlib.sha256()
+        source.position(segment.start)
+        remaining = segment.size
+        loop = asyncio.get_event_loop()
+        while remaining > 0:
+            data = (await source.read(min(HASH_CHUNK_SIZE, remaining))).getbuffer()
+            if len(data) == 0:
+                raise LogicError("Backup ended before all of its archives could be read")
+            await loop.run_in_executor(None, sha.update, data)
+            remaining -= len(data)
+        return sha.hexdigest()
+
+    async def _readManifest(self, id: str, size: int) -> Dict[str, Any]:
+        stream = await self._drive.download(id, size)
+        async with stream:
+            data = (await stream.read(size)).getvalue()
+        manifest = json.loads(data)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ProtocolError('version', MANIFEST_KEY_TEXT, manifest)
+        return manifest
+
+    def _manifestMetadata(self, metadata: Dict[str, Any], size: int) -> Dict[str, Any]:
+        ret = dict(metadata)
+        ret['appProperties'] = dict(metadata.get('appProperties', {}))
+        ret['appProperties'][PROP_DEDUP_SIZE] = str(size)
+        name = ret.get('name', '')
+        if name.endswith(".tar"):
+            name = name[:-len(".tar")]
+        ret['name'] = name + ".json"
+        return ret
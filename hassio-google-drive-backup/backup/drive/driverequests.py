@@ -1,7 +1,12 @@
+import asyncio
+import hashlib
 import io
+import json
 import math
 import re
-from typing import Any, Dict, Optional, Union
+import uuid
+from random import Random
+from typing import Any, Dict, List, Optional, Tuple, Union
 from urllib.parse import urlencode
 from datetime import datetime, timedelta
 
@@ -9,18 +14,21 @@ from aiohttp import ClientSession, ClientTimeout, ClientResponse
 from aiohttp.client_exceptions import ClientResponseError, ServerTimeoutError
 from injector import inject, singleton
 
-from ..util import AsyncHttpGetter
+from ..util import AsyncHttpGetter, BufferPool, DataCache, MemoryViewPayload, ParallelRangeStream, ReadAheadStream, ResponseCache, StreamChecksum
 from ..config import Config, Setting
 from ..exceptions import (GoogleCredentialsExpired,
                           GoogleSessionError, LogicError,
-                          ProtocolError, ensureKey, KnownTransient, GoogleTimeoutError, GoogleUnexpectedError)
-from backup.util import Backoff, TokenBucket
+                          ProtocolError, ensureKey, KnownTransient, GoogleTimeoutError, GoogleUnexpectedError, GoogleRateLimitError,
+                          UploadChecksumMismatch)
+from backup.util import Backoff, TokenBucket, BandwidthGovernor, Flow
 from backup.file import JsonFileSaver
 from ..time import Time
 from ..logger import getLogger
+from ..model.backups import PROP_SHA256
 from backup.creds import Creds, Exchanger, DriveRequester
 from datetime import timezone
 from ..config.byteformatter import ByteFormatter
+from .chunksizer import ChunkSizer, BASE_CHUNK_SIZE, CHUNK_UPLOAD_TARGET_SECONDS  # noqa: F401
 
 logger = getLogger(__name__)
 
@@ -30,21 +38,38 @@ FOLDER_NAME = 'Home Assistant Backups'
 DRIVE_VERSION = "v3"
 DRIVE_SERVICE = "drive"
 
-SELECT_FIELDS = "id,name,appProperties,size,trashed,mimeType,modifiedTime,capabilities,parents,driveId"
+SELECT_FIELDS = "id,name,appProperties,size,trashed,mimeType,modifiedTime,capabilities,parents,driveId,md5Checksum"
 THUMBNAIL_MIME_TYPE = "image/png"
 QUERY_FIELDS = "nextPageToken,files(" + SELECT_FIELDS + ")"
 CREATE_FIELDS = SELECT_FIELDS
+# Just what's needed to check the backup folder is still usable
+FOLDER_FIELDS = "id,name,trashed,mimeType,capabilities,driveId"
+CHANGES_FIELDS = "nextPageToken,newStartPageToken,changes(fileId,removed,file(" + SELECT_FIELDS + "))"
 URL_FILES = "/drive/v3/files/"
 URL_ABOUT = "/drive/v3/about"
 URL_START_UPLOAD = "/upload/drive/v3/files/?uploadType=resumable&supportsAllDrives=true"
+URL_BATCH = "/batch/drive/v3"
+URL_CHANGES = "/drive/v3/changes"
+URL_CHANGES_START = "/drive/v3/changes/startPageToken"
 PAGE_SIZE = 100
 CHUNK_SIZE = 5 * 262144
 RANGE_RE = re.compile("^bytes=0-\\d+$")
+BOUNDARY_RE = re.compile("boundary=\"?([^\";]+)\"?")
 
-BASE_CHUNK_SIZE = 256 * 1024  # Google's api requires uploading chunks in multiples of 256kb
+# Limits on the metadata responses kept around to revalidate with their ETags.  Syncs happen every few hours, so
+# entries have to last longer than that to ever get used.
+RESPONSE_CACHE_BYTES = 1024 * 1024
+RESPONSE_CACHE_TTL = timedelta(hours=12)
 
-# During upload, chunks get sized to complete upload after 10s so we can give status updates on progress.
-CHUNK_UPLOAD_TARGET_SECONDS = 10
+# Access tokens get refreshed in the background once they're this close to expiring, plus a random amount up to
+# TOKEN_REFRESH_JITTER so a lot of installations don't all refresh at the same moment.
+TOKEN_REFRESH_AHEAD = timedelta(minutes=5)
+TOKEN_REFRESH_JITTER = timedelta(minutes=2)
+
+# Drive won't take more requests than this in one batch
+MAX_BATCH_SIZE = 100
+# Drive identifies the response to each request in a batch by the request's Content-ID with this in front
+BATCH_RESPONSE_ID_PREFIX = "response-"
 
 # don't attempt to resume a session with than this many times consistant failures, just in case something is broken on Google's
 # end so we don't retry the same broken session forever.  Because the addon eventually backs off to doing 1 attempt/hour, this will
@@ -75,21 +100,46 @@ OOB_CRED_CUTOFF = datetime(2022, 3, 16, tzinfo=timezone.utc)
 @singleton
 class DriveRequests():
     @inject
-    def __init__(self, config: Config, time: Time, drive: DriveRequester, session: ClientSession, exchanger: Exchanger, byte_formatter: ByteFormatter):
+    def __init__(self, config: Config, time: Time, drive: DriveRequester, session: ClientSession, exchanger: Exchanger, byte_formatter: ByteFormatter, data_cache: DataCache, governor: BandwidthGovernor):
         self.session = session
         self.config = config
         self.time = time
         self.drive = drive
         self.creds: Optional[Creds] = None
         self.exchanger: Exchanger = exchanger
+        self.data_cache = data_cache
+        self.governor = governor
 
         # Between attempts to upload, we keep track of the info needed to resume a resumable upload.
         self.last_attempt_metadata = None
+        self.last_attempt_fingerprint = None
         self.last_attempt_location = None
         self.last_attempt_count = 0
         self.last_attempt_start_time = None
         self.bytes_formatter = byte_formatter
+
+        # Chunks get read into these buffers before they're sent to Drive, and reused from one upload to the next.
+        self.buffer_pool: Optional[BufferPool] = None
+
+        # Remembers how fast uploads go, so each upload can pick a good chunk size from the start.
+        self.chunk_sizer = ChunkSizer()
+        self.upload_limiter: Optional[TokenBucket] = None
+
+        # Updates and deletes waiting to be sent to Drive together in a batch request, as
+        # (method, url, json, future) tuples.
+        self._batch_queue: List[Tuple[str, str, Optional[Dict[str, Any]], asyncio.Future]] = []
+        self._batch_task: Optional[asyncio.Task] = None
+
+        # Metadata responses and their ETags, keyed by url (which includes the fields asked for)
+        self.response_cache = ResponseCache(time, RESPONSE_CACHE_BYTES, RESPONSE_CACHE_TTL)
+
+        # The refresh of the access token in progress, which everyone who needs a new token waits on
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background_refresh: Optional[asyncio.Task] = None
+        self._refresh_ahead_failed: Optional[Creds] = None
+        self._refresh_ahead = TOKEN_REFRESH_AHEAD + TOKEN_REFRESH_JITTER * Random().random()
         self.tryLoadCredentials()
+        self._loadUploadSession()
 
     async def _getHeaders(self):
         return {
@@ -147,36 +197,76 @@ class DriveRequests():
 
     async def getToken(self, refresh=False):
         if self.creds and not self.creds.is_expired and not refresh:
+            if self.time.now() >= self.creds.expiration - self._refresh_ahead and self._refresh_task is None and self.creds is not self._refresh_ahead_failed \
+                    and (self._background_refresh is None or self._background_refresh.done()):
+                # The token is about to expire, so get a new one while this one can still be used.  A background
+                # refresh that was just started hasn't set _refresh_task yet, so it gets checked for separately.
+                self._background_refresh = asyncio.create_task(self._refreshInBackground(), name="Drive token refresh")
             return self.creds.access_token
 
-        # refresh the credentials
-        logger.debug("Requesting refreshed Google Drive credentials")
-        self.creds = await self.exchanger.refresh(self.creds)
-        return self.creds.access_token
+        # Callers that show up while a refresh is already in progress wait for it instead of starting another.
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh(), name="Drive token refresh")
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self) -> str:
+        try:
+            logger.debug("Requesting refreshed Google Drive credentials")
+            creds = self.creds
+            refreshed = await self.exchanger.refresh(creds)
+            if self.creds is creds:
+                # Don't replace credentials that got saved while the refresh was happening
+                self.creds = refreshed
+            return refreshed.access_token
+        finally:
+            self._refresh_task = None
+
+    async def _refreshInBackground(self):
+        creds = self.creds
+        try:
+            await self.getToken(refresh=True)
+        except Exception as e:
+            # The token is still good for a few minutes, and it'll get refreshed when it's needed if it expires,
+            # so don't keep trying to get a new one before then.
+            self._refresh_ahead_failed = creds
+            logger.debug("Unable to refresh Google Drive credentials ahead of time: " + str(e))
 
     async def refreshToken(self):
         await self.getToken(refresh=True)
 
-    async def get(self, id):
+    async def get(self, id, fields=SELECT_FIELDS):
         q = {
-            "fields": SELECT_FIELDS,
+            "fields": fields,
             "supportsAllDrives": "true"
         }
-        async with await self.retryRequest("GET", URL_FILES + id + "/?" + urlencode(q)) as response:
-            return await response.json()
-
-    async def download(self, id, size):
-        ret = AsyncHttpGetter(self.config.get(Setting.DRIVE_URL) + URL_FILES + id + "/?alt=media&supportsAllDrives=true",
-                              await self._getHeaders(),
-                              self.session,
-                              size=size,
-                              timeoutFactory=GoogleTimeoutError.factory,
-                              otherErrorFactory=GoogleUnexpectedError.factory,
-                              timeout=ClientTimeout(
-                                  sock_connect=self.config.get(Setting.DOWNLOAD_TIMEOUT_SECONDS),
-                                  sock_read=self.config.get(Setting.DOWNLOAD_TIMEOUT_SECONDS)),
-                              time=self.time)
-        return ret
+        return await self._getJson(URL_FILES + id + "/?" + urlencode(q))
+
+    async def download(self, id, size, parallel=False):
+        connections = self.config.get(Setting.DOWNLOAD_CONNECTIONS)
+        part_size = int(self.config.get(Setting.DOWNLOAD_PART_BYTES))
+        if parallel and connections > 1 and size > part_size:
+            return ParallelRangeStream(lambda start, end: self._downloadRange(id, start, end), size, self.time, connections, part_size)
+        return self._mediaGetter(id, await self._getHeaders(), size, read_ahead=int(self.config.get(Setting.DOWNLOAD_READ_AHEAD_BYTES)))
+
+    async def _downloadRange(self, id, start, end) -> bytes:
+        headers = await self._getHeaders()
+        headers['range'] = "bytes={0}-{1}".format(start, end - 1)
+        getter = self._mediaGetter(id, headers, end - start)
+        async with getter:
+            return (await getter.read(end - start)).getvalue()
+
+    def _mediaGetter(self, id, headers, size, read_ahead=0) -> AsyncHttpGetter:
+        return AsyncHttpGetter(self.config.get(Setting.DRIVE_URL) + URL_FILES + id + "/?alt=media&supportsAllDrives=true",
+                               headers,
+                               self.session,
+                               size=size,
+                               timeoutFactory=GoogleTimeoutError.factory,
+                               otherErrorFactory=GoogleUnexpectedError.factory,
+                               timeout=ClientTimeout(
+                                   sock_connect=self.config.get(Setting.DOWNLOAD_TIMEOUT_SECONDS),
+                                   sock_read=self.config.get(Setting.DOWNLOAD_TIMEOUT_SECONDS)),
+                               time=self.time,
+                               read_ahead=read_ahead)
 
     async def query(self, query):
         # SOMEDAY: Add a test for page size, test server support is needed too for continuation tokens
@@ -192,50 +282,178 @@ class DriveRequests():
             }
             if continuation:
                 q["pageToken"] = continuation
-            async with await self.retryRequest("GET", URL_FILES + "?" + urlencode(q)) as response:
+            data = await self._getJson(URL_FILES + "?" + urlencode(q))
+            for item in data['files']:
+                yield item
+            if "nextPageToken" not in data or len(data['nextPageToken']) <= 0:
+                break
+            else:
+                continuation = data['nextPageToken']
+
+    async def getChangesToken(self, drive_id=None) -> str:
+        """Gets a token for listing the changes made in Drive from now on"""
+        q = {"supportsAllDrives": "true"}
+        if drive_id:
+            q["driveId"] = drive_id
+        async with await self.retryRequest("GET", URL_CHANGES_START + "?" + urlencode(q)) as response:
+            return ensureKey("startPageToken", await response.json(), "Google Drive's changes token")
+
+    async def changes(self, token, drive_id=None) -> Tuple[List[Dict[str, Any]], str]:
+        """Lists every change made in Drive since the token was issued, along with the token to use next time"""
+        changes = []
+        while True:
+            q = {
+                "pageToken": token,
+                "fields": CHANGES_FIELDS,
+                "pageSize": self.config.get(Setting.GOOGLE_DRIVE_PAGE_SIZE),
+                "supportsAllDrives": "true",
+                "includeItemsFromAllDrives": "true"
+            }
+            if drive_id:
+                q["driveId"] = drive_id
+            async with await self.retryRequest("GET", URL_CHANGES + "?" + urlencode(q)) as response:
                 data = await response.json()
-                for item in data['files']:
-                    yield item
-                if "nextPageToken" not in data or len(data['nextPageToken']) <= 0:
-                    break
-                else:
-                    continuation = data['nextPageToken']
+            changes.extend(data.get('changes', []))
+            if 'newStartPageToken' in data:
+                return changes, data['newStartPageToken']
+            token = ensureKey('nextPageToken', data, "Google Drive's list of changes")
 
     async def update(self, id, update_metadata):
-        async with await self.retryRequest("PATCH", URL_FILES + id + "/?supportsAllDrives=true", json=update_metadata):
-            pass
+        await self._batched("PATCH", URL_FILES + id + "/?supportsAllDrives=true", update_metadata)
 
     async def delete(self, id):
-        async with await self.retryRequest("DELETE", URL_FILES + id + "/?supportsAllDrives=true"):
-            pass
+        await self._batched("DELETE", URL_FILES + id + "/?supportsAllDrives=true")
+
+    async def _batched(self, method, url, json=None):
+        """
+        Makes a request that doesn't need anything back from Drive.  Requests made at the same time (eg deleting
+        several backups with asyncio.gather) get sent together in one batch request instead of one at a time.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._batch_queue.append((method, url, json, future))
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_task = asyncio.create_task(self._sendBatches(), name="Drive batch requests")
+        await future
+
+    async def _sendBatches(self):
+        # Let anything else being requested at the same time get queued first
+        await asyncio.sleep(0)
+        while len(self._batch_queue) > 0:
+            batch = [item for item in self._batch_queue[:MAX_BATCH_SIZE] if not item[3].done()]
+            del self._batch_queue[:MAX_BATCH_SIZE]
+            try:
+                failed = batch if len(batch) <= 1 else await self._sendBatch(batch)
+            except Exception as e:
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+                continue
+            # Requests that failed in the batch get sent again on their own, which retries the transient errors
+            # and raises the same exceptions they would have if they had never been batched.
+            await asyncio.gather(*[self._sendOne(item) for item in failed])
+
+    async def _sendOne(self, item):
+        method, url, json, future = item
+        try:
+            async with await self.retryRequest(method, url, json=json):
+                pass
+            if not future.done():
+                future.set_result(None)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+    async def _sendBatch(self, batch) -> list:
+        """Sends requests to Drive in one multipart/mixed batch request, returning the ones that didn't succeed"""
+        boundary = "batch_" + uuid.uuid4().hex
+        body = ""
+        for index, (method, url, json_body, future) in enumerate(batch):
+            body += "--{0}\r\nContent-Type: application/http\r\nContent-ID: <item-{1}>\r\n\r\n".format(boundary, index)
+            body += "{0} {1} HTTP/1.1\r\n".format(method, url)
+            if json_body is not None:
+                body += "Content-Type: application/json; charset=UTF-8\r\n\r\n" + json.dumps(json_body) + "\r\n"
+            else:
+                body += "\r\n"
+        body += "--{0}--\r\n".format(boundary)
+
+        logger.debug("Sending {0} requests to Google Drive in one batch".format(len(batch)))
+        async with await self.retryRequest("POST", URL_BATCH, headers={"Content-Type": "multipart/mixed; boundary=" + boundary}, data=body.encode()) as response:
+            statuses = self._parseBatchResponse(response.headers.get("Content-Type", ""), await response.read())
+
+        failed = []
+        for index, item in enumerate(batch):
+            status = statuses.get("item-{0}".format(index))
+            if status is not None and status < 400:
+                if not item[3].done():
+                    item[3].set_result(None)
+            else:
+                failed.append(item)
+        return failed
+
+    def _parseBatchResponse(self, content_type: str, body: bytes) -> Dict[str, int]:
+        """Finds the http status Drive returned for each request in a batch, by the request's Content-ID"""
+        match = BOUNDARY_RE.search(content_type)
+        if match is None:
+            return {}
+        statuses = {}
+        for part in body.decode(errors="replace").replace("\r\n", "\n").split("--" + match.group(1)):
+            headers, _, response = part.strip("\n").partition("\n\n")
+            content_id = None
+            for line in headers.split("\n"):
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-id":
+                    content_id = value.strip().strip("<>")
+            status_line = response.split("\n", 1)[0].split(" ")
+            if content_id is None or len(status_line) < 2 or not status_line[1].isdigit():
+                continue
+            if content_id.startswith(BATCH_RESPONSE_ID_PREFIX):
+                content_id = content_id[len(BATCH_RESPONSE_ID_PREFIX):]
+            statuses[content_id] = int(status_line[1])
+        return statuses
 
     async def getAboutInfo(self):
         q = {"fields": 'storageQuota,user'}
-        async with await self.retryRequest("GET", URL_ABOUT + "?" + urlencode(q)) as resp:
-            return await resp.json()
+        return await self._getJson(URL_ABOUT + "?" + urlencode(q))
+
+    async def _getJson(self, url) -> Dict[str, Any]:
+        """
+        Gets json from Drive.  If the same url was requested before, the request includes the ETag of the last
+        response so Drive can answer with 304 (Not Modified) instead of sending the same thing again.
+        """
+        cached = self.response_cache.get(url)
+        headers = {} if cached is None else {"If-None-Match": cached[0]}
+        async with await self.retryRequest("GET", url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                self.response_cache.refresh(url)
+                return json.loads(cached[1])
+            body = await response.text()
+            etag = response.headers.get("ETag")
+        if etag:
+            self.response_cache.put(url, etag, body)
+        else:
+            self.response_cache.remove(url)
+        return json.loads(body)
 
     async def create(self, stream, metadata, mime_type):
         # Upload logic is complicated. See https://developers.google.com/drive/api/v3/manage-uploads#resumable
         total_size = stream.size()
         location = None
 
-        limiter: Union[TokenBucket, None] = None
-        if self.config.get(Setting.UPLOAD_LIMIT_BYTES_PER_SECOND) > 0:
-            # google requires a minimum 256kb upload chunk, so the limiter bucket capacity must be at least that to function.
-            speed_as_tokens = self.config.get(Setting.UPLOAD_LIMIT_BYTES_PER_SECOND) / BASE_CHUNK_SIZE
-            capacity = max(speed_as_tokens, 1)
-            limiter = TokenBucket(self.time, capacity, speed_as_tokens, 0)
-        if metadata == self.last_attempt_metadata and self.last_attempt_location is not None and self.last_attempt_count < RETRY_SESSION_ATTEMPTS and self.time.now() < self.last_attempt_start_time + UPLOAD_SESSION_EXPIRATION_DURATION:
+        limiter = self._getUploadLimiter()
+        if self._fingerprint(metadata) == self.last_attempt_fingerprint and self.last_attempt_location is not None and self.last_attempt_count < RETRY_SESSION_ATTEMPTS and self.time.now() < self.last_attempt_start_time + UPLOAD_SESSION_EXPIRATION_DURATION:
             logger.debug(
                 "Attempting to resume a previously failed upload where we left off")
             self.last_attempt_count += 1
+            self._saveUploadSession()
             # Attempt to resume from a partially completed upload.
             headers = {
                 "Content-Length": "0",
                 "Content-Range": "bytes */{0}".format(total_size)
             }
             try:
+                requestTime = self.time.now()
                 async with await self.retryRequest("PUT", self.last_attempt_location, headers=headers, patch_url=False) as initial:
+                    self.chunk_sizer.recordLatency((self.time.now() - requestTime).total_seconds())
                     if initial.status == 308:
                         # We can resume the upload, check where it left off
                         if 'Range' in initial.headers:
@@ -255,14 +473,12 @@ class DriveRequests():
                     # Drive doesn't recognize the resume token, so we'll just have to start over.
                     logger.debug("Drive upload session wasn't recognized, restarting upload from the beginning.")
                     location = None
-                    self.last_attempt_location = None
-                    self.last_attempt_metadata = None
+                    self._clearUploadSession()
                     raise GoogleUnexpectedError()
                 if e.status == 404:
                     logger.error("Drive upload session wasn't recognized (http 404), restarting upload from the beginning.")
                     location = None
-                    self.last_attempt_location = None
-                    self.last_attempt_metadata = None
+                    self._clearUploadSession()
                     raise GoogleUnexpectedError()
                 else:
                     raise
@@ -274,7 +490,9 @@ class DriveRequests():
                 "X-Upload-Content-Type": mime_type,
                 "X-Upload-Content-Length": str(total_size),
             }
+            requestTime = self.time.now()
             async with await self.retryRequest("POST", URL_START_UPLOAD, headers=headers, json=metadata) as initial:
+                self.chunk_sizer.recordLatency((self.time.now() - requestTime).total_seconds())
                 # Google returns a url in the header "Location", which is where subsequent requests to upload
                 # the backup's bytes should be sent.  Logic below handles uploading the file bytes in chunks.
                 location = ensureKey(
@@ -284,14 +502,35 @@ class DriveRequests():
 
         # Keep track of the location in case the upload fails and we want to resume where we left off.
         # "metadata" is a durable fingerprint that uniquely identifies a backup, so we can use it to identify a
-        # resumable partial upload in future retrys.
+        # resumable partial upload in future retrys.  Its also saved to disk so an upload can be resumed after
+        # the addon restarts.
         self.last_attempt_location = location
         self.last_attempt_metadata = metadata
+        self.last_attempt_fingerprint = self._fingerprint(metadata)
         self.last_attempt_start_time = self.time.now()
+        self._saveUploadSession()
+
+        # Read the next chunk from the source while the current one is being sent to Drive, so the two
+        # network legs overlap instead of taking turns.
+        reader = ReadAheadStream(stream, self._getMaxChunkSize() * BASE_CHUNK_SIZE)
+        pool = self._getBufferPool()
+        buffer = await pool.acquire()
 
-        # Always start with the minimum chunk size and work up from there in case the last attempt
-        # failed due to connectivity errors or ... whatever.
-        current_chunk_size = 1
+        # The checksum is computed from the chunks as they're sent, so it only covers the whole file when the upload
+        # started from the beginning.
+        checksum = StreamChecksum()
+        try:
+            async for progress in self._uploadChunks(reader, memoryview(buffer), location, total_size, limiter, checksum):
+                yield progress
+        except Exception:
+            self.chunk_sizer.recordFailure()
+            raise
+        finally:
+            pool.release(buffer)
+            await reader.close()
+
+    async def _uploadChunks(self, stream: ReadAheadStream, buffer: memoryview, location, total_size, limiter: Union[TokenBucket, None], checksum: StreamChecksum):
+        current_chunk_size = self.chunk_sizer.initialSize(self._getMaxChunkSize())
         while True:
             start = stream.position()
 
@@ -301,32 +540,42 @@ class DriveRequests():
                 if request != current_chunk_size:
                     # This can go over the speed cap slightly, not a big deal though
                     current_chunk_size = request
-            data = await stream.read(current_chunk_size * BASE_CHUNK_SIZE)
-            chunk_size = len(data.getbuffer())
+            chunk_size = await stream.readinto(buffer[:current_chunk_size * BASE_CHUNK_SIZE])
+            data = buffer[:chunk_size]
             if chunk_size == 0:
                 raise LogicError(
                     "Backup file stream ended prematurely while uploading to Google Drive")
+
+            # Wait for a turn on the network, which gets shared with restores and downloads
+            await self.governor.consume(Flow.UPLOAD, chunk_size)
             headers = {
                 "Content-Length": str(chunk_size),
                 "Content-Range": "bytes {0}-{1}/{2}".format(start, start + chunk_size - 1, total_size)
             }
             startTime = self.time.now()
             logger.debug("Sending {0} to Google Drive".format(self.bytes_formatter.format(chunk_size)))
+
+            # Hash the chunk on another thread while it's being sent.  The buffer can't be reused until that finishes.
+            hashing = asyncio.get_event_loop().run_in_executor(None, checksum.update, start, data)
             try:
                 async with await self.retryRequest("PUT", location, headers=headers, data=data, patch_url=False) as partial:
+                    await hashing
                     # Base the next chunk size on how long it took to send the last chunk.
-                    current_chunk_size = self._getNextChunkSize(
-                        current_chunk_size, (self.time.now() - startTime).total_seconds())
+                    self.chunk_sizer.recordChunk(chunk_size, (self.time.now() - startTime).total_seconds())
+                    current_chunk_size = self.chunk_sizer.nextSize(self._getMaxChunkSize())
 
                     # any time a chunk gets uploaded, reset the retry counter.  This lets very flaky connections
                     # complete eventually after enough retrying.
-                    self.last_attempt_count = 1
+                    if self.last_attempt_location == location and self.last_attempt_count != 1:
+                        self.last_attempt_count = 1
+                        self._saveUploadSession()
                     yield float(start + chunk_size) / float(total_size)
                     if partial.status == 200 or partial.status == 201:
                         # Upload completed, return the object json
-                        self.last_attempt_location = None
-                        self.last_attempt_metadata = None
-                        yield await self.get((await partial.json())['id'])
+                        self._clearUploadSession(location)
+                        await stream.close()
+                        item = await self.get((await partial.json())['id'])
+                        yield await self._verifyChecksum(item, checksum)
                         break
                     elif partial.status == 308:
                         # Upload partially complete, seek to the new requested position
@@ -343,26 +592,98 @@ class DriveRequests():
                 if math.floor(e.status / 100) == 4:
                     # clear the cached session location URI, since a 4XX error
                     # always means the upload session is no good anymore (AFAIK)
-                    self.last_attempt_location = None
-                    self.last_attempt_metadata = None
+                    self._clearUploadSession(location)
 
                 if e.status == 404:
                     raise GoogleSessionError()
                 else:
                     raise e
+            finally:
+                await hashing
+
+    async def _verifyChecksum(self, item, checksum: StreamChecksum):
+        if not checksum.valid():
+            logger.debug("Upload was resumed part way through, so its checksum can't be verified")
+            return item
+        if 'md5Checksum' in item and item['md5Checksum'] != checksum.md5():
+            logger.error("The backup uploaded to Google Drive had MD5 {0} but {1} was sent, so it will be deleted".format(
+                item['md5Checksum'], checksum.md5()))
+            await self.delete(item['id'])
+            raise UploadChecksumMismatch(checksum.md5(), item['md5Checksum'])
+
+        # Keep the SHA-256 with the file so it can be checked later without downloading it.  The upload already made it
+        # intact, so failing to save this shouldn't fail the upload.
+        properties = {PROP_SHA256: checksum.sha256()}
+        try:
+            await self.update(item['id'], {'appProperties': properties})
+            item.setdefault('appProperties', {}).update(properties)
+        except Exception as e:
+            logger.warning("Couldn't save the checksum of the uploaded backup in Google Drive, so it can't be verified later: " + logger.formatException(e))
+        return item
+
+    def _fingerprint(self, metadata):
+        # The metadata includes a thumbnail and is too big to keep on disk, so a hash of it is used instead.
+        return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+
+    def _loadUploadSession(self):
+        session = self.data_cache.uploadSession
+        if session is None:
+            return
+        try:
+            self.last_attempt_location = session['location']
+            self.last_attempt_fingerprint = session['fingerprint']
+            self.last_attempt_count = session['count']
+            self.last_attempt_start_time = self.time.parse(session['start_time'])
+            logger.debug("Loaded an unfinished upload session from a previous run")
+        except (KeyError, ValueError, TypeError):
+            logger.warning("Saved upload session was malformed, so it won't be resumed")
+            self._clearUploadSession()
+
+    def _saveUploadSession(self):
+        if self.last_attempt_location is None:
+            self.data_cache.uploadSession = None
+        else:
+            self.data_cache.uploadSession = {
+                'location': self.last_attempt_location,
+                'fingerprint': self.last_attempt_fingerprint,
+                'count': self.last_attempt_count,
+                'start_time': self.last_attempt_start_time.isoformat()
+            }
+        self.data_cache.saveIfDirty()
 
-    def _getNextChunkSize(self, last_chunk_size, last_chunk_seconds):
-        max = math.floor(self.config.get(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES) / BASE_CHUNK_SIZE)
-        if max < 1:
-            max = 1
-        if last_chunk_seconds <= 0:
-            return max
-        next_chunk = math.floor(CHUNK_UPLOAD_TARGET_SECONDS * last_chunk_size / last_chunk_seconds)
-        if next_chunk >= max:
-            return max
-        if next_chunk < 1:
-            return 1
-        return next_chunk
+    def _clearUploadSession(self, location=None):
+        if location is not None and location != self.last_attempt_location:
+            # Another upload started since this one, so the saved session belongs to it now.
+            return
+        self.last_attempt_location = None
+        self.last_attempt_metadata = None
+        self.last_attempt_fingerprint = None
+        self._saveUploadSession()
+
+    def _getBufferPool(self) -> BufferPool:
+        size = self._getMaxChunkSize() * BASE_CHUNK_SIZE
+        count = self.config.get(Setting.MAXIMUM_CONCURRENT_UPLOADS)
+        if self.buffer_pool is None or self.buffer_pool.buffer_size != size or self.buffer_pool.max_buffers != count:
+            # The settings changed, so the old buffers aren't useful anymore
+            self.buffer_pool = BufferPool(size, count)
+        return self.buffer_pool
+
+    def _getUploadLimiter(self) -> Optional[TokenBucket]:
+        # All uploads share one limiter, so uploading several backups at once doesn't go over the limit.  This is
+        # separate from the BandwidthGovernor's limit, which uploads also wait on afterward, so an upload goes at
+        # whichever of the two is lower.
+        limit = self.config.get(Setting.UPLOAD_LIMIT_BYTES_PER_SECOND)
+        if limit <= 0:
+            self.upload_limiter = None
+        elif self.upload_limiter is None or self.upload_limiter.fill_rate != limit / BASE_CHUNK_SIZE:
+            # google requires a minimum 256kb upload chunk, so the limiter bucket capacity must be at least that to function.
+            speed_as_tokens = limit / BASE_CHUNK_SIZE
+            capacity = max(speed_as_tokens, 1)
+            self.upload_limiter = TokenBucket(self.time, capacity, speed_as_tokens, 0)
+        return self.upload_limiter
+
+    def _getMaxChunkSize(self):
+        return max(math.floor(self.config.get(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES) / BASE_CHUNK_SIZE), 1)
 
     async def createFolder(self, metadata):
         async with await self.retryRequest("POST", URL_FILES + "?supportsAllDrives=true", json=metadata) as resp:
@@ -380,7 +701,10 @@ class DriveRequests():
                 logger.trace("Making Google Drive request: " + url)
             try:
                 data_to_use = data
-                if isinstance(data_to_use, io.BytesIO):
+                if isinstance(data_to_use, memoryview):
+                    # Send upload chunks straight from the buffer they were read into, without a copy.
+                    data_to_use = MemoryViewPayload(data_to_use)
+                elif isinstance(data_to_use, io.BytesIO):
                     # This is a pretty low-down dirty hack, but it works and lets us reuse the byte stream.
                     # aiohttp complains if you pass it a large byte object
                     data_to_use = io.BytesIO(data_to_use.getbuffer())
@@ -390,6 +714,15 @@ class DriveRequests():
                 # Get fresh credentials, then retry right away.
                 logger.debug("Google Drive credentials have expired.  We'll retry with new ones.")
                 await self.refreshToken()
+            except GoogleRateLimitError as e:
+                backoff.backoff(e)
+                if e.retry_after is None:
+                    logger.error("{0}: we'll retry in {1} seconds".format(e.message(), backoff.peek()))
+                    await self.time.sleepAsync(backoff.peek())
+                else:
+                    # DriveRequester holds back every request until Google said to try again, so waiting here too
+                    # would just be waiting twice.
+                    logger.error("{0}: we'll retry in {1} seconds".format(e.message(), e.retry_after))
             except KnownTransient as e:
                 backoff.backoff(e)
                 logger.error("{0}: we'll retry in {1} seconds".format(e.message(), backoff.peek()))
@@ -1,7 +1,8 @@
+import asyncio
 from datetime import datetime
 from io import IOBase
 from asyncio import Event
-from typing import Dict
+from typing import Any, Dict, List, Optional
 
 from aiohttp import ClientSession
 from aiohttp.client_exceptions import ClientResponseError
@@ -19,7 +20,9 @@ from ..exceptions import (BackupFolderInaccessible,
 from ..model.backups import (PROP_NOTE, PROP_PROTECTED, PROP_RETAINED, PROP_TYPE, PROP_VERSION)
 from ..time import Time
 from .driverequests import DriveRequests
+from .dedup import Deduplicator
 from .folderfinder import FolderFinder
+from .folderindex import FolderIndex
 from .thumbnail import THUMBNAIL_IMAGE
 from ..model import BackupDestination, DriveBackup, Backup
 from ..logger import getLogger
@@ -40,18 +43,24 @@ DRIVE_MAX_PROPERTY_LENGTH = 120
 class DriveSource(BackupDestination):
     # SOMEDAY: read backups all in one big batch request, then sort the folder and child addons from that.  Would need to add test verifying the "current" backup directory is used instead of the "latest"
     @inject
-    def __init__(self, config: Config, time: Time, drive_requests: DriveRequests, info: GlobalInfo, session: ClientSession, folderfinder: FolderFinder):
+    def __init__(self, config: Config, time: Time, drive_requests: DriveRequests, info: GlobalInfo, session: ClientSession, folderfinder: FolderFinder, dedup: Deduplicator, folder_index: FolderIndex):
         super().__init__()
         self.session = session
         self.config = config
         self.drivebackend: DriveRequests = drive_requests
         self.time = time
         self.folder_finder = folderfinder
+        self.dedup = dedup
+        self.folder_index = folder_index
         self._info = info
-        self._uploadedAtLeastOneChunk = False
+        # How many uploads in progress have sent at least one chunk to Drive
+        self._uploadsWithProgress = 0
         self._drive_info = None
         self._cred_trigger = Event()
 
+        # How long each part of the last get() took, and how much time running them at the same time saved
+        self.get_timing: Dict[str, float] = {}
+
     def saveCreds(self, creds: Creds) -> None:
         logger.info("Saving new Google Drive credentials")
         self.drivebackend.saveCredentials(creds)
@@ -109,7 +118,7 @@ class DriveSource(BackupDestination):
         return "google-drive"
 
     def isWorking(self):
-        return self._uploadedAtLeastOneChunk
+        return self._uploadsWithProgress > 0
 
     def detail(self):
         if self._drive_info and 'user' in self._drive_info and 'emailAddress' in self._drive_info['user']:
@@ -118,39 +127,81 @@ class DriveSource(BackupDestination):
             return super().detail()
 
     async def get(self, allow_retry=True) -> Dict[str, DriveBackup]:
-        parent = await self.getFolderId()
+        # Drive's storage info doesn't depend on the backup folder, so it gets requested while the folder is
+        # found and listed instead of before.
+        start = self.time.monotonic()
+        results = await asyncio.gather(self._timed(self._refreshDriveInfo()), self._timed(self._listBackups(allow_retry)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        (_, info_seconds), (backups, list_seconds) = results
+
+        total = self.time.monotonic() - start
+        self.get_timing = {
+            'info': info_seconds,
+            'list': list_seconds,
+            'total': total,
+            'saved': max(info_seconds + list_seconds - total, 0),
+        }
+        logger.debug("Listed backups in Google Drive in {0:.2f}s, {1:.2f}s faster than one request at a time".format(total, self.get_timing['saved']))
+        return backups
+
+    async def _timed(self, coroutine) -> Any:
+        start = self.time.monotonic()
+        result = await coroutine
+        return result, self.time.monotonic() - start
+
+    async def _refreshDriveInfo(self):
         try:
             self._drive_info = await self.drivebackend.getAboutInfo()
         except Exception as e:
             # This is just used to get the remaining space in Drive, which is a
             # nice to have.  Just log the error to debug if we can't get it
             logger.debug("Unable to retrieve Google Drive storage info: " + str(e))
+
+    async def _listBackups(self, allow_retry=True) -> Dict[str, DriveBackup]:
+        parent = await self.getFolderId()
         backups: Dict[str, DriveBackup] = {}
         try:
-            async for child in self.drivebackend.query("'{}' in parents".format(parent)):
+            children = await self.folder_index.list(parent, self.folder_finder.sharedDriveId())
+            for child in children:
                 properties = child.get('appProperties')
                 if properties and NECESSARY_PROP_KEY_DATE in properties and NECESSARY_PROP_KEY_SLUG in properties and not child['trashed']:
                     backup = DriveBackup(child)
                     backups[backup.slug()] = backup
+            self.dedup.update(children)
         except ClientResponseError as e:
             if e.status == 404:
                 # IIUC, 404 on create can only mean that the parent id isn't valid anymore.
+                self.folder_finder.deCache()
                 if not self.config.get(Setting.SPECIFY_BACKUP_FOLDER) and allow_retry:
-                    self.folder_finder.deCache()
                     await self.folder_finder.create()
-                    return await self.get(False)
+                    return await self._listBackups(False)
                 raise BackupFolderInaccessible(parent)
             raise e
         except GoogleDrivePermissionDenied:
             # This should always mean we lost permission on the backup folder, but at least it still exists.
+            self.folder_finder.deCache()
             if not self.config.get(Setting.SPECIFY_BACKUP_FOLDER) and allow_retry:
-                self.folder_finder.deCache()
                 await self.folder_finder.create()
-                return await self.get(False)
+                return await self._listBackups(False)
             raise BackupFolderInaccessible(parent)
         return backups
 
     async def delete(self, backup: Backup):
+        await self._collectGarbage([await self._delete(backup)])
+
+    async def deleteMany(self, backups: List[Backup]):
+        # Deleting them all at once lets the deletes go together in batch requests, and then unused archives only
+        # have to be looked for once.
+        results = await asyncio.gather(*[self._delete(backup) for backup in backups], return_exceptions=True)
+        await self._collectGarbage([result for result in results if isinstance(result, str)])
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _delete(self, backup: Backup) -> Optional[str]:
+        """Deletes a backup, returning its id if it was a deduplicated backup whose archives might not be needed anymore"""
         item = self._validateBackup(backup)
         if item.canDeleteDirectly():
             logger.info("Deleting '{}' From Google Drive".format(item.name()))
@@ -159,6 +210,20 @@ class DriveSource(BackupDestination):
             logger.info("Trashing '{}' in Google Drive".format(item.name()))
             await self.drivebackend.update(item.id(), {"trashed": True})
         backup.removeSource(self.name())
+        if item.deduplicated() and item.canDeleteDirectly():
+            # A trashed manifest can still be restored, so its archives have to stay around
+            return item.id()
+        return None
+
+    async def _collectGarbage(self, deleted_ids: List[Optional[str]]):
+        deleted_ids = [deleted_id for deleted_id in deleted_ids if deleted_id is not None]
+        if len(deleted_ids) == 0:
+            return
+        try:
+            await self.dedup.collectGarbage(deleted_ids)
+        except Exception as e:
+            # Unused archives will get cleaned up next time a backup gets deleted
+            logger.warning("Unable to clean up unused archives in Google Drive: " + logger.formatException(e))
 
     async def save(self, backup: Backup, source: AsyncHttpGetter) -> DriveBackup:
         retain = backup.getOptions() and backup.getOptions().retain_sources.get(self.name(), False)
@@ -194,7 +259,12 @@ class DriveSource(BackupDestination):
             file_metadata['appProperties'][PROP_NOTE] = self.truncateAppProperty(PROP_NOTE, backup.note())
         file_metadata['appProperties'][NECESSARY_PROP_KEY_NAME] = self.truncateAppProperty(NECESSARY_PROP_KEY_NAME, str(backup.name()))
 
+        if isinstance(source, AsyncHttpGetter):
+            # The upload reads ahead of what it sends on its own, and deduplicating seeks all over the backup, so
+            # the download's own read-ahead would just hold a second copy of the data or get thrown away.
+            await source.disableReadAhead()
         async with source:
+            uploadedAtLeastOneChunk = False
             try:
                 logger.info("Uploading '{}' to Google Drive".format(
                     backup.name()))
@@ -202,8 +272,14 @@ class DriveSource(BackupDestination):
                 self._info.upload(size)
                 backup.overrideStatus("Uploading {0}%", source)
                 backup.setUploadSource(self.title(), source)
-                async for progress in self.drivebackend.create(source, file_metadata, MIME_TYPE):
-                    self._uploadedAtLeastOneChunk = True
+                if self.config.get(Setting.DEDUPLICATE_UPLOADS):
+                    uploader = self.dedup.save(source, file_metadata, MIME_TYPE)
+                else:
+                    uploader = self.drivebackend.create(source, file_metadata, MIME_TYPE)
+                async for progress in uploader:
+                    if not uploadedAtLeastOneChunk:
+                        uploadedAtLeastOneChunk = True
+                        self._uploadsWithProgress += 1
                     if isinstance(progress, float):
                         logger.debug("Uploading {1} {0:.2f}%".format(
                             progress * 100, backup.name()))
@@ -214,11 +290,13 @@ class DriveSource(BackupDestination):
             except ClientResponseError as e:
                 if e.status == 404:
                     # IIUC, 404 on create can only mean that the parent id isn't valid anymore.
+                    self.folder_finder.deCache()
                     raise BackupFolderInaccessible(parent_id)
                 raise e
             except GoogleDrivePermissionDenied:
                 # This should always mean we lost permission on the backup folder, since we could have only just
                 # created the backup item on this request.
+                self.folder_finder.deCache()
                 raise BackupFolderInaccessible(parent_id)
             except DriveQuotaExceeded as space_error:
                 try:
@@ -235,7 +313,8 @@ class DriveSource(BackupDestination):
                 raise
             finally:
                 backup.clearUploadSource()
-                self._uploadedAtLeastOneChunk = False
+                if uploadedAtLeastOneChunk:
+                    self._uploadsWithProgress -= 1
                 backup.clearStatus()
 
     def truncateAppProperty(self, key: str, value: str):
@@ -254,7 +333,9 @@ class DriveSource(BackupDestination):
 
     async def read(self, backup: Backup) -> IOBase:
         item = self._validateBackup(backup)
-        return await self.drivebackend.download(item.id(), item.size())
+        if item.deduplicated():
+            return await self.dedup.read(item.id(), item.fileSize())
+        return await self.drivebackend.download(item.id(), item.size(), parallel=True)
 
     async def retain(self, backup: Backup, retain: bool) -> None:
         item = self._validateBackup(backup)
@@ -1,5 +1,5 @@
 from datetime import timedelta
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from backup.file import File
 from aiohttp.client_exceptions import ClientResponseError
 from injector import inject, singleton
@@ -8,7 +8,8 @@ from ..config import Config, Setting
 from ..exceptions import (BackupFolderInaccessible, BackupFolderMissingError,
                           GoogleDrivePermissionDenied, LogInToGoogleDriveError)
 from ..time import Time
-from .driverequests import DriveRequests
+from ..util import DataCache
+from .driverequests import DriveRequests, FOLDER_FIELDS
 from ..logger import getLogger
 
 logger = getLogger(__name__)
@@ -20,11 +21,17 @@ FOLDER_CACHE_SECONDS = 60 * 31  # 31 minutes
 
 @singleton
 class FolderFinder():
+    """
+    Finds (or creates) the folder backups get stored in.  Once the folder has been verified it isn't checked
+    again for FOLDER_CACHE_SECONDS, and that's remembered in the data cache so restarting the addon doesn't
+    mean checking it again right away.
+    """
     @inject
-    def __init__(self, config: Config, time: Time, drive_requests: DriveRequests):
+    def __init__(self, config: Config, time: Time, drive_requests: DriveRequests, data_cache: DataCache):
         self.config = config
         self.drivebackend: DriveRequests = drive_requests
         self.time = time
+        self._data_cache = data_cache
 
         # The cached folder id
         self._folderId = None
@@ -51,6 +58,11 @@ class FolderFinder():
     def currentIsSharedDrive(self):
         return self._folder_details and self._isSharedDrive(self._folder_details)
 
+    def sharedDriveId(self) -> Optional[str]:
+        if self.currentIsSharedDrive():
+            return self._folder_details.get("driveId")
+        return None
+
     async def get(self):
         if self._existing_folder and self._use_existing is not None:
             if self._use_existing:
@@ -59,6 +71,7 @@ class FolderFinder():
                 await self.create()
             self._use_existing = None
         if not self._folder_queryied_last or self._folder_queryied_last + timedelta(seconds=FOLDER_CACHE_SECONDS) < self.time.now():
+            self._folder_queryied_last = None
             try:
                 self._folderId = await self._readFolderId()
             except (BackupFolderMissingError, BackupFolderInaccessible):
@@ -72,7 +85,8 @@ class FolderFinder():
                         await self.create()
                 else:
                     raise
-            self._folder_queryied_last = self.time.now()
+            if self._folder_queryied_last is None:
+                self._folder_queryied_last = self.time.now()
         return self._folderId
 
     def getExisting(self):
@@ -89,6 +103,7 @@ class FolderFinder():
         self._folderId = folder
         self._folder_queryied_last = self.time.now()
         self._existing_folder = None
+        self._remember(folder)
 
     def reset(self):
         if File.exists(self.config.get(Setting.FOLDER_FILE_PATH)):
@@ -96,13 +111,16 @@ class FolderFinder():
         self._folderId = None
         self._folder_queryied_last = None
         self._existing_folder = None
+        self._forget()
 
     def getCachedFolder(self):
         return self._folderId
 
     def deCache(self):
+        """Makes the next call to get() check the folder again, eg because Drive said it can't be found"""
         self._folderId = None
         self._folder_queryied_last = None
+        self._forget()
 
     async def _readFolderId(self) -> str:
         # First, check if we cached the drive folder
@@ -110,11 +128,30 @@ class FolderFinder():
             raise BackupFolderMissingError()
         else:
             folder_id: str = File.read(self.config.get(Setting.FOLDER_FILE_PATH)).strip()
+            remembered = self._data_cache.driveFolder
+            if remembered is not None and remembered.get('id') == folder_id and self.time.now() < self.time.parse(remembered['verified']) + timedelta(seconds=FOLDER_CACHE_SECONDS):
+                # Checked recently enough, probably before the addon restarted
+                self._folder_details = remembered.get('details')
+                self._folder_queryied_last = self.time.parse(remembered['verified'])
+                return folder_id
             if await self._verify(folder_id):
+                self._remember(folder_id)
                 return folder_id
             else:
                 raise BackupFolderInaccessible(folder_id)
 
+    def _remember(self, folder_id: str):
+        self._data_cache.driveFolder = {
+            'id': folder_id,
+            'details': self._folder_details,
+            'verified': self.time.now().isoformat(),
+        }
+        self._data_cache.saveIfDirty()
+
+    def _forget(self):
+        self._data_cache.driveFolder = None
+        self._data_cache.saveIfDirty()
+
     async def _search(self) -> str:
         folders = []
 
@@ -151,7 +188,9 @@ class FolderFinder():
             return True
         # Query drive for the folder to make sure it still exists and we have the right permission on it.
         try:
-            folder = await self.drivebackend.get(id)
+            # Only ask for what's needed to check the folder, which Drive can answer with 304 (Not Modified)
+            # when it hasn't changed since the last check.
+            folder = await self.drivebackend.get(id, FOLDER_FIELDS)
             if not self._isValidFolder(folder):
                 logger.info("Provided backup folder {0} is invalid".format(id))
                 return False
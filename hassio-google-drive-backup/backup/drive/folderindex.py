@@ -0,0 +1,90 @@
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from aiohttp.client_exceptions import ClientResponseError
+from injector import inject, singleton
+
+from ..logger import getLogger
+from ..time import Time
+from ..util import DataCache
+from .driverequests import DriveRequests
+
+logger = getLogger(__name__)
+
+# Drive responds with one of these when a changes token is too old or otherwise can't be used anymore
+REJECTED_TOKEN_STATUSES = [400, 404, 410]
+
+# The folder gets listed in full at least this often, in case some change never made it into the changes feed.
+FULL_LISTING_INTERVAL = timedelta(days=1)
+
+
+@singleton
+class FolderIndex():
+    """
+    Lists the files in the backup folder.  The first listing queries for everything in the folder, and after
+    that Drive's changes API gets asked what changed since, which takes one request no matter how many
+    backups are kept.  The files and where the changes left off are kept in the data cache, so restarting the
+    addon doesn't mean listing everything again.
+    """
+    @inject
+    def __init__(self, drive_requests: DriveRequests, data_cache: DataCache, time: Time):
+        self._drive = drive_requests
+        self._data_cache = data_cache
+        self._time = time
+
+    async def list(self, folder_id: str, drive_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Returns every file in the folder.  drive_id must be given if the folder is in a shared drive."""
+        state = self._data_cache.driveChanges
+        if state is not None and state.get('folder') == folder_id and state.get('drive') == drive_id and self._time.now() < self._time.parse(state['listed']) + FULL_LISTING_INTERVAL:
+            files = await self._applyChanges(state, folder_id, drive_id)
+            if files is not None:
+                return files
+        return await self._listAll(folder_id, drive_id)
+
+    def reset(self):
+        self._data_cache.driveChanges = None
+        self._data_cache.saveIfDirty()
+
+    async def _listAll(self, folder_id: str, drive_id: Optional[str]) -> List[Dict[str, Any]]:
+        # Get the token first, so anything that changes while the folder is being listed still shows up next time
+        token = await self._drive.getChangesToken(drive_id)
+        files = []
+        async for item in self._drive.query("'{}' in parents".format(folder_id)):
+            files.append(item)
+        self._save(folder_id, drive_id, token, {item['id']: item for item in files}, self._time.now().isoformat())
+        return files
+
+    async def _applyChanges(self, state, folder_id: str, drive_id: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        try:
+            changes, token = await self._drive.changes(state['token'], drive_id)
+        except ClientResponseError as e:
+            if e.status in REJECTED_TOKEN_STATUSES:
+                logger.info("Google Drive didn't accept the token for its list of changes, so the backup folder will be listed again")
+                return None
+            raise
+
+        files = dict(state['files'])
+        for change in changes:
+            id = change.get('fileId')
+            file = change.get('file')
+            if id == folder_id:
+                if change.get('removed', False) or file is None or file.get('trashed', False):
+                    # The folder is gone or can't be seen anymore, which listing it will find out and deal with
+                    return None
+                continue
+            if change.get('removed', False) or file is None or folder_id not in file.get('parents', []):
+                files.pop(id, None)
+            else:
+                files[id] = file
+        self._save(folder_id, drive_id, token, files, state['listed'])
+        return list(files.values())
+
+    def _save(self, folder_id: str, drive_id: Optional[str], token: str, files: Dict[str, Any], listed: str):
+        self._data_cache.driveChanges = {
+            'folder': folder_id,
+            'drive': drive_id,
+            'token': token,
+            'files': files,
+            'listed': listed,
+        }
+        self._data_cache.saveIfDirty()
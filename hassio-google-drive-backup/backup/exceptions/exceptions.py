@@ -11,7 +11,7 @@ from ..const import (DRIVE_FOLDER_URL_FORMAT, ERROR_BACKUP_FOLDER_INACCESSIBLE,
                      ERROR_NOT_UPLOADABLE, ERROR_PLEASE_WAIT, ERROR_PROTOCOL,
                      ERROR_BACKUP_IN_PROGRESS, ERROR_UPLOAD_FAILED, LOG_IN_TO_DRIVE,
                      SUPERVISOR_PERMISSION, ERROR_GOOGLE_UNEXPECTED, ERROR_SUPERVISOR_TIMEOUT, ERROR_SUPERVISOR_UNEXPECTED, ERROR_SUPERVISOR_FILE_SYSTEM,
-                     UNKONWN_NETWORK_STORAGE, INACTIVE_NETWORK_STORAGE)
+                     UNKONWN_NETWORK_STORAGE, INACTIVE_NETWORK_STORAGE, ERROR_UPLOAD_CHECKSUM)
 
 
 def ensureKey(key, target, name):
@@ -232,6 +232,10 @@ class GoogleTimeoutError(KnownError):
 
 
 class GoogleRateLimitError(KnownTransient):
+    def __init__(self, retry_after=None):
+        # Seconds Google said to wait before trying again, if it said
+        self.retry_after = retry_after
+
     def message(self):
         return "The addon has made too many requests to Google Drive, and will back off"
 
@@ -247,6 +251,24 @@ class GoogleSessionError(KnownError):
         return ERROR_GOOGLE_SESSION
 
 
+class UploadChecksumMismatch(KnownError):
+    def __init__(self, expected: str = None, actual: str = None):
+        self.expected = expected
+        self.actual = actual
+
+    def message(self):
+        return "The backup uploaded to Google Drive didn't match the one sent, so it was removed and will be uploaded again."
+
+    def code(self):
+        return ERROR_UPLOAD_CHECKSUM
+
+    def data(self):
+        return {
+            "expected": self.expected,
+            "actual": self.actual
+        }
+
+
 class HomeAssistantDeleteError(KnownError):
     def message(self):
         return "Home Assistant refused to delete the backup."
@@ -1,8 +1,10 @@
 # flake8: noqa
 from .hasource import HaSource, HABackup, PendingBackup, SOURCE_HA
 from .haupdater import HaUpdater
-from .harequests import HaRequests, EVENT_BACKUP_END, EVENT_BACKUP_START, VERSION_BACKUP_PATH
+from .harequests import HaRequests, EVENT_BACKUP_END, EVENT_BACKUP_START, VERSION_BACKUP_PATH, SUPERVISOR_EVENT
 from .backupname import BackupName, BACKUP_NAME_KEYS
 from .password import Password
 from .addon_stopper import AddonStopper
+from .restorespool import RestoreSpool
+from .eventlistener import EventListener
 
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Any, Dict
+
+from aiohttp import WSMsgType
+from injector import inject, singleton
+
+from ..config import Config, Setting
+from ..logger import getLogger
+from ..time import Time
+from ..util import Backoff
+from ..worker import Trigger, Worker
+from .harequests import HaRequests, SUPERVISOR_EVENT
+from .hasource import HaSource
+
+logger = getLogger(__name__)
+
+# Supervisor jobs that create, import or restore backups are all named like this
+BACKUP_JOB_PREFIX = "backup_manager"
+
+FIRST_RECONNECT_SECONDS = 10
+MAX_RECONNECT_SECONDS = 60 * 5  # 5 minutes
+
+
+@singleton
+class EventListener(Worker, Trigger):
+    """
+    Subscribes to the events Home Assistant sends over its websocket API, so backups the supervisor finishes
+    making get noticed right away instead of on the next sync.
+    """
+    @inject
+    def __init__(self, requests: HaRequests, source: HaSource, config: Config, time: Time):
+        super().__init__("Backup Event Listener", self.listen, time, self.getInterval)
+        self._requests = requests
+        self._source = source
+        self._config = config
+        self._backoff = Backoff(base=FIRST_RECONNECT_SECONDS, max=MAX_RECONNECT_SECONDS)
+        self._reconnect_seconds = FIRST_RECONNECT_SECONDS
+        self._changes_have_happened = False
+        self.noticed_change_signal = asyncio.Event()
+        self.connected_signal = asyncio.Event()
+
+    def name(self):
+        return "Backup Event Listener"
+
+    def getInterval(self):
+        return self._reconnect_seconds
+
+    async def start(self):
+        if not self._config.get(Setting.WATCH_BACKUP_EVENTS):
+            return
+        return await super().start()
+
+    async def listen(self):
+        try:
+            ws = await self._requests.connectEvents()
+        except Exception as e:
+            self._reconnect_seconds = self._backoff.backoff(e)
+            logger.debug("Couldn't connect to Home Assistant's websocket API, will try again in %d seconds: %s", self._reconnect_seconds, e)
+            return
+        try:
+            await ws.send_json({"id": 1, "type": "subscribe_events", "event_type": SUPERVISOR_EVENT})
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    break
+                message = msg.json()
+                if message.get("type") == "result" and message.get("id") == 1:
+                    if not message.get("success", False):
+                        logger.warning("Home Assistant refused to send backup events: %s", message.get("error"))
+                        break
+                    logger.debug("Listening for backup events from Home Assistant")
+                    self._backoff.reset()
+                    self.connected_signal.set()
+                elif self._isBackupEvent(message):
+                    logger.debug("Home Assistant says a backup job finished, we'll check for new backups")
+                    self._changes_have_happened = True
+                    self.noticed_change_signal.set()
+        except Exception as e:
+            logger.debug("Lost the connection to Home Assistant's websocket API: %s", e)
+        finally:
+            self.connected_signal.clear()
+            await ws.close()
+        # Home Assistant closes the connection when it restarts, so wait a bit before reconnecting
+        self._reconnect_seconds = self._backoff.backoff(None)
+
+    def _isBackupEvent(self, message: Dict[str, Any]) -> bool:
+        if message.get("type") != "event":
+            return False
+        event = message.get("event", {})
+        if event.get("event_type") != SUPERVISOR_EVENT:
+            return False
+        data = event.get("data", {})
+        if data.get("event") != "job":
+            return False
+        job = data.get("data", {})
+        return str(job.get("name", "")).startswith(BACKUP_JOB_PREFIX) and job.get("done", False) is True
+
+    async def check(self):
+        if self._changes_have_happened:
+            self._changes_have_happened = False
+            await self._source.get()
+            if self._source.query_had_changes:
+                self.trigger()
+        return await super().check()
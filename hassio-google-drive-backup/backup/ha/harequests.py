@@ -1,12 +1,16 @@
+import asyncio
+import json
 import os
-from typing import Any, Dict
+import tarfile
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
 
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientSession, ClientTimeout, ClientWebSocketResponse
 from aiohttp.client_exceptions import ClientResponseError, ClientConnectorError
 from injector import inject
 from asyncio.exceptions import TimeoutError
 
-from ..util import AsyncHttpGetter
+from ..util import AsyncHttpGetter, LocalFileStream
 from ..config import Config, Setting, Version
 from ..exceptions import HomeAssistantDeleteError, SupervisorConnectionError, SupervisorPermissionError, SupervisorTimeoutError, SupervisorUnexpectedError
 from ..model import HABackup
@@ -24,9 +28,20 @@ NOTIFICATION_ID = "backup_broken"
 EVENT_BACKUP_START = "backup_started"
 EVENT_BACKUP_END = "backup_ended"
 
+# Event the supervisor fires in Home Assistant whenever one of its jobs (like creating or restoring a backup) changes
+SUPERVISOR_EVENT = "supervisor_event"
+
 VERSION_BACKUP_PATH = Version.parse("2021.8")
 VERSION_MOUNT_INFO = Version.parse("2023.6")
 
+# What a backup in the supervisor's list of backups needs to have for it to be used without asking for the backup's
+# details.  Most supervisor versions only list a summary of each backup, without the Home Assistant version and with
+# just the slugs of the included addons.
+LISTED_DETAIL_KEYS = ['slug', 'name', 'date', 'size', 'type', 'protected', 'homeassistant', 'addons', 'folders']
+
+# The most backups whose details get remembered, both in memory and in the data cache
+MAX_CACHED_BACKUPS = 200
+
 
 def supervisor_call(func):
     async def wrap_and_call(*args, **kwargs):
@@ -50,11 +65,19 @@ class HaRequests():
     @inject
     def __init__(self, config: Config, session: ClientSession, time: Time, data_cache: DataCache):
         self.config: Config = config
-        self.cache = {}
+
+        # Details of backups by slug, least recently used first.  These are saved in the data cache along with the
+        # supervisor version they came from, so they don't all have to be requested again after a restart.
+        self.cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._cache_version = None
         self.session = session
         self._time = time
         self._data_cache = data_cache
 
+        # The slug of each tar file seen in the backup directory, by path, along with the file's modification time and
+        # size so it only gets read again if the file changes.
+        self._local_backups: Dict[str, Tuple[float, int, Optional[str]]] = {}
+
         # default the supervisor versio to using the "most featured" when it can't be parsed.
         self._super_version = VERSION_MOUNT_INFO
 
@@ -97,8 +120,7 @@ class HaRequests():
 
     @supervisor_call
     async def delete(self, slug) -> None:
-        if slug in self.cache:
-            del self.cache[slug]
+        self._uncache([slug])
         try:
             if self.supportsBackupPaths():
                 delete_url = self.getSupervisorURL().with_path("{1}/{0}".format(slug, self._getBackupPath()))
@@ -122,17 +144,83 @@ class HaRequests():
         await self._postHassioData(url, {})
 
     @supervisor_call
-    async def backup(self, slug):
-        if slug in self.cache:
-            info = self.cache[slug]
-        else:
-            info = await self._getHassioData(self.getSupervisorURL().with_path("{1}/{0}/info".format(slug, self._getBackupPath())))
-            self.cache[slug] = info
+    async def backup(self, slug, listed: Optional[Dict[str, Any]] = None):
+        """
+        Gets a backup's details.  listed is what the supervisor's list of backups had for it, which gets used
+        instead of requesting the details when it has everything they would.
+        """
+        info = self._cached(slug)
+        if info is None:
+            if listed is not None and all(key in listed for key in LISTED_DETAIL_KEYS) and self._hasAddonDetails(listed):
+                info = listed
+            else:
+                info = await self._getHassioData(self.getSupervisorURL().with_path("{1}/{0}/info".format(slug, self._getBackupPath())))
+            self._cache(slug, info)
         return HABackup(info, self._data_cache, self.config, self.config.isRetained(slug))
 
+    def _hasAddonDetails(self, listed: Dict[str, Any]) -> bool:
+        # The details list each addon as an object with its name and version, a summary just has their slugs
+        return all(isinstance(addon, dict) for addon in listed['addons'])
+
     @supervisor_call
     async def backups(self):
-        return await self._getHassioData(self.getSupervisorURL().with_path(self._getBackupPath()))
+        query = await self._getHassioData(self.getSupervisorURL().with_path(self._getBackupPath()))
+
+        # Forget about backups that aren't there anymore
+        listed = set()
+        for key in [NECESSARY_OLD_BACKUP_PLURAL_NAME, 'backups']:
+            for backup in query.get(key, []):
+                listed.add(backup.get('slug'))
+        self._uncache([slug for slug in self._cachedSlugs() if slug not in listed])
+        return query
+
+    def _checkCacheVersion(self):
+        # Details from a different supervisor version might not look the same, so they only get used by the same one.
+        version = str(self._super_version)
+        if self._cache_version == version:
+            return
+        self._cache_version = version
+        self.cache.clear()
+        saved = self._data_cache.haBackupInfo
+        if saved is not None and saved.get('supervisor') == version:
+            self.cache.update(saved.get('backups', {}))
+            while len(self.cache) > MAX_CACHED_BACKUPS:
+                self.cache.popitem(last=False)
+
+    def _cachedSlugs(self):
+        self._checkCacheVersion()
+        return list(self.cache.keys())
+
+    def _cached(self, slug) -> Optional[Dict[str, Any]]:
+        self._checkCacheVersion()
+        info = self.cache.get(slug)
+        if info is not None:
+            self.cache.move_to_end(slug)
+        return info
+
+    def _cache(self, slug, info: Dict[str, Any]):
+        self._checkCacheVersion()
+        self.cache[slug] = info
+        self.cache.move_to_end(slug)
+        while len(self.cache) > MAX_CACHED_BACKUPS:
+            self.cache.popitem(last=False)
+        self._saveCache()
+
+    def _uncache(self, slugs):
+        self._checkCacheVersion()
+        removed = False
+        for slug in slugs:
+            if self.cache.pop(slug, None) is not None:
+                removed = True
+        if removed:
+            self._saveCache()
+
+    def _saveCache(self):
+        # This just marks the data cache as changed, it gets written at the end of the sync
+        self._data_cache.haBackupInfo = {
+            'supervisor': self._cache_version,
+            'backups': dict(self.cache),
+        }
 
     @supervisor_call
     async def haInfo(self):
@@ -193,8 +281,64 @@ class HaRequests():
         else:
             await self._postHassioData(url, {})
 
+    async def localBackupPath(self, slug) -> Optional[str]:
+        """
+        Returns the path to the backup's tar file if the supervisor stored it in the backup directory
+        the add-on has mapped, otherwise None.
+        """
+        # Finding it can mean opening every tar in the directory, so keep that off the event loop
+        return await asyncio.get_event_loop().run_in_executor(None, self._findLocalBackup, slug)
+
+    def _findLocalBackup(self, slug) -> Optional[str]:
+        directory = self.config.get(Setting.BACKUP_DIRECTORY_PATH)
+        path = os.path.join(directory, "{0}.tar".format(slug))
+        if os.path.isfile(path):
+            return path
+
+        # Newer supervisors name the file after the backup instead of its slug, so look for the tar that has it
+        logger.debug("Backup {0} isn't at {1}, looking for it in the backup directory".format(slug, path))
+        found = None
+        seen = {}
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        for name in names:
+            candidate = os.path.join(directory, name)
+            if not name.endswith(".tar") or not os.path.isfile(candidate):
+                continue
+            stat = os.stat(candidate)
+            known = self._local_backups.get(candidate)
+            if known is not None and known[0] == stat.st_mtime and known[1] == stat.st_size:
+                seen[candidate] = known
+            else:
+                seen[candidate] = (stat.st_mtime, stat.st_size, self._readBackupSlug(candidate))
+            if seen[candidate][2] == slug:
+                found = candidate
+        self._local_backups = seen
+        if found is None:
+            logger.debug("Backup {0} isn't in the backup directory, so it will be downloaded from the supervisor".format(slug))
+        return found
+
+    def _readBackupSlug(self, path: str) -> Optional[str]:
+        try:
+            with tarfile.open(path, "r:") as tar:
+                # backup.json is normally the first file in the tar, so this rarely has to look further
+                for member in tar:
+                    if member.name in ["backup.json", "./backup.json", "snapshot.json", "./snapshot.json"]:
+                        with tar.extractfile(member) as f:
+                            return json.load(f).get("slug")
+        except Exception as e:
+            logger.debug("Couldn't read the backup info from {0}: {1}".format(path, e))
+        return None
+
     @supervisor_call
-    async def download(self, slug) -> AsyncHttpGetter:
+    async def download(self, slug) -> Union[AsyncHttpGetter, LocalFileStream]:
+        local_path = await self.localBackupPath(slug)
+        if local_path is not None:
+            # Reading from disk avoids a round trip through the supervisor's HTTP API
+            logger.debug("Reading backup {0} from {1}".format(slug, local_path))
+            return LocalFileStream(local_path, self._time)
         url = self.getSupervisorURL().with_path("{1}/{0}/download".format(slug, self._getBackupPath()))
         ret = AsyncHttpGetter(url,
                               self._getAuthHeaders(),
@@ -203,7 +347,8 @@ class HaRequests():
                               otherErrorFactory=SupervisorUnexpectedError.factory,
                               timeout=ClientTimeout(sock_connect=self.config.get(Setting.DOWNLOAD_TIMEOUT_SECONDS),
                                                     sock_read=self.config.get(Setting.DOWNLOAD_TIMEOUT_SECONDS)),
-                              time=self._time)
+                              time=self._time,
+                              read_ahead=int(self.config.get(Setting.DOWNLOAD_READ_AHEAD_BYTES)))
         return ret
 
     @supervisor_call
@@ -308,6 +453,26 @@ class HaRequests():
     async def _sendEvent(self, event_name: str, data: Dict[str, str]) -> None:
         await self._postHaData("events/" + event_name, data)
 
+    @supervisor_call
+    async def connectEvents(self) -> ClientWebSocketResponse:
+        """
+        Opens an authenticated connection to Home Assistant's websocket API through the supervisor, which is left to
+        the caller to subscribe to events on and close.
+        """
+        url = self.getSupervisorURL().with_path("core/websocket")
+        ws = await self.session.ws_connect(url, headers=self._getAuthHeaders())
+        try:
+            message = await ws.receive_json()
+            if message.get("type") == "auth_required":
+                await ws.send_json({"type": "auth", "access_token": self._getToken()})
+                message = await ws.receive_json()
+            if message.get("type") != "auth_ok":
+                raise SupervisorPermissionError()
+            return ws
+        except BaseException:
+            await ws.close()
+            raise
+
     async def dismissNotification(self) -> None:
         data: Dict[str, str] = {
             "notification_id": NOTIFICATION_ID
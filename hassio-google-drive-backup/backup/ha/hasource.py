@@ -8,7 +8,8 @@ from typing import Dict, List, Optional, Any, Union
 from aiohttp.client_exceptions import ClientResponseError
 from injector import inject, singleton
 
-from backup.util import AsyncHttpGetter, GlobalInfo, Estimator, DataCache, KEY_NOTE, KEY_LAST_SEEN, KEY_PENDING, KEY_NAME, KEY_CREATED, KEY_I_MADE_THIS, KEY_IGNORE
+from backup.util import AsyncHttpGetter, GlobalInfo, Estimator, DataCache, KEY_NOTE, KEY_LAST_SEEN, KEY_PENDING, KEY_NAME, KEY_CREATED, KEY_I_MADE_THIS, KEY_IGNORE, LocalFileStream
+from backup.util.asynchttpgetter import DEFAULT_CHUNK_SIZE
 from ..config import Config, Setting, CreateOptions, Startable, Version
 from ..const import SOURCE_HA
 from ..model import BackupSource, AbstractBackup, HABackup, Backup
@@ -21,9 +22,27 @@ from ..time import Time
 from ..logger import getLogger, StandardLogger
 from backup.const import FOLDERS, NECESSARY_OLD_BACKUP_PLURAL_NAME
 from .addon_stopper import LOGGER, AddonStopper
+from .restorespool import RestoreSpool
 
 logger: StandardLogger = getLogger(__name__)
 
+# How many backups get looked up from the supervisor at once
+MAX_CONCURRENT_BACKUP_LOOKUPS = 8
+
+# How long each piece of information about the supervisor and Home Assistant gets used before it's requested again
+INFO_TTL = {
+    "self": timedelta(minutes=1),
+    "core": timedelta(minutes=1),
+    "supervisor": timedelta(minutes=1),
+    "mounts": timedelta(minutes=1),
+    "host": timedelta(hours=1),
+    "addons": timedelta(minutes=10),
+}
+
+# These rarely change, so once they expire the old value keeps getting used while they're refreshed in the background
+BACKGROUND_INFO = ["host", "addons"]
+
+
 class PendingBackup(AbstractBackup):
     def __init__(self, backupType, protected, options: CreateOptions, request_info, config, time):
         super().__init__(
@@ -132,10 +151,11 @@ class HaSource(BackupSource[HABackup], Startable):
     Stores logic for interacting with the supervisor add-on API
     """
     @inject
-    def __init__(self, config: Config, time: Time, ha: HaRequests, info: GlobalInfo, stopper: AddonStopper, estimator: Estimator, data_cache: DataCache):
+    def __init__(self, config: Config, time: Time, ha: HaRequests, info: GlobalInfo, stopper: AddonStopper, estimator: Estimator, data_cache: DataCache, spool: RestoreSpool):
         super().__init__()
         self.config: Config = config
         self._data_cache = data_cache
+        self._spool = spool
         self.backup_thread: Optional[Thread] = None
         self.pending_backup_error: Optional[Exception] = None
         self.pending_backup_slug: Optional[str] = None
@@ -155,8 +175,13 @@ class HaSource(BackupSource[HABackup], Startable):
         self.stopper = stopper
         self.estimator = estimator
         self._addons = {}
+        self._addon_info = []
         self._changes_from_last_query = False
 
+        # When each item in INFO_TTL was last requested from the supervisor
+        self._info_fetched = {}
+        self._info_refresh_task = None
+
         # This lock should be used for _ANYTHING_ that interacts with self._pending_backup
         self._pending_backup_lock = asyncio.Lock()
         self.pending_backup: Optional[PendingBackup] = None
@@ -253,6 +278,9 @@ class HaSource(BackupSource[HABackup], Startable):
         if self._pending_backup_task:
             self._pending_backup_task.cancel()
             await asyncio.wait([self._pending_backup_task])
+        if self._info_refresh_task:
+            self._info_refresh_task.cancel()
+            await asyncio.wait([self._info_refresh_task])
 
     @property
     def needsSpaceCheck(self):
@@ -273,7 +301,7 @@ class HaSource(BackupSource[HABackup], Startable):
             await self.init()
         else:
             # Always ensure the supervisor version is fresh before makign any other requests
-            self.super_info = await self.harequests.supervisorInfo()
+            await self._fetchInfo(["supervisor"])
         slugs = set()
         retained = []
         backups: Dict[str, AbstractBackup] = {}
@@ -286,10 +314,20 @@ class HaSource(BackupSource[HABackup], Startable):
         if 'backups' in query:
             backup_list = query['backups']
 
-        for backup in backup_list:
-            slug = backup['slug']
+        # Look up the backups at the same time, since each one that isn't cached yet means a request to the supervisor
+        lookups = asyncio.Semaphore(MAX_CONCURRENT_BACKUP_LOOKUPS)
+
+        async def lookup(listed):
+            async with lookups:
+                return await self.harequests.backup(listed['slug'], listed)
+        items = await asyncio.gather(*[lookup(backup) for backup in backup_list], return_exceptions=True)
+        for item in items:
+            if isinstance(item, BaseException):
+                raise item
+
+        for item in items:
+            slug = item.slug()
             slugs.add(slug)
-            item = await self.harequests.backup(slug)
             if slug in self.pending_options:
                 item.setOptions(self.pending_options[slug])
             backups[slug] = item
@@ -384,9 +422,21 @@ class HaSource(BackupSource[HABackup], Startable):
             backup.overrideStatus("Loading {0}%", source)
             backup.setUploadSource(self.title(), source)
             async with source:
-                with aiohttp.MultipartWriter('mixed') as mpwriter:
-                    mpwriter.append(source, {'CONTENT-TYPE': 'application/tar'})  # type: ignore
-                    resp = await self.harequests.upload(mpwriter)
+                # Download to a local file first if there's room, so if the download fails retrying doesn't have to start over
+                spool = self._spool.fits(backup.slug(), source.size())
+                if spool:
+                    path = await self._spool.fill(backup.slug(), source)
+                else:
+                    logger.info("There isn't enough free space to download the backup before restoring it, so it will be sent straight to Home Assistant")
+                    self._spool.clear()
+                    resp = await self._uploadToSupervisor(self._spool.passThrough(source))
+            if spool:
+                spooled = LocalFileStream(path, self.time)
+                async with spooled:
+                    backup.overrideStatus("Loading into Home Assistant {0}%", spooled)
+                    resp = await self._uploadToSupervisor(spooled.generator(DEFAULT_CHUNK_SIZE))
+                # The supervisor has seen the whole backup, so whether or not it accepted it the download is done.
+                self._spool.clear()
             backup.clearStatus()
             backup.clearUploadSource()
         except Exception as e:
@@ -408,47 +458,52 @@ class HaSource(BackupSource[HABackup], Startable):
         item._retained = retain
         self.config.setRetained(backup.slug(), retain)
 
+    async def _uploadToSupervisor(self, chunks):
+        with aiohttp.MultipartWriter('mixed') as mpwriter:
+            mpwriter.append(chunks, {'CONTENT-TYPE': 'application/tar'})  # type: ignore
+            return await self.harequests.upload(mpwriter)
+
     async def init(self):
-        await self._refreshInfo()
+        await self._refreshInfo(force=True)
         self._initialized = True
 
     async def refresh(self):
-        await self._refreshInfo()
+        self._spool.clearStale()
+        await self._refreshInfo(force=True)
 
-    async def _refreshInfo(self) -> None:
+    async def _refreshInfo(self, force=False) -> None:
         try:
-            self.self_info = await self.harequests.selfInfo()
-            self.host_info = await self.harequests.info()
-            self.ha_info = await self.harequests.haInfo()
-            self.super_info = await self.harequests.supervisorInfo()
-            self.mount_info = await self.harequests.mountInfo()
-
-            addon_info = ensureKey("addons", await self.harequests.getAddons(), "Supervisor Metadata")
-            self.config.update(
-                ensureKey("options", self.self_info, "addon metdata"))
-            if self.config.mustSaveUpgradeChanges():
-                LOGGER.info("The configuration format has changed in this version of the addon and your configuration will be automatically updated")
-                options = {}
-                for option in self.config.getAllConfig().keys():
-                    options[option.value] = self.config.get(option)
-                await self.harequests.updateConfig(options)
-                self.config.persistedChanges()
+            expired = [key for key in INFO_TTL if force or self._infoExpired(key)]
+            background = []
+            if not force:
+                background = [key for key in expired if key in BACKGROUND_INFO and key in self._info_fetched]
+                expired = [key for key in expired if key not in background]
+            await self._fetchInfo(expired)
+            if len(background) > 0:
+                self._refreshInBackground(background)
+
+            if "self" in expired:
+                # Only apply the addon's options when they were just requested, since they might have been changed
+                # since the last time.
+                self.config.update(
+                    ensureKey("options", self.self_info, "addon metdata"))
+                if self.config.mustSaveUpgradeChanges():
+                    LOGGER.info("The configuration format has changed in this version of the addon and your configuration will be automatically updated")
+                    options = {}
+                    for option in self.config.getAllConfig().keys():
+                        options[option.value] = self.config.get(option)
+                    await self.harequests.updateConfig(options)
+                    self.config.persistedChanges()
 
             self._info.ha_port = ensureKey(
                 "port", self.ha_info, "Home Assistant metadata")
             self._info.ha_ssl = ensureKey(
                 "ssl", self.ha_info, "Home Assistant metadata")
-            self._info.addons = addon_info
             self._info.slug = ensureKey(
                 "slug", self.self_info, "addon metdata")
             self._info.url = self.getAddonUrl()
 
-            self._addons = {}
-            for addon in addon_info:
-                self._addons[addon.get('slug', "default")] = addon
-
             self._info.addDebugInfo("self_info", self.self_info)
-            self._info.addDebugInfo("host_info", self.host_info)
             self._info.addDebugInfo("ha_info", self.ha_info)
             self._info.addDebugInfo("super_info", self.super_info)
         except Exception as e:
@@ -456,6 +511,62 @@ class HaSource(BackupSource[HABackup], Startable):
             logger.debug(logger.formatException(e))
             raise e
 
+    def _infoExpired(self, key: str) -> bool:
+        fetched = self._info_fetched.get(key)
+        return fetched is None or self.time.now() >= fetched + INFO_TTL[key]
+
+    async def _fetchInfo(self, keys: List[str]) -> None:
+        """Requests the given items in INFO_TTL from the supervisor all at once"""
+        async def fetch(key):
+            if key == "self":
+                self.self_info = await self.harequests.selfInfo()
+            elif key == "host":
+                self.host_info = await self.harequests.info()
+                self._info.addDebugInfo("host_info", self.host_info)
+            elif key == "core":
+                self.ha_info = await self.harequests.haInfo()
+            elif key == "supervisor":
+                self.super_info = await self.harequests.supervisorInfo()
+            elif key == "mounts":
+                self.mount_info = await self.harequests.mountInfo()
+            elif key == "addons":
+                self._addon_info = ensureKey("addons", await self.harequests.getAddons(), "Supervisor Metadata")
+                self._info.addons = self._addon_info
+                self._addons = {}
+                for addon in self._addon_info:
+                    self._addons[addon.get('slug', "default")] = addon
+            self._info_fetched[key] = self.time.now()
+
+        async def fetchAfterSupervisor():
+            # Whether mount info can be requested depends on the supervisor version, which isn't known until the
+            # supervisor has been asked once.
+            await fetch("supervisor")
+            await fetch("mounts")
+
+        keys = list(keys)
+        requests = []
+        if self.super_info is None and "supervisor" in keys and "mounts" in keys:
+            keys.remove("supervisor")
+            keys.remove("mounts")
+            requests.append(fetchAfterSupervisor())
+        requests.extend(fetch(key) for key in keys)
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def _refreshInBackground(self, keys: List[str]) -> None:
+        if self._info_refresh_task is not None and not self._info_refresh_task.done():
+            return
+
+        async def refresh():
+            try:
+                await self._fetchInfo(keys)
+            except Exception as e:
+                logger.debug("Failed to refresh info from the supervisor in the background")
+                logger.debug(logger.formatException(e))
+        self._info_refresh_task = asyncio.create_task(refresh(), name="Supervisor Info Refresher")
+
     def addonHasLogo(self, slug):
         return self._addons.get(slug, {}).get('logo', False)
 
@@ -0,0 +1,150 @@
+import asyncio
+import os
+from datetime import timedelta
+
+from injector import inject, singleton
+
+from ..config import Config, Setting
+from ..exceptions import LogicError
+from ..logger import getLogger
+from ..time import Time
+from ..util import DataCache, BandwidthGovernor, Flow
+from ..util.asynchttpgetter import DEFAULT_CHUNK_SIZE
+
+logger = getLogger(__name__)
+
+# How much gets written to the spool between checkpoints.  A failed restore re-downloads at most this much.
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+# A spool that hasn't been checkpointed in this long is from a restore nobody retried, so it gets deleted
+# instead of taking up space.
+SPOOL_EXPIRATION = timedelta(days=1)
+
+# Spooling a backup has to leave at least this much free space on the disk
+SPOOL_FREE_SPACE_MARGIN = 100 * 1024 * 1024
+
+
+@singleton
+class RestoreSpool():
+    """
+    Downloads a backup being restored into a local file before it gets handed to the supervisor.  Every so
+    often the file is flushed to disk and how much of it is complete gets saved in the data cache, so if the
+    download fails (or the addon restarts) trying again picks up from the last checkpoint instead of starting
+    over.  Without this a large backup over a flaky connection might never make it all the way through.
+    """
+    @inject
+    def __init__(self, config: Config, time: Time, data_cache: DataCache, governor: BandwidthGovernor):
+        self._config = config
+        self._time = time
+        self._data_cache = data_cache
+        self._governor = governor
+        self._checkpoint_bytes = CHECKPOINT_BYTES
+
+    def path(self) -> str:
+        return self._config.get(Setting.RESTORE_SPOOL_FILE_PATH)
+
+    def checkpoint(self) -> int:
+        """How many bytes of the spool are known to be complete"""
+        spool = self._data_cache.restoreSpool
+        if spool is None:
+            return 0
+        return spool.get('position', 0)
+
+    def fits(self, slug: str, size: int) -> bool:
+        """
+        Whether there's enough free space to spool a backup of the given size.  The supervisor keeps its own copy
+        of the backup once it's restored, so if that ends up on the same disk it needs room for both.
+        """
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path()))
+            needed = size - self._resumePosition(slug, size) + SPOOL_FREE_SPACE_MARGIN
+            if os.stat(directory).st_dev == os.stat(self._config.get(Setting.BACKUP_DIRECTORY_PATH)).st_dev:
+                needed += size
+            return self._bytesFree(directory) >= needed
+        except OSError as e:
+            logger.debug("Unable to check the free space for spooling a restore: {0}".format(e))
+            return False
+
+    def passThrough(self, source):
+        """Streams all of source without spooling it, for when it won't fit on the disk"""
+        return self._governor.stream(Flow.RESTORE, source.generator(DEFAULT_CHUNK_SIZE))
+
+    async def fill(self, slug: str, source) -> str:
+        """
+        Downloads all of source (which must already be set up) into the spool, resuming where an earlier
+        attempt for the same backup left off.  Returns the path of the spooled file.
+        """
+        path = self.path()
+        size = source.size()
+        start = self._resumePosition(slug, size)
+        if start > 0:
+            logger.info("Resuming the download of the backup from {0} bytes in".format(start))
+        else:
+            self._saveCheckpoint(slug, size, 0)
+
+        loop = asyncio.get_event_loop()
+        position = start
+        with open(path, "r+b" if start > 0 else "wb") as f:
+            f.truncate(start)
+            f.seek(start)
+            source.position(start)
+            unsaved = 0
+            async for chunk in self._governor.stream(Flow.RESTORE, source.generator(DEFAULT_CHUNK_SIZE)):
+                await loop.run_in_executor(None, f.write, chunk)
+                position += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= self._checkpoint_bytes:
+                    await self._checkpoint(f, slug, size, position)
+                    unsaved = 0
+            await self._checkpoint(f, slug, size, position)
+        if position != size:
+            raise LogicError("The backup ended before it was completely downloaded")
+        return path
+
+    def clear(self):
+        """Deletes the spool, eg once the supervisor has the backup"""
+        path = self.path()
+        if os.path.exists(path):
+            os.remove(path)
+        self._data_cache.restoreSpool = None
+        self._data_cache.saveIfDirty()
+
+    def clearStale(self):
+        spool = self._data_cache.restoreSpool
+        if spool is None:
+            return
+        if self._time.now() > self._time.parse(spool.get('time')) + SPOOL_EXPIRATION:
+            logger.info("Deleting a partially downloaded backup from a restore that was never finished")
+            self.clear()
+
+    def _resumePosition(self, slug: str, size: int) -> int:
+        spool = self._data_cache.restoreSpool
+        if spool is None or spool.get('slug') != slug or spool.get('size') != size:
+            return 0
+        position = spool.get('position', 0)
+        path = self.path()
+        if not os.path.exists(path) or os.path.getsize(path) < position or position > size:
+            return 0
+        return position
+
+    async def _checkpoint(self, f, slug: str, size: int, position: int):
+        # The data has to actually be on disk before the checkpoint claims it is.
+        await asyncio.get_event_loop().run_in_executor(None, self._sync, f)
+        self._saveCheckpoint(slug, size, position)
+
+    def _saveCheckpoint(self, slug: str, size: int, position: int):
+        self._data_cache.restoreSpool = {
+            'slug': slug,
+            'size': size,
+            'position': position,
+            'time': self._time.now().isoformat()
+        }
+        self._data_cache.saveIfDirty()
+
+    def _bytesFree(self, directory: str) -> int:
+        stats = os.statvfs(directory)
+        return stats.f_bavail * stats.f_frsize
+
+    def _sync(self, f):
+        f.flush()
+        os.fsync(f.fileno())
@@ -15,6 +15,13 @@ PROP_VERSION = "version"
 PROP_PROTECTED = "protected"
 PROP_RETAINED = "retained"
 PROP_NOTE = "note"
+PROP_SHA256 = "sha256"
+
+# Backups uploaded with deduplication are stored as a manifest, which keeps the size of the backup it describes
+PROP_DEDUP_SIZE = "dedup_size"
+
+# Archives shared between deduplicated backups are stored under their SHA-256
+PROP_DEDUP_BLOB = "dedup_blob"
 
 DRIVE_KEY_TEXT = "Google Drive's backup metadata"
 HA_KEY_TEXT = "Home Assistant's backup metadata"
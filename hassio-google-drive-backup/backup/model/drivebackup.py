@@ -1,4 +1,4 @@
-from .backups import AbstractBackup
+from .backups import AbstractBackup, PROP_DEDUP_SIZE
 from typing import Any, Dict
 
 from ..const import SOURCE_GOOGLE_DRIVE, NECESSARY_PROP_KEY_SLUG, NECESSARY_PROP_KEY_DATE, NECESSARY_PROP_KEY_NAME, PROP_NOTE
@@ -34,7 +34,7 @@ class DriveBackup(AbstractBackup):
             slug=ensureKey(NECESSARY_PROP_KEY_SLUG, props, DRIVE_KEY_TEXT),
             date=Time.parse(
                 ensureKey(NECESSARY_PROP_KEY_DATE, props, DRIVE_KEY_TEXT)),
-            size=int(ensureKey("size", data, DRIVE_KEY_TEXT)),
+            size=int(props[PROP_DEDUP_SIZE] if PROP_DEDUP_SIZE in props else ensureKey("size", data, DRIVE_KEY_TEXT)),
             source=SOURCE_GOOGLE_DRIVE,
             backupType=props.get(PROP_TYPE, "?"),
             version=props.get(PROP_VERSION, None),
@@ -50,6 +50,14 @@ class DriveBackup(AbstractBackup):
     def id(self) -> str:
         return self._id
 
+    def fileSize(self) -> int:
+        """The size of the file in Google Drive, which for a deduplicated backup is the size of its manifest"""
+        return int(ensureKey("size", self._drive_data, DRIVE_KEY_TEXT))
+
+    def deduplicated(self) -> bool:
+        """True if this is a manifest for a backup whose archives are stored in separate files"""
+        return PROP_DEDUP_SIZE in self._drive_data.get('appProperties', {})
+
     def canDeleteDirectly(self) -> str:
         caps = self._drive_data.get("capabilities", {})
         if caps.get('canDelete', False):
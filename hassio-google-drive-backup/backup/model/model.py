@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta, date
 from io import IOBase
 from typing import Dict, Generic, List, Optional, Tuple, TypeVar, Union
@@ -59,6 +60,13 @@ class BackupSource(Trigger, Generic[T]):
     async def delete(self, backup: T):
         pass
 
+    async def deleteMany(self, backups: List[T]):
+        """Deletes several backups at once, which sources can override to do more efficiently than one at a time"""
+        results = await asyncio.gather(*[self.delete(backup) for backup in backups], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
     async def ignore(self, backup: T, ignore: bool):
         pass
 
@@ -218,8 +226,7 @@ class Model():
             for backup in self.backups.values():
                 if backup.ignore() and backup.date() < cutoff:
                     delete.append(backup)
-            for backup in delete:
-                await self.deleteBackup(backup, self.source)
+            await self.deleteBackups(delete, self.source)
 
         self._handleBackupDetails()
         next_backup = self.nextBackup(now)
@@ -238,20 +245,16 @@ class Model():
                     uploads.append(backup)
             uploads.sort(key=lambda s: s.date())
             uploads.reverse()
-            for upload in uploads:
-                # only upload if doing so won't result in it being deleted next
-                dummy = DummyBackup(
-                    "", upload.date(), self.dest.name(), "dummy_slug_name")
-                proposed = list(self.backups.values())
-                proposed.append(dummy)
-                if self._nextPurge(self.dest, proposed)[1] != dummy:
-                    if self.config.get(Setting.DELETE_BEFORE_NEW_BACKUP):
-                        await self._purge(self.dest, pre_purge=True)
-                    upload.addSource(await self.dest.save(upload, await self.source.read(upload)))
-                    await self._purge(self.dest)
-                    self._handleBackupDetails()
-                else:
+            while len(uploads) > 0:
+                batch = self._nextUploads(uploads)
+                if len(batch) == 0:
                     break
+                if self.config.get(Setting.DELETE_BEFORE_NEW_BACKUP):
+                    await self._purge(self.dest, pre_purge=True)
+                await self._upload(batch)
+                await self._purge(self.dest)
+                self._handleBackupDetails()
+                uploads = uploads[len(batch):]
             if self.config.get(Setting.DELETE_AFTER_UPLOAD):
                 await self._purge(self.source)
         self._handleBackupDetails()
@@ -259,6 +262,47 @@ class Model():
         self.dest.postSync()
         self._data_cache.saveIfDirty()
 
+    def _nextUploads(self, uploads: List[Backup]) -> List[Backup]:
+        """
+        Picks the next backups to upload at the same time, in the order given.  Stops before any backup that would
+        get deleted next if it were uploaded.
+        """
+        if self.config.get(Setting.DELETE_BEFORE_NEW_BACKUP):
+            # Deleting before each new backup only makes room for one of them.
+            count = 1
+        else:
+            count = max(self.config.get(Setting.MAXIMUM_CONCURRENT_UPLOADS), 1)
+        proposed = list(self.backups.values())
+        batch = []
+        for upload in uploads[:count]:
+            # only upload if doing so won't result in it being deleted next
+            dummy = DummyBackup(
+                "", upload.date(), self.dest.name(), "dummy_slug_name" + str(len(batch)))
+            proposed.append(dummy)
+            candidates = list(proposed)
+            for x in range(len(batch) + 1):
+                purge = self._nextPurge(self.dest, candidates)[1]
+                if purge is None:
+                    break
+                if isinstance(purge, DummyBackup):
+                    return batch
+                candidates.remove(purge)
+            batch.append(upload)
+        return batch
+
+    async def _upload(self, uploads: List[Backup]):
+        async def upload(backup: Backup):
+            backup.addSource(await self.dest.save(backup, await self.source.read(backup)))
+        if len(uploads) == 1:
+            await upload(uploads[0])
+            return
+
+        # Let every upload finish before reporting a failure, so none get abandoned half way through.
+        results = await asyncio.gather(*[upload(backup) for backup in uploads], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
     def isWorkingThroughUpload(self):
         return self.dest.isWorking()
 
@@ -273,14 +317,17 @@ class Model():
         backup = Backup(created)
         self.backups[backup.slug()] = backup
 
-    async def deleteBackup(self, backup, source):
-        if not backup.getSource(source.name()):
-            return
-        slug = backup.slug()
-        await source.delete(backup)
-        backup.removeSource(source.name())
-        if backup.isDeleted():
-            del self.backups[slug]
+    async def deleteBackups(self, backups, source):
+        backups = [backup for backup in backups if backup.getSource(source.name())]
+        slugs = [backup.slug() for backup in backups]
+        try:
+            # Deleting them all at once lets a source send the deletes together, eg Google Drive's batch requests.
+            await source.deleteMany(backups)
+        finally:
+            # Sources remove themselves from each backup they delete, even when deleting others failed
+            for slug, backup in zip(slugs, backups):
+                if backup.isDeleted() and self.backups.get(slug) is backup:
+                    del self.backups[slug]
 
     def getNextPurges(self):
         purges = {}
@@ -379,7 +426,7 @@ class Model():
                 return
             if len(purge) != len(reasons) and (self.config.get(Setting.CONFIRM_MULTIPLE_DELETES) and not self.info.isPermitMultipleDeletes()):
                 raise DeleteMutlipleBackupsError(self._getPurgeStats())
-            await self.deleteBackup(purge[0][0], source)
+            await self.deleteBackups([backup for backup, reason in purge], source)
 
     def _getPurgeStats(self):
         ret = {}
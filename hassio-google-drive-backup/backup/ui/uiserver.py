@@ -1,6 +1,7 @@
 import asyncio
 import ssl
 import json
+import uuid
 import aiohttp_jinja2
 import jinja2
 import base64
@@ -16,7 +17,7 @@ from backup.config import Config, Setting, CreateOptions, BoolValidator, Startab
 from backup.const import SOURCE_GOOGLE_DRIVE, SOURCE_HA, GITHUB_BUG_TEMPLATE
 from backup.model import Coordinator, Backup, AbstractBackup
 from backup.exceptions import KnownError, GoogleCredGenerateError, ensureKey
-from backup.util import GlobalInfo, Estimator, DataCache, UpgradeFlags
+from backup.util import GlobalInfo, Estimator, DataCache, UpgradeFlags, BandwidthGovernor, Flow, LocalFileStream, parseRangeHeader
 from backup.file import File
 from backup.ha import HaSource, PendingBackup, BACKUP_NAME_KEYS, HaRequests, HaUpdater
 from backup.ha import Password
@@ -47,13 +48,14 @@ class UiServer(Trigger, Startable):
                  time: Time, config: Config, global_info: GlobalInfo, estimator: Estimator,
                  session: ClientSession, exchanger_builder: ClassAssistedBuilder[Exchanger],
                  debug_worker: DebugWorker, folder_finder: FolderFinder, data_cache: DataCache,
-                 haupdater: HaUpdater, custom_auth_provider: ProviderOf[AuthCodeQuery]):
+                 haupdater: HaUpdater, custom_auth_provider: ProviderOf[AuthCodeQuery], governor: BandwidthGovernor):
         super().__init__()
         # Currently running server tasks
         self.runners = []
         self.exchanger_builder = exchanger_builder
         self._coord = coord
         self._time = time
+        self._governor = governor
         self.custom_auth_provider = custom_auth_provider
         self.manual_exchanger: Exchanger = None
         self.config: Config = config
@@ -643,21 +645,89 @@ class UiServer(Trigger, Startable):
         slug = request.query.get("slug", "")
         backup = self._coord.getBackup(slug)
         stream = await self._coord.download(slug)
-        await stream.setup()
-        resp = web.StreamResponse()
-        resp.content_type = 'application/tar'
-        resp.headers['Content-Disposition'] = 'attachment; filename="{}.tar"'.format(
-            backup.name())
-        resp.headers['Content-Length'] = str(stream.size())
-
-        await resp.prepare(request)
-
-        # SOMEDAY: consider re-streaming a decrypted tar file for the sake of convenience
-
-        async for chunk in stream.generator(self.config.get(Setting.DEFAULT_CHUNK_SIZE)):
-            await resp.write(chunk)
+        async with stream:
+            size = stream.size()
+            # A backup's bytes are the same no matter where they get downloaded from, so its slug and size identify them.
+            etag = '"{0}-{1}"'.format(slug, size)
+            last_modified = backup.date().replace(microsecond=0)
+            headers = {
+                hdrs.ACCEPT_RANGES: "bytes",
+                hdrs.ETAG: etag,
+            }
 
-        await resp.write_eof()
+            ranges = None
+            if self._ifRangeMatches(request, etag, last_modified):
+                ranges = parseRangeHeader(request.headers.get(hdrs.RANGE), size)
+            if ranges is not None and len(ranges) == 0:
+                headers[hdrs.CONTENT_RANGE] = "bytes */{0}".format(size)
+                return web.Response(status=416, headers=headers)
+
+            resp = web.StreamResponse(headers=headers)
+            resp.last_modified = last_modified
+            resp.headers['Content-Disposition'] = 'attachment; filename="{}.tar"'.format(
+                backup.name())
+
+            # SOMEDAY: consider re-streaming a decrypted tar file for the sake of convenience
+
+            if ranges is None or len(ranges) == 1:
+                start, end = ranges[0] if ranges is not None else (0, size)
+                if ranges is not None:
+                    resp.set_status(206)
+                    resp.headers[hdrs.CONTENT_RANGE] = "bytes {0}-{1}/{2}".format(start, end - 1, size)
+                resp.content_type = 'application/tar'
+                resp.headers[hdrs.CONTENT_LENGTH] = str(end - start)
+                await resp.prepare(request)
+                await self._writeRange(request, resp, stream, start, end)
+            else:
+                boundary = uuid.uuid4().hex
+                part_headers = [
+                    "--{0}\r\nContent-Type: application/tar\r\nContent-Range: bytes {1}-{2}/{3}\r\n\r\n".format(
+                        boundary, start, end - 1, size).encode() for start, end in ranges]
+                closing = "--{0}--\r\n".format(boundary).encode()
+                resp.set_status(206)
+                resp.headers[hdrs.CONTENT_TYPE] = "multipart/byteranges; boundary={0}".format(boundary)
+                resp.headers[hdrs.CONTENT_LENGTH] = str(
+                    sum(len(header) + end - start + 2 for header, (start, end) in zip(part_headers, ranges)) + len(closing))
+                await resp.prepare(request)
+                for header, (start, end) in zip(part_headers, ranges):
+                    await resp.write(header)
+                    await self._writeRange(request, resp, stream, start, end)
+                    await resp.write(b"\r\n")
+                await resp.write(closing)
+            await resp.write_eof()
+            return resp
+
+    def _ifRangeMatches(self, request: Request, etag: str, last_modified) -> bool:
+        if_range = request.headers.get(hdrs.IF_RANGE)
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # Only a strong validator can be used to combine ranges
+            return if_range == etag
+        return request.if_range is not None and request.if_range == last_modified
+
+    async def _writeRange(self, request: Request, resp: web.StreamResponse, stream, start: int, end: int):
+        chunk_size = self.config.get(Setting.DEFAULT_CHUNK_SIZE)
+        if isinstance(stream, LocalFileStream):
+            # The backup is on disk, so let the kernel copy it straight to the socket instead of reading it into memory.
+            loop = asyncio.get_event_loop()
+            position = start
+            while position < end:
+                count = min(chunk_size, end - position)
+                await self._governor.consume(Flow.DOWNLOAD, count)
+                if request.transport is None:
+                    raise ConnectionResetError("Connection lost")
+                await loop.sendfile(request.transport, stream.file(), position, count)
+                position += count
+            return
+        stream.position(start)
+        while stream.position() < end:
+            data = await stream.read(min(chunk_size, end - stream.position()))
+            if len(data.getbuffer()) == 0:
+                raise ConnectionResetError("The backup ended before it was supposed to")
+            await self._governor.consume(Flow.DOWNLOAD, len(data.getbuffer()))
+            await resp.write(data.getbuffer())
 
     async def run(self) -> None:
         await self.stop()
@@ -1,5 +1,6 @@
 # flake8: noqa
 from .asynchttpgetter import AsyncHttpGetter
+from .throughput_meter import ThroughputMeter
 from .backoff import Backoff
 from .estimator import Estimator
 from .globalinfo import GlobalInfo
@@ -7,3 +8,15 @@ from .resolver import Resolver
 from .rangelookup import RangeLookup
 from .data_cache import DataCache, KEY_CREATED, KEY_I_MADE_THIS, KEY_PENDING, KEY_NOTE, KEY_IGNORE, KEY_LAST_SEEN, KEY_NAME, CACHE_EXPIRATION_DAYS, UpgradeFlags
 from .token_bucket import TokenBucket
+from .read_ahead_buffer import ReadAheadBuffer
+from .readaheadstream import ReadAheadStream
+from .parallelrangestream import ParallelRangeStream
+from .localfilestream import LocalFileStream
+from .buffer_pool import BufferPool, MemoryViewPayload
+from .bandwidth_governor import BandwidthGovernor, Flow
+from .stream_checksum import StreamChecksum
+from .tar_layout import TarSegment, scanTarLayout
+from .composite_stream import CompositeStream, StreamSegment, RangeStream
+from .byterange import parseRangeHeader
+from .response_cache import ResponseCache
+from .adaptive_limiter import AdaptiveLimiter
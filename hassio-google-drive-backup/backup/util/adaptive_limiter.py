@@ -0,0 +1,86 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Optional
+
+from ..time import Time
+
+
+class AdaptiveLimiter:
+    """
+    Limits how many requests can be in flight at once, adjusting the limit the way TCP adjusts its congestion window
+    (additive increase, multiplicative decrease).  Every request that goes through raises the limit a little, and
+    a rate limit response cuts it by decrease_factor.  When the server says when to try again (eg with a
+    Retry-After header) nobody gets to start a request until then.
+    """
+
+    def __init__(self, time: Time, minimum: int, maximum: int, decrease_factor: float = 0.5):
+        self._time = time
+        self._minimum = minimum
+        self._maximum = maximum
+        self._decrease_factor = decrease_factor
+        self._limit = float(maximum)
+        self._in_flight = 0
+        self._paused_until: Optional[datetime] = None
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        # Goes up every time the limit gets cut, so a burst of rate limit responses to requests that were all sent
+        # before the cut only cuts the limit once.
+        self._generation = 0
+
+    def limit(self) -> int:
+        return max(self._minimum, int(self._limit))
+
+    def inFlight(self) -> int:
+        return self._in_flight
+
+    def pausedUntil(self) -> Optional[datetime]:
+        return self._paused_until
+
+    async def acquire(self) -> int:
+        """
+        Waits for a chance to make a request.  Returns a number that has to be passed back to rateLimited() if the
+        request gets rate limited, and release() must be called once the request finishes.
+        """
+        while True:
+            if self._paused_until is not None:
+                remaining = (self._paused_until - self._time.now()).total_seconds()
+                if remaining > 0:
+                    await self._time.sleepAsync(remaining)
+                    continue
+                self._paused_until = None
+            if self._in_flight < self.limit():
+                self._in_flight += 1
+                return self._generation
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def release(self):
+        self._in_flight -= 1
+        self._wakeWaiters()
+
+    def succeeded(self):
+        self._limit = min(float(self._maximum), self._limit + 1.0 / self._limit)
+        self._wakeWaiters()
+
+    def rateLimited(self, generation: int, retry_after: Optional[float] = None):
+        if generation == self._generation:
+            self._limit = max(float(self._minimum), self._limit * self._decrease_factor)
+            self._generation += 1
+        if retry_after is not None and retry_after > 0:
+            until = self._time.now() + timedelta(seconds=retry_after)
+            if self._paused_until is None or until > self._paused_until:
+                self._paused_until = until
+
+    def _wakeWaiters(self):
+        room = self.limit() - self._in_flight
+        while room > 0 and len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                room -= 1
@@ -1,15 +1,17 @@
+import asyncio
 from datetime import timedelta
 import io
 from typing import Dict
 
 from aiohttp import ClientSession
 from aiohttp.client import ClientResponse, ClientPayloadError, ClientOSError
-from asyncio.exceptions import TimeoutError
-from collections import deque
+from asyncio.exceptions import TimeoutError, CancelledError
 
 from ..exceptions import LogicError, ensureKey
 from ..logger import getLogger
 from ..time import Time
+from .throughput_meter import ThroughputMeter
+from .read_ahead_buffer import ReadAheadBuffer
 
 logger = getLogger(__name__)
 
@@ -18,6 +20,8 @@ CONTENT_LENGTH_ERROR = "Content size must be provided if the webserver doesn't p
 SERVER_CONTENT_LENGTH_ERROR = "Server returned a content length that didn't match the requested size"
 POSITION_ERROR_MESSAGE = "AsyncHttpGetter must also be set up at position 0"
 DEFAULT_CHUNK_SIZE = 1024 * 1024
+# How much the background reader asks the response for at a time
+READ_AHEAD_CHUNK_SIZE = 256 * 1024
 
 
 # This class is dumb but it gets around a dumb problem
@@ -27,7 +31,7 @@ class Stupid(io.BytesIO):
 
 
 class AsyncHttpGetter:
-    def __init__(self, url, headers: Dict[str, str], session, size: int = None, timeout=None, timeoutFactory=None, otherErrorFactory=None, time: Time = None):
+    def __init__(self, url, headers: Dict[str, str], session, size: int = None, timeout=None, timeoutFactory=None, otherErrorFactory=None, time: Time = None, read_ahead: int = 0):
         self._url: str = url
 
         # Current position of the stream
@@ -48,7 +52,16 @@ class AsyncHttpGetter:
         # Where the resposne currently starts
         self._responseStart = 0
 
-        self._history = deque()
+        # If non-zero, a background task keeps up to this many bytes read from the response ahead of the consumer,
+        # so the connection keeps downloading while the consumer is busy with what it last read.
+        self._readAhead = max(int(read_ahead), 0)
+
+        # Bytes read ahead but not yet handed to the consumer.  They always start at self._position, so while
+        # the consumer reads sequentially the response sits at self._position + self.prefetched().
+        self._prefetched = ReadAheadBuffer(self._readAhead)
+        self._prefetchTask: asyncio.Task = None
+
+        self._meter = ThroughputMeter(time)
         self._time = time
         self._startTime = self._time.now()
         self.timeoutFactory = timeoutFactory
@@ -58,6 +71,8 @@ class AsyncHttpGetter:
     async def setup(self):
         if not self._position == 0:
             raise LogicError(POSITION_ERROR_MESSAGE)
+        await self._stopPrefetch()
+        self._discardPrefetched()
         await self._startReadRemoteAt(0)
         if CONTENT_LENGTH_HEADER in self._response.headers:
             self._size = int(ensureKey(
@@ -66,7 +81,9 @@ class AsyncHttpGetter:
             raise LogicError(
                 CONTENT_LENGTH_ERROR)
 
-        self._history.append([self._time.now(), 0])
+        self._meter.start()
+        if self._readAhead > 0:
+            self._ensurePrefetching()
         return self._size
 
     def _ensureSetup(self):
@@ -81,10 +98,33 @@ class AsyncHttpGetter:
         return self.size()
 
     def position(self, pos=None):
-        if pos is not None:
-            self._position = pos
+        if pos is not None and pos != self._position:
+            if self._position < pos <= self._position + self._prefetched.buffered():
+                # Already read ahead, so just skip over it
+                self._prefetched.skip(pos - self._position)
+                self._position = pos
+            else:
+                # Anything read ahead is for the wrong part of the stream now.  The next read notices the response
+                # isn't where it needs to be and starts a new one.
+                self._discardPrefetched()
+                self._position = pos
         return self._position
 
+    def prefetched(self) -> int:
+        """How many bytes have been read ahead of the consumer"""
+        return self._prefetched.buffered()
+
+    async def disableReadAhead(self):
+        """
+        Stops reading ahead, for consumers that already buffer on their own or seek around too much for it to help.
+        Anything read ahead so far gets thrown away, so it's best done before setup().
+        """
+        if self._readAhead == 0:
+            return
+        self._readAhead = 0
+        await self._stopPrefetch()
+        self._discardPrefetched()
+
     async def generator(self, chunk_size):
         while True:
             chunk = await self.read(chunk_size)
@@ -102,53 +142,7 @@ class AsyncHttpGetter:
 
     # return the estimated speed of the tranfser in bytes/second
     def speed(self, period: timedelta = timedelta(seconds=10)):
-        if len(self._history) < 2:
-            return None
-        now = self._time.now()
-        intervals = []
-        current = self._history[0]
-        last_speed = 0
-        for x in range(1, len(self._history)):
-            next = self._history[x]
-            seconds = (next[0] - current[0]).total_seconds()
-            data = next[1] - current[1]
-            if seconds == 0:
-                speed = 0  # avoid div by 0
-            else:
-                speed = data / seconds
-            intervals.append([current[0], next[0], speed])
-            current = next
-            last_speed = speed
-
-        time_since_last = now - current[0]
-        if time_since_last > period:
-            # linear decay the "estimated" rate over the period
-            diff = time_since_last - period
-            if diff > period:
-                return 0
-            else:
-                return last_speed * (1 - diff.total_seconds() / period.total_seconds())
-
-        # behave as though we continued with the pseed form the last interval
-        intervals.append([current[0], now, last_speed])
-
-        # calculate the time-averaged speed over the given period
-        stop = now
-        start = now - period
-        total = 0
-        minimum_time = now
-        for interval in intervals:
-            if start > interval[1]:
-                continue
-            if stop < interval[0]:
-                continue
-            overlap_start = max(start, interval[0])
-            overlap_stop = min(stop, interval[1])
-            if overlap_stop > overlap_start:
-                total += (overlap_stop - overlap_start).total_seconds() * interval[2]
-            if overlap_start < minimum_time:
-                minimum_time = overlap_start
-        return total / (now - minimum_time).total_seconds()
+        return self._meter.rate(period)
 
     def startTime(self):
         return self._startTime
@@ -191,16 +185,37 @@ class AsyncHttpGetter:
             return ret
 
         # See if we need to move the stream elsewhere
-        if self._responseStart != self._position:
+        if self._responseStart != self._position + self._prefetched.buffered():
             # Reset the stream's position
+            await self._stopPrefetch()
+            self._discardPrefetched()
             await self._startReadRemoteAt(self._position)
 
         # Limit by how much we can get from the stream
         needed = min(count, self.size() - self._position)
 
         # And then get it
+        if self._readAhead > 0:
+            data = await self._readPrefetched(needed)
+        else:
+            data = await self._readRemote(needed)
+        # Wrapping the bytes (instead of writing them) lets BytesIO share them rather than making a copy.
+        ret = Stupid(data)
+        # Keep track of where we are in the stream
+        self._position += len(data)
+        self._meter.add(len(data))
+
+        ret.seek(0)
+        return ret
+
+    async def _readRemote(self, count) -> bytes:
         try:
-            data = await self._response.content.readexactly(needed)
+            data = await self._response.content.readexactly(count)
+        except CancelledError:
+            # Some of the response may have been consumed, so it can't be trusted to be at
+            # _responseStart anymore.  Force the next read to restart the request.
+            self._responseStart = -1
+            raise
         except TimeoutError:
             if self.timeoutFactory is not None:
                 raise self.timeoutFactory()
@@ -213,21 +228,58 @@ class AsyncHttpGetter:
             if self.otherErrorFactory is not None:
                 raise self.otherErrorFactory()
             raise
-        ret.write(data)
-        # Keep track of where we are in the stream
         self._responseStart += len(data)
-        self._position += len(data)
-        self._history.append([self._time.now(), self._position])
-        if len(self._history) > 50:
-            self._history.popleft()
+        return data
 
-        ret.seek(0)
-        return ret
+    async def _readPrefetched(self, needed) -> bytes:
+        try:
+            await self._prefetched.waitFor(needed, self._ensurePrefetching)
+        except Exception:
+            # The response can't be trusted after an error, so the next read starts a new one from here.
+            self._discardPrefetched()
+            self._responseStart = -1
+            raise
+        return self._prefetched.take(needed)
+
+    def _discardPrefetched(self):
+        if self._prefetchTask is not None:
+            # Whatever it's in the middle of reading is no longer wanted either
+            self._prefetchTask.cancel()
+        self._prefetched.clear()
+
+    def _ensurePrefetching(self):
+        if self._prefetchTask is None or self._prefetchTask.done():
+            self._prefetchTask = asyncio.create_task(self._prefetch(), name="AsyncHttpGetter read ahead")
+
+    async def _stopPrefetch(self):
+        if self._prefetchTask is not None:
+            self._prefetchTask.cancel()
+            try:
+                await self._prefetchTask
+            except CancelledError:
+                pass
+            self._prefetchTask = None
+
+    async def _prefetch(self):
+        try:
+            while self._responseStart < self._size:
+                space = self._prefetched.space()
+                if space <= 0:
+                    await self._prefetched.waitForSpace()
+                    continue
+                self._prefetched.put(await self._readRemote(min(space, READ_AHEAD_CHUNK_SIZE, self._size - self._responseStart)))
+        except CancelledError:
+            raise
+        except Exception as e:
+            # The consumer sees the error once it's read everything before it
+            self._prefetched.fail(e)
 
     async def __aenter__(self):
         await self.setup()
 
     async def __aexit__(self, type, value, traceback):
+        await self._stopPrefetch()
+        self._discardPrefetched()
         if self._response is not None:
             self._response.release()
 
@@ -0,0 +1,131 @@
+import asyncio
+import heapq
+import itertools
+from enum import Enum
+from typing import Optional, Tuple
+
+from injector import inject, singleton
+
+from ..config import Config, Setting
+from ..time import Time
+
+
+class Flow(Enum):
+    RESTORE = "restore"
+    DOWNLOAD = "download"
+    UPLOAD = "upload"
+
+
+# Lower numbers go first.  Restores and browser downloads have someone waiting on them, uploads happen in the background.
+FLOW_PRIORITIES = {
+    Flow.RESTORE: 0,
+    Flow.DOWNLOAD: 1,
+    Flow.UPLOAD: 2,
+}
+
+# How many seconds worth of bandwidth can build up while nothing is being transferred.
+BURST_SECONDS = 1
+
+
+def parseLimitHours(value: str) -> Optional[Tuple[int, int]]:
+    """
+    Parses a range like "06:00-22:00" into the minute of the day it starts and ends on.  The range
+    wraps around midnight when it ends before it starts.  Returns None if it isn't a valid range.
+    """
+    if not value:
+        return None
+    try:
+        start, end = value.split("-")
+        return (_parseMinuteOfDay(start), _parseMinuteOfDay(end))
+    except ValueError:
+        return None
+
+
+def _parseMinuteOfDay(value: str) -> int:
+    hour, minute = value.split(":")
+    hour = int(hour)
+    minute = int(minute)
+    if hour < 0 or hour > 23 or minute < 0 or minute > 59:
+        raise ValueError("{0} isn't a time of day".format(value))
+    return hour * 60 + minute
+
+
+@singleton
+class BandwidthGovernor:
+    """
+    Limits the combined bandwidth of every large transfer the addon makes (uploads to Google Drive, restores
+    from Google Drive into Home Assistant, and backups downloaded through the web UI) since they all share
+    the same network link.  The limit can be restricted to certain hours of the day, and when transfers
+    compete for bandwidth the higher priority flow is served first.
+
+    Uploads are also held to upload_limit_bytes_per_second on their own, which is checked before they get here
+    and shrinks upload chunks to fit it.  So when both are set an upload goes no faster than the lower of the two,
+    and only this limit is shared with restores and downloads.
+
+    It works like a token bucket that's allowed to go into debt: a transfer waits until the bucket isn't
+    empty and then takes everything it needs, so chunks larger than a second's worth of bandwidth still
+    go through and the following transfers wait for the debt to be repaid.
+    """
+    @inject
+    def __init__(self, time: Time, config: Config):
+        self._time = time
+        self._config = config
+        self._tokens = 0.0
+        self._timestamp = self._time.monotonic()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._changed = asyncio.Condition()
+
+    def limit(self) -> float:
+        """The bandwidth limit in bytes/second right now, or 0 if transfers aren't limited"""
+        limit = self._config.get(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND)
+        if limit <= 0:
+            return 0
+        hours = parseLimitHours(self._config.get(Setting.BANDWIDTH_LIMIT_HOURS))
+        if hours is None:
+            return limit
+        now = self._time.nowLocal()
+        minute = now.hour * 60 + now.minute
+        start, end = hours
+        if start <= end:
+            limited = start <= minute < end
+        else:
+            limited = minute >= start or minute < end
+        return limit if limited else 0
+
+    async def consume(self, flow: Flow, count: int):
+        """Waits until count bytes of the given flow can be sent without going over the bandwidth limit"""
+        if count <= 0 or self.limit() <= 0:
+            return
+        waiter = (FLOW_PRIORITIES[flow], next(self._sequence))
+        heapq.heappush(self._waiters, waiter)
+        try:
+            while True:
+                limit = self.limit()
+                if limit <= 0:
+                    return
+                self._refill(limit)
+                if self._waiters[0] != waiter:
+                    async with self._changed:
+                        await self._changed.wait()
+                elif self._tokens >= 0:
+                    self._tokens -= count
+                    return
+                else:
+                    await self._time.sleepAsync(-self._tokens / limit)
+        finally:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def stream(self, flow: Flow, source):
+        """Wraps an async iterable of chunks so each one waits for bandwidth before it gets sent"""
+        async for chunk in source:
+            await self.consume(flow, len(chunk))
+            yield chunk
+
+    def _refill(self, limit: float):
+        now = self._time.monotonic()
+        self._tokens = min(limit * BURST_SECONDS, self._tokens + limit * (now - self._timestamp))
+        self._timestamp = now
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, List
+
+from aiohttp.abc import AbstractStreamWriter
+from aiohttp.payload import Payload
+
+# How much of a buffer gets handed to the socket at once, so sending a large chunk doesn't hold up the event loop.
+PAYLOAD_WRITE_SIZE = 256 * 1024
+
+
+class BufferPool:
+    """
+    Hands out reusable, fixed size buffers so the upload loop doesn't allocate (and later garbage collect)
+    a new multi-megabyte buffer for every chunk it sends.  Buffers are only allocated when they're first
+    needed, and at most max_buffers of them ever exist at once.
+    """
+
+    def __init__(self, buffer_size: int, max_buffers: int = 1):
+        self.buffer_size = max(int(buffer_size), 1)
+        self.max_buffers = max(int(max_buffers), 1)
+        self._free: List[bytearray] = []
+        self._allocated = 0
+        self._released = asyncio.Event()
+
+    def allocated(self) -> int:
+        return self._allocated
+
+    async def acquire(self) -> bytearray:
+        while True:
+            if len(self._free) > 0:
+                return self._free.pop()
+            if self._allocated < self.max_buffers:
+                self._allocated += 1
+                return bytearray(self.buffer_size)
+            self._released.clear()
+            await self._released.wait()
+
+    def release(self, buffer: bytearray):
+        self._free.append(buffer)
+        self._released.set()
+
+
+class MemoryViewPayload(Payload):
+    """
+    An aiohttp request body that sends a memoryview straight to the socket without copying it first,
+    which aiohttp would otherwise do for anything that isn't a bytes object.
+    """
+
+    def __init__(self, value: memoryview, *args: Any, **kwargs: Any):
+        kwargs.setdefault("content_type", "application/octet-stream")
+        super().__init__(value, *args, **kwargs)
+        self._size = value.nbytes
+
+    def decode(self, encoding: str = "utf-8", errors: str = "strict") -> str:
+        return bytes(self._value).decode(encoding, errors)
+
+    async def as_bytes(self, encoding: str = "utf-8", errors: str = "strict") -> bytes:
+        return bytes(self._value)
+
+    async def write(self, writer: AbstractStreamWriter) -> None:
+        for start in range(0, self._size, PAYLOAD_WRITE_SIZE):
+            await writer.write(self._value[start:start + PAYLOAD_WRITE_SIZE])
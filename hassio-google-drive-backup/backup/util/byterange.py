@@ -0,0 +1,51 @@
+import re
+from typing import List, Optional, Tuple
+
+RANGE_UNIT = "bytes="
+# Requests for more ranges than this get the whole file instead, since a huge number of tiny ranges is a
+# cheap way to make the server do a lot of work.
+MAX_RANGES = 16
+
+_RANGE_SPEC = re.compile("^\\s*(\\d*)\\s*-\\s*(\\d*)\\s*$")
+
+
+def parseRangeHeader(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parses an HTTP Range header for something with the given size into a sorted list of [start, end) byte
+    ranges, with overlapping ranges merged together.  Returns None if the header is missing or malformed, which
+    means it should be ignored and the whole thing sent, and an empty list if none of the ranges are
+    satisfiable.
+    """
+    if header is None or not header.strip().startswith(RANGE_UNIT):
+        return None
+    ranges = []
+    for spec in header.strip()[len(RANGE_UNIT):].split(","):
+        match = _RANGE_SPEC.match(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if len(first) == 0 and len(last) == 0:
+            return None
+        if len(first) == 0:
+            # A suffix range, ie the last N bytes
+            length = int(last)
+            if length > 0 and size > 0:
+                ranges.append((max(size - length, 0), size))
+            continue
+        start = int(first)
+        if len(last) > 0 and int(last) < start:
+            return None
+        end = size if len(last) == 0 else min(int(last) + 1, size)
+        if start < size:
+            ranges.append((start, end))
+
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
@@ -0,0 +1,184 @@
+from datetime import timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from ..exceptions import LogicError
+from ..time import Time
+from .asynchttpgetter import DEFAULT_CHUNK_SIZE, Stupid
+from .throughput_meter import ThroughputMeter
+
+
+class StreamSegment():
+    """
+    One part of a CompositeStream, either bytes kept in memory or a stream (like AsyncHttpGetter) that only
+    gets opened once something in it is read.
+    """
+
+    def __init__(self, size: int, data: Optional[bytes] = None, opener: Optional[Callable[[], Awaitable]] = None):
+        if (data is None) == (opener is None):
+            raise LogicError("A stream segment needs either data or an opener")
+        if data is not None and len(data) != size:
+            raise LogicError("A stream segment's data doesn't match its size")
+        self.size = size
+        self.data = data
+        self.opener = opener
+
+
+class CompositeStream:
+    """
+    Joins several segments together into one stream with the same interface as AsyncHttpGetter.  Only one
+    segment's stream is open at a time.
+    """
+
+    def __init__(self, segments: List[StreamSegment], time: Time):
+        self._segments = segments
+        self._starts = []
+        total = 0
+        for segment in segments:
+            self._starts.append(total)
+            total += segment.size
+        self._size = total
+        self._position = 0
+        self._open_index: Optional[int] = None
+        self._open_stream = None
+        self._meter = ThroughputMeter(time)
+        self._time = time
+        self._startTime = self._time.now()
+
+    async def setup(self):
+        self._meter.start()
+        return self._size
+
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return self.size()
+
+    def position(self, pos=None):
+        if pos is not None:
+            self._position = pos
+        return self._position
+
+    async def generator(self, chunk_size):
+        while True:
+            chunk = await self.read(chunk_size)
+            if len(chunk.getbuffer()) == 0:
+                break
+            yield chunk.getbuffer()
+
+    def progress(self):
+        if self._size == 0:
+            return 0
+        return 100 * float(self.position()) / float(self._size)
+
+    # return the estimated speed of the tranfser in bytes/second
+    def speed(self, period: timedelta = timedelta(seconds=10)):
+        return self._meter.rate(period)
+
+    def startTime(self):
+        return self._startTime
+
+    def __format__(self, format_spec: str) -> str:
+        return str(int(self.progress()))
+
+    async def read(self, count=DEFAULT_CHUNK_SIZE):
+        # Like AsyncHttpGetter, return exactly as many bytes as were asked for unless the stream ends first.
+        start = self._position
+        parts = []
+        remaining = min(count, self._size - self._position)
+        while remaining > 0:
+            data = await self._readSegment(remaining)
+            parts.append(data)
+            remaining -= len(data)
+            self._position += len(data)
+        self._meter.add(self._position - start)
+        if len(parts) == 1:
+            return Stupid(parts[0])
+        return Stupid(b"".join(parts))
+
+    async def _readSegment(self, count) -> bytes:
+        index = self._segmentAt(self._position)
+        segment = self._segments[index]
+        offset = self._position - self._starts[index]
+        needed = min(count, segment.size - offset)
+        if segment.data is not None:
+            return segment.data[offset:offset + needed]
+        stream = await self._open(index)
+        stream.position(offset)
+        data = (await stream.read(needed)).getvalue()
+        if len(data) != needed:
+            raise LogicError("A segment of a stream ended before it was supposed to")
+        return data
+
+    def _segmentAt(self, position: int) -> int:
+        # Segments are usually read in order, so check the open one and the one after it before searching
+        for index in [self._open_index, (self._open_index or 0) + 1]:
+            if index is not None and index < len(self._segments) and self._starts[index] <= position < self._starts[index] + self._segments[index].size:
+                return index
+        for index in range(len(self._segments)):
+            if position < self._starts[index] + self._segments[index].size:
+                return index
+        raise LogicError("Position is past the end of the stream")
+
+    async def _open(self, index: int):
+        if self._open_index != index:
+            await self.close()
+            stream = await self._segments[index].opener()
+            await stream.setup()
+            self._open_stream = stream
+            self._open_index = index
+        return self._open_stream
+
+    async def close(self):
+        if self._open_stream is not None:
+            await self._open_stream.__aexit__(None, None, None)
+        self._open_stream = None
+        self._open_index = None
+
+    async def __aenter__(self):
+        await self.setup()
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        val = await self.read()
+        if len(val) == 0:
+            raise StopAsyncIteration
+        return val.getbuffer()
+
+
+class RangeStream:
+    """
+    Reads a range of bytes from another stream as though it were its own stream, eg to upload one file from
+    inside a tar.
+    """
+
+    def __init__(self, source, start: int, size: int):
+        self._source = source
+        self._start = start
+        self._size = size
+        self._position = 0
+
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return self.size()
+
+    def position(self, pos=None):
+        if pos is not None:
+            self._position = pos
+        return self._position
+
+    async def read(self, count=DEFAULT_CHUNK_SIZE):
+        needed = min(count, self._size - self._position)
+        if needed <= 0:
+            return Stupid()
+        self._source.position(self._start + self._position)
+        data = await self._source.read(needed)
+        self._position += len(data.getbuffer())
+        return data
@@ -17,6 +17,11 @@ KEY_LAST_VERSION = "last_verison"
 KEY_UPGRADES = "upgrades"
 KEY_FLAGS = "flags"
 KEY_NOTE = "note"
+KEY_UPLOAD_SESSION = "upload_session"
+KEY_RESTORE_SPOOL = "restore_spool"
+KEY_DRIVE_CHANGES = "drive_changes"
+KEY_DRIVE_FOLDER = "drive_folder"
+KEY_HA_BACKUP_INFO = "ha_backup_info"
 
 CACHE_EXPIRATION_DAYS = 30
 
@@ -104,6 +109,87 @@ class DataCache:
             self.backups[slug] = {}
         return self.backups[slug]
 
+    @property
+    def uploadSession(self) -> Dict[str, Any]:
+        return self._data.get(KEY_UPLOAD_SESSION)
+
+    @uploadSession.setter
+    def uploadSession(self, session: Dict[str, Any]):
+        if session is None:
+            if KEY_UPLOAD_SESSION not in self._data:
+                return
+            del self._data[KEY_UPLOAD_SESSION]
+        elif self._data.get(KEY_UPLOAD_SESSION) == session:
+            return
+        else:
+            self._data[KEY_UPLOAD_SESSION] = session
+        self.makeDirty()
+
+    @property
+    def restoreSpool(self) -> Dict[str, Any]:
+        return self._data.get(KEY_RESTORE_SPOOL)
+
+    @restoreSpool.setter
+    def restoreSpool(self, spool: Dict[str, Any]):
+        if spool is None:
+            if KEY_RESTORE_SPOOL not in self._data:
+                return
+            del self._data[KEY_RESTORE_SPOOL]
+        elif self._data.get(KEY_RESTORE_SPOOL) == spool:
+            return
+        else:
+            # Copy it, since callers may keep changing the dict they passed in
+            self._data[KEY_RESTORE_SPOOL] = dict(spool)
+        self.makeDirty()
+
+    @property
+    def driveChanges(self) -> Dict[str, Any]:
+        return self._data.get(KEY_DRIVE_CHANGES)
+
+    @driveChanges.setter
+    def driveChanges(self, changes: Dict[str, Any]):
+        if changes is None:
+            if KEY_DRIVE_CHANGES not in self._data:
+                return
+            del self._data[KEY_DRIVE_CHANGES]
+        elif self._data.get(KEY_DRIVE_CHANGES) == changes:
+            return
+        else:
+            self._data[KEY_DRIVE_CHANGES] = changes
+        self.makeDirty()
+
+    @property
+    def driveFolder(self) -> Dict[str, Any]:
+        return self._data.get(KEY_DRIVE_FOLDER)
+
+    @driveFolder.setter
+    def driveFolder(self, folder: Dict[str, Any]):
+        if folder is None:
+            if KEY_DRIVE_FOLDER not in self._data:
+                return
+            del self._data[KEY_DRIVE_FOLDER]
+        elif self._data.get(KEY_DRIVE_FOLDER) == folder:
+            return
+        else:
+            self._data[KEY_DRIVE_FOLDER] = folder
+        self.makeDirty()
+
+    @property
+    def haBackupInfo(self) -> Dict[str, Any]:
+        return self._data.get(KEY_HA_BACKUP_INFO)
+
+    @haBackupInfo.setter
+    def haBackupInfo(self, info: Dict[str, Any]):
+        if info is None:
+            if KEY_HA_BACKUP_INFO not in self._data:
+                return
+            del self._data[KEY_HA_BACKUP_INFO]
+        elif self._data.get(KEY_HA_BACKUP_INFO) == info:
+            return
+        else:
+            self._data[KEY_HA_BACKUP_INFO] = info
+        self.makeDirty()
+
     def saveIfDirty(self):
         if self._dirty:
             # See if we need to remove any old entries
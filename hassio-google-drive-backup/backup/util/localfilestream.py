@@ -0,0 +1,120 @@
+import asyncio
+import io
+import os
+from datetime import timedelta
+
+from ..exceptions import LogicError
+from ..time import Time
+from .asynchttpgetter import DEFAULT_CHUNK_SIZE, Stupid
+from .throughput_meter import ThroughputMeter
+
+
+class LocalFileStream:
+    """
+    Reads a file on disk with the same interface as AsyncHttpGetter, so a backup that's available
+    in the backup directory can be read directly instead of downloading it from the supervisor.
+    """
+
+    def __init__(self, path: str, time: Time):
+        self._path = path
+        self._position = 0
+        self._size: int = None
+        # Held open from setup() until the stream is closed, so if the supervisor deletes or replaces the backup
+        # partway through this keeps reading the file it started with.
+        self._file: io.FileIO = None
+        self._meter = ThroughputMeter(time)
+        self._time = time
+        self._startTime = self._time.now()
+
+    def path(self) -> str:
+        return self._path
+
+    def file(self) -> io.FileIO:
+        """The open file being read, once the stream is set up"""
+        self._ensureOpen()
+        return self._file
+
+    async def setup(self):
+        self.close()
+        self._file = io.FileIO(self._path, "r")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._meter.start()
+        return self._size
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _ensureSetup(self):
+        if self._size is None:
+            raise LogicError("LocalFileStream.setup() must be called first")
+
+    def _ensureOpen(self):
+        if self._file is None:
+            raise LogicError("LocalFileStream must be set up and not yet closed to be read")
+
+    def size(self) -> int:
+        self._ensureSetup()
+        return self._size
+
+    def __len__(self):
+        return self.size()
+
+    def position(self, pos=None):
+        if pos is not None:
+            self._position = pos
+        return self._position
+
+    async def generator(self, chunk_size):
+        while True:
+            chunk = await self.read(chunk_size)
+            if len(chunk.getbuffer()) == 0:
+                break
+            yield chunk.getbuffer()
+
+    def progress(self):
+        self._ensureSetup()
+        if self._size == 0:
+            return 0
+        return 100 * float(self.position()) / float(self._size)
+
+    # return the estimated speed of the tranfser in bytes/second
+    def speed(self, period: timedelta = timedelta(seconds=10)):
+        return self._meter.rate(period)
+
+    def startTime(self):
+        return self._startTime
+
+    def __format__(self, format_spec: str) -> str:
+        return str(int(self.progress()))
+
+    async def read(self, count=DEFAULT_CHUNK_SIZE):
+        self._ensureOpen()
+        ret = Stupid()
+        needed = min(count, self._size - self._position)
+        if needed <= 0:
+            return ret
+        data = await asyncio.get_running_loop().run_in_executor(None, os.pread, self._file.fileno(), needed, self._position)
+        if len(data) != needed:
+            raise LogicError("Backup file '{0}' changed size while it was being read".format(self._path))
+        ret = Stupid(data)
+        self._position += len(data)
+        self._meter.add(len(data))
+        ret.seek(0)
+        return ret
+
+    async def __aenter__(self):
+        await self.setup()
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        val = await self.read()
+        if len(val) == 0:
+            raise StopAsyncIteration
+        return val.getbuffer()
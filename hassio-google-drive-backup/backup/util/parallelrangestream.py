@@ -0,0 +1,191 @@
+import asyncio
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict
+
+from ..exceptions import LogicError
+from ..time import Time
+from .asynchttpgetter import DEFAULT_CHUNK_SIZE, Stupid
+from .throughput_meter import ThroughputMeter
+
+
+class ParallelRangeStream():
+    """
+    Downloads a file as fixed size parts using several range requests at once, and hands the parts back in
+    order with the same interface as AsyncHttpGetter.  A single connection to Google is often much slower than
+    the link it's on, so this can make restoring a large backup several times faster.  Parts are only fetched
+    up to max_parts ahead of the consumer, which bounds how much memory gets used while waiting on a slow
+    part or a slow consumer.  Nothing gets fetched until the first read, so seeking first (eg to resume a
+    download part way through) doesn't waste any requests on the beginning of the file.
+    """
+
+    def __init__(self, fetch: Callable[[int, int], Awaitable[bytes]], size: int, time: Time, connections: int, part_size: int, max_parts: int = None):
+        # fetch(start, end) returns the bytes of the file in [start, end)
+        self._fetch = fetch
+        self._size = size
+        self._time = time
+        self._connections = max(int(connections), 1)
+        self._part_size = max(int(part_size), 1)
+        self._max_parts = max(max_parts or self._connections * 2, self._connections)
+        self._part_count = (size + self._part_size - 1) // self._part_size
+
+        self._position = 0
+        # How far the read in progress has gotten.  The position only moves there once the whole read succeeds,
+        # but parts get scheduled around it so a read spanning many parts doesn't cancel the ones it's waiting on.
+        self._cursor = 0
+        # Parts that finished downloading but haven't been read past yet, by their index
+        self._parts: Dict[int, bytes] = {}
+        # Parts being downloaded (or that failed to download) by their index
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+        self._meter = ThroughputMeter(time)
+        self._startTime = self._time.now()
+
+    async def setup(self):
+        self._meter.start()
+        return self._size
+
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return self.size()
+
+    def position(self, pos=None):
+        if pos is not None:
+            self._position = pos
+            self._cursor = pos
+        return self._position
+
+    def buffered(self) -> int:
+        return sum(len(part) for part in self._parts.values())
+
+    def downloading(self) -> int:
+        return len([task for task in self._tasks.values() if not task.done()])
+
+    async def generator(self, chunk_size):
+        while True:
+            chunk = await self.read(chunk_size)
+            if len(chunk.getbuffer()) == 0:
+                break
+            yield chunk.getbuffer()
+
+    def progress(self):
+        if self._size == 0:
+            return 0
+        return 100 * float(self.position()) / float(self._size)
+
+    # return the estimated speed of the tranfser in bytes/second
+    def speed(self, period: timedelta = timedelta(seconds=10)):
+        return self._meter.rate(period)
+
+    def startTime(self):
+        return self._startTime
+
+    def __format__(self, format_spec: str) -> str:
+        return str(int(self.progress()))
+
+    async def read(self, count=DEFAULT_CHUNK_SIZE):
+        start = self._position
+        pieces = []
+        remaining = min(count, self._size - self._position)
+        self._cursor = start
+        try:
+            while remaining > 0:
+                index = self._cursor // self._part_size
+                part = await self._part(index)
+                offset = self._cursor - index * self._part_size
+                piece = part[offset:offset + remaining]
+                if len(piece) == 0:
+                    raise LogicError("A part of the download was shorter than it was supposed to be")
+                pieces.append(piece)
+                remaining -= len(piece)
+                self._cursor += len(piece)
+        except BaseException:
+            # Nothing was returned, so the next read has to start from the same place
+            self._cursor = start
+            raise
+        self._position = self._cursor
+        self._schedule()
+        self._meter.add(self._position - start)
+        if len(pieces) == 1:
+            return Stupid(pieces[0])
+        return Stupid(b"".join(pieces))
+
+    async def _part(self, index: int) -> bytes:
+        self._schedule()
+        while index not in self._parts:
+            task = self._tasks.get(index)
+            if task is None:
+                # Every connection is busy with later parts (eg after seeking), but this is the one that's needed
+                task = self._start(index)
+            # Wait without letting a cancelled read cancel the download, other reads may still want it.
+            await asyncio.wait([task])
+            if index not in self._parts and self._tasks.get(index) is task:
+                # The download failed, so forget it.  Reading this part again will try again.
+                del self._tasks[index]
+                task.result()
+        return self._parts[index]
+
+    def _schedule(self):
+        first = self._cursor // self._part_size
+        last = min(first + self._max_parts, self._part_count)
+
+        # Forget about parts that are behind the consumer or too far ahead of it, eg after seeking
+        for index in list(self._parts.keys()):
+            if index < first or index >= last:
+                del self._parts[index]
+        for index in list(self._tasks.keys()):
+            if index < first or index >= last:
+                task = self._tasks.pop(index)
+                if task.done() and not task.cancelled():
+                    # Nobody needs this part anymore, but retrieve its error so asyncio doesn't complain about it
+                    task.exception()
+                task.cancel()
+
+        running = self.downloading()
+        for index in range(first, last):
+            if running >= self._connections:
+                break
+            if index in self._parts or index in self._tasks:
+                continue
+            self._start(index)
+            running += 1
+
+    def _start(self, index: int) -> asyncio.Task:
+        task = asyncio.create_task(self._download(index), name="Download part {0}".format(index))
+        self._tasks[index] = task
+        return task
+
+    async def _download(self, index: int):
+        start = index * self._part_size
+        end = min(start + self._part_size, self._size)
+        data = await self._fetch(start, end)
+        if len(data) != end - start:
+            raise LogicError("A part of the download was a different size than requested")
+        self._parts[index] = data
+        self._tasks.pop(index, None)
+        self._schedule()
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        self._parts.clear()
+        for task in tasks:
+            task.cancel()
+        # Wait for everything to stop, which also keeps asyncio from complaining about errors nobody saw
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        await self.setup()
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        val = await self.read()
+        if len(val) == 0:
+            raise StopAsyncIteration
+        return val.getbuffer()
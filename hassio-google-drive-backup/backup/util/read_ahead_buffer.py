@@ -0,0 +1,119 @@
+import asyncio
+from collections import deque
+from typing import Callable
+
+
+class ReadAheadBuffer():
+    """
+    Holds bytes a background task has read ahead of a consumer, and lets the two wait on each other.  The reader
+    fills it with put() until space() runs out, and the consumer waits for what it needs with waitFor() before
+    taking it.  Chunks are kept as the reader supplied them instead of being copied into one big buffer.
+    """
+
+    def __init__(self, limit: int):
+        self._limit = max(int(limit), 0)
+        self._chunks = deque()
+        self._buffered = 0
+        self._error: Exception = None
+        self._ended = False
+
+        # How much the consumer is currently waiting on, which may be more than the limit
+        self._wanted = 0
+        self._dataReady = asyncio.Event()
+        self._spaceReady = asyncio.Event()
+
+    def buffered(self) -> int:
+        return self._buffered
+
+    def space(self) -> int:
+        """How many more bytes the reader should put into the buffer"""
+        return max(self._limit, self._wanted) - self._buffered
+
+    def put(self, chunk):
+        self._chunks.append(chunk)
+        self._buffered += len(chunk)
+        self._dataReady.set()
+
+    def fail(self, error: Exception):
+        """Hands the reader's error to the consumer, once it's taken everything before it"""
+        self._error = error
+        self._dataReady.set()
+
+    def end(self):
+        """Lets the consumer know nothing more is coming, eg because the source ended early"""
+        self._ended = True
+        self._dataReady.set()
+
+    async def waitForSpace(self):
+        self._spaceReady.clear()
+        await self._spaceReady.wait()
+
+    def clear(self):
+        """Drops everything buffered, along with any error or end the reader reported for it"""
+        self._chunks.clear()
+        self._buffered = 0
+        self._error = None
+        self._ended = False
+        self._spaceReady.set()
+
+    async def waitFor(self, needed: int, startReading: Callable[[], None]) -> int:
+        """
+        Waits until needed bytes are buffered, calling startReading() to make sure something is filling the buffer.
+        Returns how many bytes can be taken, which is only less than needed if the reader ended.
+        """
+        if needed > self._wanted:
+            self._wanted = needed
+            self._spaceReady.set()
+        try:
+            while self._buffered < needed:
+                if self._error is not None:
+                    error = self._error
+                    self._error = None
+                    raise error
+                if self._ended:
+                    return self._buffered
+                startReading()
+                self._dataReady.clear()
+                await self._dataReady.wait()
+            return needed
+        finally:
+            self._wanted = 0
+
+    def take(self, count: int):
+        """Removes and returns the next count bytes, without copying them if they're all in one chunk"""
+        if len(self._chunks[0]) == count:
+            # The common case, where nothing needs to be copied
+            chunk = self._chunks[0]
+            self.skip(count)
+            return chunk
+        parts = []
+        remaining = count
+        while remaining > 0:
+            part = self._chunks[0][:remaining]
+            parts.append(part)
+            remaining -= len(part)
+            self.skip(len(part))
+        return b"".join(parts)
+
+    def takeInto(self, buffer: memoryview, count: int):
+        """Removes the next count bytes, copying them into the start of buffer"""
+        copied = 0
+        while copied < count:
+            chunk = self._chunks[0]
+            length = min(len(chunk), count - copied)
+            buffer[copied:copied + length] = chunk[:length]
+            copied += length
+            self.skip(length)
+
+    def skip(self, count: int):
+        """Drops the first count buffered bytes, once the consumer has them or doesn't need them"""
+        self._buffered -= count
+        while count > 0:
+            chunk = self._chunks[0]
+            if len(chunk) <= count:
+                count -= len(chunk)
+                self._chunks.popleft()
+            else:
+                self._chunks[0] = chunk[count:]
+                count = 0
+        self._spaceReady.set()
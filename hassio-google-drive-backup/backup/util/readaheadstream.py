@@ -0,0 +1,101 @@
+import asyncio
+import io
+
+from .asynchttpgetter import DEFAULT_CHUNK_SIZE
+from .read_ahead_buffer import ReadAheadBuffer
+
+
+class ReadAheadStream():
+    """
+    Wraps a stream (eg an AsyncHttpGetter) and keeps up to max_buffered bytes read ahead of the consumer
+    in a background task.  This lets reading the next chunk from the source overlap with whatever the
+    consumer is doing with the last one, eg sending it to Google Drive.
+    """
+
+    def __init__(self, stream, max_buffered: int, read_size: int = DEFAULT_CHUNK_SIZE):
+        self._stream = stream
+        self._read_size = max(int(read_size), 1)
+
+        # Bytes read from the source but not yet handed to the consumer, starting at self._position
+        self._buffer = ReadAheadBuffer(max(int(max_buffered), 1))
+        self._position = stream.position()
+
+        # Where the background reader should move the source stream before its next read
+        self._seek = None
+        self._task: asyncio.Task = None
+
+    def size(self) -> int:
+        return self._stream.size()
+
+    def position(self, pos=None):
+        if pos is not None and pos != self._position:
+            if self._position < pos <= self._position + self._buffer.buffered():
+                # The new position is already buffered, so just skip ahead
+                self._buffer.skip(pos - self._position)
+            else:
+                self._buffer.clear()
+                self._seek = pos
+            self._position = pos
+        return self._position
+
+    def buffered(self) -> int:
+        return self._buffer.buffered()
+
+    async def read(self, count=DEFAULT_CHUNK_SIZE) -> io.BytesIO:
+        ret = bytearray(max(min(count, self.size() - self._position), 0))
+        read = await self.readinto(memoryview(ret))
+        del ret[read:]
+        return io.BytesIO(ret)
+
+    async def readinto(self, buffer: memoryview) -> int:
+        """
+        Fills the given buffer with the next bytes from the stream, returning how many bytes were copied.  This
+        is only less than the size of the buffer at the end of the stream.
+        """
+        needed = max(min(buffer.nbytes, self.size() - self._position), 0)
+        # This only comes back with less than was needed if the source ended early
+        needed = await self._buffer.waitFor(needed, self._ensureReading)
+        self._buffer.takeInto(buffer, needed)
+        self._position += needed
+        return needed
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _ensureReading(self):
+        if self._task is None or self._task.done():
+            if self._seek is None:
+                self._seek = self._position + self._buffer.buffered()
+            self._task = asyncio.create_task(self._fill(), name="Read ahead stream")
+
+    async def _fill(self):
+        try:
+            while True:
+                if self._seek is not None:
+                    self._stream.position(self._seek)
+                    self._seek = None
+                space = self._buffer.space()
+                if space <= 0 or self._stream.position() >= self._stream.size():
+                    await self._buffer.waitForSpace()
+                    continue
+                data = await self._stream.read(min(self._read_size, space))
+                if self._seek is not None:
+                    # The consumer moved elsewhere while this was being read, so it's no longer useful.
+                    continue
+                # getvalue() doesn't make a copy when the BytesIO was created from a bytes object
+                chunk = memoryview(data.getvalue())
+                if chunk.nbytes == 0:
+                    self._buffer.end()
+                    await self._buffer.waitForSpace()
+                    continue
+                self._buffer.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._buffer.fail(e)
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from ..time import Time
+
+
+class ResponseCache:
+    """
+    Remembers the bodies of responses along with the ETag the server gave them, so the same request can be sent
+    again with If-None-Match and the remembered body used if the server says nothing changed (304).  Entries
+    expire after ttl, and the least recently used ones get dropped once the bodies add up to more than
+    max_bytes.
+    """
+
+    def __init__(self, time: Time, max_bytes: int, ttl: timedelta):
+        self._time = time
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries: OrderedDict[str, Tuple[str, str, datetime]] = OrderedDict()
+        self._bytes = 0
+
+    def size(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """Returns the (etag, body) remembered for key, or None if there isn't one"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        etag, body, stored = entry
+        if self._time.now() >= stored + self._ttl:
+            self.remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return etag, body
+
+    def put(self, key: str, etag: str, body: str):
+        self.remove(key)
+        if len(body) > self._max_bytes:
+            return
+        self._entries[key] = (etag, body, self._time.now())
+        self._bytes += len(body)
+        while self._bytes > self._max_bytes:
+            self.remove(next(iter(self._entries)))
+
+    def refresh(self, key: str):
+        """Restarts the expiration of an entry, eg because the server just confirmed it's still current"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries[key] = (entry[0], entry[1], self._time.now())
+            self._entries.move_to_end(key)
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
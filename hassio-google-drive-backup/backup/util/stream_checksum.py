@@ -0,0 +1,43 @@
+import hashlib
+from typing import Optional
+
+
+class StreamChecksum():
+    """
+    Computes the MD5 and SHA-256 of a stream incrementally from the chunks as they get sent somewhere, so
+    verifying a transfer doesn't need a second read of the whole file.  Chunks can be given more than once
+    (eg when an upload has to seek backward) and only the bytes that haven't been hashed yet are used.
+    If a chunk skips ahead, the bytes in between are never seen so the checksum can't be known.
+    """
+
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self._position = 0
+        self._valid = True
+
+    def position(self) -> int:
+        return self._position
+
+    def valid(self) -> bool:
+        return self._valid
+
+    def update(self, start: int, data):
+        if not self._valid:
+            return
+        if start > self._position:
+            self._valid = False
+            return
+        skip = self._position - start
+        if skip >= len(data):
+            return
+        data = memoryview(data)[skip:]
+        self._md5.update(data)
+        self._sha256.update(data)
+        self._position += len(data)
+
+    def md5(self) -> Optional[str]:
+        return self._md5.hexdigest() if self._valid else None
+
+    def sha256(self) -> Optional[str]:
+        return self._sha256.hexdigest() if self._valid else None
@@ -0,0 +1,97 @@
+import math
+import tarfile
+from typing import List, Optional
+
+TAR_BLOCK_SIZE = 512
+# Members of these types are only a header, they have no data following them even if a size is given
+NO_DATA_TYPES = (tarfile.LNKTYPE, tarfile.SYMTYPE, tarfile.DIRTYPE, tarfile.CHRTYPE, tarfile.BLKTYPE, tarfile.FIFOTYPE)
+
+
+class TarSegment():
+    """
+    A range of bytes in a tar file.  Segments with a name hold the contents of a file inside the tar (for a
+    Home Assistant backup, the archive for an addon or folder), everything else (headers, padding, small
+    files) has no name.
+    """
+
+    def __init__(self, start: int, size: int, name: Optional[str] = None):
+        self.start = start
+        self.size = size
+        self.name = name
+
+    def isFile(self) -> bool:
+        return self.name is not None
+
+    def __eq__(self, other):
+        return isinstance(other, TarSegment) and (self.start, self.size, self.name) == (other.start, other.size, other.name)
+
+    def __repr__(self) -> str:
+        return "<TarSegment {0}-{1} {2}>".format(self.start, self.start + self.size, self.name)
+
+
+def _parsePax(data: bytes):
+    # Pax extended headers are a series of "<length> <key>=<value>\n" records
+    ret = {}
+    position = 0
+    while position < len(data):
+        space = data.index(b" ", position)
+        length = int(data[position:space])
+        key, value = data[space + 1:position + length - 1].split(b"=", 1)
+        ret[key.decode("utf-8")] = value.decode("utf-8", "surrogateescape")
+        position += length
+    return ret
+
+
+async def scanTarLayout(stream, minimum_file_size: int = 0) -> Optional[List[TarSegment]]:
+    """
+    Reads the headers of a tar file from a stream (like AsyncHttpGetter) and splits the file into segments
+    that cover all of it in order, with one segment for the contents of each file inside it that's at least
+    minimum_file_size bytes.  Only the headers get read, the stream is seeked over the contents of each
+    file.  Returns None if the stream isn't a tar file.
+    """
+    size = stream.size()
+    segments: List[TarSegment] = []
+    inline_start = 0
+    offset = 0
+    extended = {}
+    while offset + TAR_BLOCK_SIZE <= size:
+        stream.position(offset)
+        header = (await stream.read(TAR_BLOCK_SIZE)).getvalue()
+        try:
+            info = tarfile.TarInfo.frombuf(header, tarfile.ENCODING, "surrogateescape")
+        except (tarfile.EmptyHeaderError, tarfile.EOFHeaderError):
+            # The end of the archive
+            break
+        except tarfile.HeaderError:
+            if offset == 0:
+                return None
+            raise
+
+        data_start = offset + TAR_BLOCK_SIZE
+        if info.type in (tarfile.XHDTYPE, tarfile.GNUTYPE_LONGNAME):
+            # These describe the member that follows them, most importantly its real size and name
+            stream.position(data_start)
+            data = (await stream.read(info.size)).getvalue()
+            if info.type == tarfile.XHDTYPE:
+                extended.update(_parsePax(data))
+            else:
+                extended["path"] = data.rstrip(b"\0").decode(tarfile.ENCODING, "surrogateescape")
+            offset = data_start + math.ceil(info.size / TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+            continue
+
+        name = extended.get("path", info.name)
+        member_size = int(extended.get("size", info.size))
+        extended = {}
+        if info.type in (tarfile.REGTYPE, tarfile.AREGTYPE) and member_size >= max(minimum_file_size, 1):
+            if data_start > inline_start:
+                segments.append(TarSegment(inline_start, data_start - inline_start))
+            segments.append(TarSegment(data_start, member_size, name))
+            inline_start = data_start + member_size
+        if info.type in NO_DATA_TYPES:
+            offset = data_start
+        else:
+            offset = data_start + math.ceil(member_size / TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+
+    if size > inline_start:
+        segments.append(TarSegment(inline_start, size - inline_start))
+    return segments
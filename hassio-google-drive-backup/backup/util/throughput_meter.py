@@ -0,0 +1,117 @@
+import math
+from datetime import timedelta
+from typing import List, Optional
+
+from ..time import Time
+
+# Resolution and reach of the meter's history.  Windows can be at most BUCKET_SECONDS * BUCKET_COUNT long.
+BUCKET_SECONDS = 0.5
+BUCKET_COUNT = 240
+
+
+class ThroughputMeter():
+    """
+    Measures the speed of a transfer in bytes/second, averaged over a window of recent time.  Instead of
+    keeping every read and integrating over them each time the speed is asked for (which the UI does on
+    every status poll), it keeps how many bytes had been transferred at each boundary of a fixed ring of
+    time buckets.  Recording a read and asking for the speed over any window are then both constant time.
+
+    Between reads the transfer is treated as going at a steady rate, and after the last read it's assumed to
+    keep going at the rate of the last read for one window before decaying to zero over the next.
+    """
+
+    def __init__(self, time: Time, bucket_seconds: float = BUCKET_SECONDS, bucket_count: int = BUCKET_COUNT):
+        self._time = time
+        self._bucket_seconds = bucket_seconds
+        self._bucket_count = bucket_count
+        # Bytes transferred as of each bucket boundary, and which boundary each slot currently holds
+        self._boundaries: List[float] = [0.0] * bucket_count
+        self._boundary_indexes: List[int] = [-1] * bucket_count
+
+        self._origin = None
+        self._samples = 0
+        self._first_seconds = 0.0
+        self._last_seconds = 0.0
+        self._last_total = 0
+        self._last_rate = 0.0
+        self._total = 0
+
+    def start(self):
+        """Starts measuring from now, if it hasn't started already"""
+        if self._origin is None:
+            self._origin = self._time.now()
+            self._samples = 1
+
+    def total(self) -> int:
+        return self._total
+
+    def add(self, count: int):
+        """Records that count more bytes were just transferred"""
+        if self._origin is None:
+            self.start()
+        now = self._seconds(self._time.now())
+        self._total += count
+        if now <= self._last_seconds:
+            # Another read at the same instant, which just adds to the last one
+            self._last_total = self._total
+            return
+
+        elapsed = now - self._last_seconds
+        self._last_rate = (self._total - self._last_total) / elapsed
+
+        # Fill in the boundaries crossed since the last read, but never more than the ring can hold
+        first = max(math.floor(self._last_seconds / self._bucket_seconds) + 1,
+                    math.floor(now / self._bucket_seconds) - self._bucket_count + 1)
+        for index in range(first, math.floor(now / self._bucket_seconds) + 1):
+            boundary = index * self._bucket_seconds
+            self._boundaries[index % self._bucket_count] = self._last_total + self._last_rate * (boundary - self._last_seconds)
+            self._boundary_indexes[index % self._bucket_count] = index
+
+        self._last_seconds = now
+        self._last_total = self._total
+        self._samples += 1
+
+    def rate(self, period: timedelta = timedelta(seconds=10)) -> Optional[float]:
+        """Bytes/second over the last period, or None if there haven't been any reads yet"""
+        if self._samples < 2:
+            return None
+        now = self._seconds(self._time.now())
+        window = period.total_seconds()
+        since_last = now - self._last_seconds
+        if since_last > window:
+            # linear decay the "estimated" rate over the period
+            if since_last - window > window:
+                return 0
+            return self._last_rate * (1 - (since_last - window) / window)
+
+        oldest = (math.floor(self._last_seconds / self._bucket_seconds) - self._bucket_count + 1) * self._bucket_seconds
+        start = max(now - window, self._first_seconds, oldest)
+        if now <= start:
+            return self._last_rate
+        transferred = self._last_total + self._last_rate * since_last - self._totalAt(start)
+        return transferred / (now - start)
+
+    def _seconds(self, when) -> float:
+        return (when - self._origin).total_seconds()
+
+    def _totalAt(self, seconds: float) -> float:
+        # How much had been transferred at a moment in the past, interpolating between the closest boundaries
+        # (or the first and last reads).
+        if seconds >= self._last_seconds:
+            return self._last_total + self._last_rate * (seconds - self._last_seconds)
+        index = math.floor(seconds / self._bucket_seconds)
+        left_seconds, left_total = self._boundaryOr(index, self._first_seconds, 0)
+        right_seconds, right_total = self._boundaryOr(index + 1, self._last_seconds, self._last_total)
+        if left_seconds > seconds:
+            left_seconds, left_total = self._first_seconds, 0
+        if right_seconds < seconds or right_seconds > self._last_seconds:
+            right_seconds, right_total = self._last_seconds, self._last_total
+        if right_seconds <= left_seconds:
+            return left_total
+        return left_total + (right_total - left_total) * (seconds - left_seconds) / (right_seconds - left_seconds)
+
+    def _boundaryOr(self, index: int, default_seconds: float, default_total: float):
+        slot = index % self._bucket_count
+        if index >= 0 and self._boundary_indexes[slot] == index:
+            return index * self._bucket_seconds, self._boundaries[slot]
+        return default_seconds, default_total
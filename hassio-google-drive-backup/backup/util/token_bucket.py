@@ -1,3 +1,5 @@
+import asyncio
+
 from ..time import Time
 from injector import inject, singleton
 
@@ -18,6 +20,9 @@ class TokenBucket:
             self.tokens = float(capacity)
         self.timestamp = self._time.monotonic()
 
+        # Makes callers waiting on tokens take turns, otherwise they'd all wait for (and then take) the same tokens.
+        self._waiting = asyncio.Lock()
+
     def consume(self, tokens):
         """
         Attempts to consume the given number of tokens, returning true if there were enough tokenas availabel and 
@@ -37,6 +42,10 @@ class TokenBucket:
         - Else consumes as many tokens as are available
         Always returns the positive number of tokens consumed.
         """
+        async with self._waiting:
+            return await self._consumeWithWait(min_tokens, max_tokens)
+
+    async def _consumeWithWait(self, min_tokens: int, max_tokens: int):
         self._refill()
         if self.tokens >= max_tokens:
             self.consume(max_tokens)
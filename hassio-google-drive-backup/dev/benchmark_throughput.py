@@ -0,0 +1,103 @@
+import argparse
+from collections import deque
+from datetime import timedelta
+from time import perf_counter
+
+from backup.util import ThroughputMeter
+from tests.faketime import FakeTime
+
+# Compares the cost of asking for a transfer's speed with the ThroughputMeter against how it was done before,
+# which kept the last 50 reads and integrated over all of them on every query.  Run it from the addon's
+# directory with "python -m dev.benchmark_throughput".  Time is faked, so only the time spent computing speeds
+# gets measured.
+
+HISTORY = 50
+PERIOD = timedelta(seconds=10)
+
+
+def legacySpeed(history, now, period: timedelta = timedelta(seconds=10)):
+    """How speed was estimated before, from a history of [time, position] pairs"""
+    if len(history) < 2:
+        return None
+    intervals = []
+    current = history[0]
+    last_speed = 0
+    for x in range(1, len(history)):
+        next = history[x]
+        seconds = (next[0] - current[0]).total_seconds()
+        data = next[1] - current[1]
+        if seconds == 0:
+            speed = 0
+        else:
+            speed = data / seconds
+        intervals.append([current[0], next[0], speed])
+        current = next
+        last_speed = speed
+
+    time_since_last = now - current[0]
+    if time_since_last > period:
+        diff = time_since_last - period
+        if diff > period:
+            return 0
+        else:
+            return last_speed * (1 - diff.total_seconds() / period.total_seconds())
+
+    intervals.append([current[0], now, last_speed])
+    stop = now
+    start = now - period
+    total = 0
+    minimum_time = now
+    for interval in intervals:
+        if start > interval[1]:
+            continue
+        if stop < interval[0]:
+            continue
+        overlap_start = max(start, interval[0])
+        overlap_stop = min(stop, interval[1])
+        if overlap_stop > overlap_start:
+            total += (overlap_stop - overlap_start).total_seconds() * interval[2]
+        if overlap_start < minimum_time:
+            minimum_time = overlap_start
+    return total / (now - minimum_time).total_seconds()
+
+
+def benchmark(reads: int):
+    """Returns the seconds spent on speed queries by the old estimate and by the ThroughputMeter"""
+    time = FakeTime()
+    meter = ThroughputMeter(time)
+    meter.start()
+    history = deque([[time.now(), 0]])
+    position = 0
+
+    legacy_seconds = 0
+    meter_seconds = 0
+    for x in range(reads):
+        time.advance(seconds=0.1)
+        position += 1024
+        history.append([time.now(), position])
+        if len(history) > HISTORY:
+            history.popleft()
+        meter.add(1024)
+
+        start = perf_counter()
+        legacySpeed(history, time.now(), PERIOD)
+        legacy_seconds += perf_counter() - start
+
+        start = perf_counter()
+        meter.rate(PERIOD)
+        meter_seconds += perf_counter() - start
+    return legacy_seconds, meter_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reads", help="How many reads to simulate, with a speed query after each one.", type=int, default=100000)
+    args = parser.parse_args()
+
+    legacy_seconds, meter_seconds = benchmark(args.reads)
+    print("Legacy speed estimate: {0:.1f}us per query".format(legacy_seconds * 1000000 / args.reads))
+    print("ThroughputMeter:       {0:.1f}us per query".format(meter_seconds * 1000000 / args.reads))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 import re
+import hashlib
+import json
+
+from http import HTTPStatus
 
 from yarl import URL
 from datetime import timedelta
@@ -21,12 +25,20 @@ logger = getLogger(__name__)
 mimeTypeQueryPattern = re.compile("^mimeType='.*'$")
 parentsQueryPattern = re.compile("^'.*' in parents$")
 resumeBytesPattern = re.compile("^bytes \\*/\\d+$")
+boundaryPattern = re.compile("boundary=\"?([^\";]+)\"?")
+batchFilePattern = re.compile("^/drive/v3/files/([^/]+)/?$")
 
 URL_MATCH_DRIVE_API = "^.*drive.*$"
 URL_MATCH_UPLOAD = "^/upload/drive/v3/files/$"
 URL_MATCH_UPLOAD_PROGRESS = "^/upload/drive/v3/files/progress/.*$"
 URL_MATCH_CREATE = "^/upload/drive/v3/files/progress/.*$"
 URL_MATCH_FILE = "^/drive/v3/files/.*$"
+URL_MATCH_BATCH = "^/batch/drive/v3$"
+URL_MATCH_CHANGES = "^/drive/v3/changes$"
+URL_MATCH_CHANGES_TOKEN = "^/drive/v3/changes/startPageToken$"
+
+# How many changes tokens are remembered before the oldest stop being accepted
+MAX_CHANGE_TOKENS = 100
 URL_MATCH_DEVICE_CODE = "^/device/code$"
 URL_MATCH_TOKEN = "^/token$"
 
@@ -54,6 +66,17 @@ class SimulatedGoogle(BaseServer):
         self.space_available = 5 * 1024 * 1024 * 1024
         self.usage = 0
 
+        # How many requests were in each batch request received
+        self.batches = []
+
+        # How many requests were answered with 304 because the caller already had the current response
+        self.not_modified = 0
+
+        # What every item looked like when each changes token was issued.  The changes feed compares against them
+        # instead of recording each change, so tests can still change self.items directly.
+        self._change_snapshots: Dict[str, Dict[str, Any]] = {}
+        self._next_change_token = 1
+
         # Upload state information
         self._upload_info: Dict[str, Any] = {}
         self.chunks = []
@@ -64,9 +87,30 @@ class SimulatedGoogle(BaseServer):
         self.device_auth_params = {}
         self._device_code_accepted = None
 
+        # Simulated network conditions for uploads
+        self._upload_bytes_per_second = None
+        self._upload_latency_seconds = 0
+        self._corrupt_uploads = False
+
     def setDriveSpaceAvailable(self, bytes_available):
         self.space_available = bytes_available
 
+    def setUploadProfile(self, bytes_per_second=None, latency_seconds=0):
+        """Makes upload requests take as long as they would over a connection with the given speed and latency"""
+        self._upload_bytes_per_second = bytes_per_second
+        self._upload_latency_seconds = latency_seconds
+
+    def setCorruptUploads(self, corrupt=True):
+        """Makes uploads store a different byte than was received, like they'd been damaged in transit"""
+        self._corrupt_uploads = corrupt
+
+    async def _simulateUploadTime(self, size):
+        seconds = self._upload_latency_seconds
+        if self._upload_bytes_per_second:
+            seconds += size / self._upload_bytes_per_second
+        if seconds > 0:
+            await self._time.sleepAsync(seconds)
+
     def generateNewAccessToken(self):
         new_token = self.generateId(20)
         self._auth_token = new_token
@@ -102,6 +146,9 @@ class SimulatedGoogle(BaseServer):
             get('/drive/v3/files/', self._query),
             delete('/drive/v3/files/{id}/', self._delete),
             patch('/drive/v3/files/{id}/', self._update),
+            post('/batch/drive/v3', self._batch),
+            get('/drive/v3/changes/startPageToken', self._changesToken),
+            get('/drive/v3/changes', self._changes),
             get('/drive/v3/files/{id}/', self._get),
             post('/oauth2/v4/token', self._oauth2Token),
             get('/o/oauth2/v2/auth', self._oAuth2Authorize),
@@ -341,23 +388,116 @@ class SimulatedGoogle(BaseServer):
             return self.serve_bytes(request, item['bytes'], include_length=False)
         else:
             fields = request.query.get("fields", "id").split(",")
-            return json_response(self.filter_fields(self.items[id], fields))
+            return self._etagResponse(request, self.filter_fields(self.items[id], fields))
+
+    def _etagResponse(self, request: Request, data):
+        etag = '"{0}"'.format(hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest())
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return Response(status=304, headers={"ETag": etag})
+        return json_response(data, headers={"ETag": etag})
 
     async def _update(self, request: Request):
         id = request.match_info.get('id')
         await self._checkDriveHeaders(request)
         if id not in self.items:
             return HTTPNotFound
-        update = await request.json()
+        self._applyUpdate(id, await request.json())
+        return Response()
+
+    def _applyUpdate(self, id, update):
         for key in update:
             if key in self.items[id] and isinstance(self.items[id][key], dict):
                 self.items[id][key].update(update[key])
             else:
                 self.items[id][key] = update[key]
-        return Response()
+
+    async def _batch(self, request: Request):
+        await self._checkDriveHeaders(request)
+        match = boundaryPattern.search(request.headers.get("Content-Type", ""))
+        if match is None:
+            raise HTTPBadRequest()
+        responses = []
+        for part in (await request.text()).replace("\r\n", "\n").split("--" + match.group(1)):
+            part = part.strip("\n")
+            if len(part) == 0 or part == "--":
+                continue
+            headers, _, inner = part.partition("\n\n")
+            content_id = None
+            for line in headers.split("\n"):
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-id":
+                    content_id = value.strip().strip("<>")
+            request_line, _, rest = inner.partition("\n")
+            body = rest.partition("\n\n")[2]
+            method, path = request_line.split(" ")[0:2]
+            responses.append((content_id, self._batchItem(method, URL(path).path, body)))
+        self.batches.append(len(responses))
+
+        boundary = "batch_" + self.generateId(10)
+        body = ""
+        for content_id, status in responses:
+            body += "--{0}\r\nContent-Type: application/http\r\nContent-ID: <response-{1}>\r\n\r\n".format(boundary, content_id)
+            body += "HTTP/1.1 {0} {1}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n{{}}\r\n".format(status, HTTPStatus(status).phrase)
+        body += "--{0}--\r\n".format(boundary)
+        return Response(body=body.encode(), headers={"Content-Type": "multipart/mixed; boundary=" + boundary})
+
+    def _batchItem(self, method, path, body) -> int:
+        match = batchFilePattern.match(path)
+        if match is None or match.group(1) not in self.items:
+            return 404
+        id = match.group(1)
+        if method == "PATCH":
+            self._applyUpdate(id, json.loads(body))
+            return 200
+        elif method == "DELETE":
+            del self.items[id]
+            return 204
+        return 400
+
+    def expireChangeTokens(self):
+        self._change_snapshots.clear()
+
+    def _issueChangeToken(self) -> str:
+        token = str(self._next_change_token)
+        self._next_change_token += 1
+        self._change_snapshots[token] = {id: self._snapshot(id) for id in self.items.keys()}
+        while len(self._change_snapshots) > MAX_CHANGE_TOKENS:
+            del self._change_snapshots[next(iter(self._change_snapshots))]
+        return token
+
+    def _snapshot(self, id):
+        if id in self.lostPermission:
+            return None
+        return json.dumps({key: value for key, value in self.items[id].items() if key != 'bytes'}, sort_keys=True, default=str)
+
+    async def _changesToken(self, request: Request):
+        await self._checkDriveHeaders(request)
+        return json_response({'startPageToken': self._issueChangeToken()})
+
+    async def _changes(self, request: Request):
+        await self._checkDriveHeaders(request)
+        token = request.query.get("pageToken", "")
+        if token not in self._change_snapshots:
+            return Response(
+                status=400,
+                content_type="application/json",
+                text='{"error": {"errors": [{"reason": "invalid", "message": "Invalid Value"}]}}')
+        previous = self._change_snapshots[token]
+        fields = [field.split("(")[-1].strip(")") for field in request.query.get('fields', 'fileId').split(",")]
+        changes = []
+        for id in set(previous.keys()).union(self.items.keys()):
+            current = self._snapshot(id) if id in self.items else None
+            if current == previous.get(id):
+                continue
+            if current is None:
+                changes.append({'fileId': id, 'removed': True})
+            else:
+                changes.append({'fileId': id, 'removed': False, 'file': self.filter_fields(self.items[id], fields)})
+        return json_response({'changes': changes, 'newStartPageToken': self._issueChangeToken()})
 
     async def _driveAbout(self, request: Request):
-        return json_response({
+        return self._etagResponse(request, {
             'storageQuota': {
                 'usage': self.usage,
                 'limit': self.space_available
@@ -385,7 +525,7 @@ class SimulatedGoogle(BaseServer):
             for item in self.items.values():
                 if item.get('mimeType', '') == mimeType:
                     ret.append(self.filter_fields(item, fields))
-            return json_response({'files': ret})
+            return self._etagResponse(request, {'files': ret})
         elif parentsQueryPattern.match(query):
             ret = []
             parent = query[1:-len("' in parents")]
@@ -399,12 +539,12 @@ class SimulatedGoogle(BaseServer):
             for item in self.items.values():
                 if parent in item.get('parents', []):
                     ret.append(self.filter_fields(item, fields))
-            return json_response({'files': ret})
+            return self._etagResponse(request, {'files': ret})
         elif len(query) == 0:
             ret = []
             for item in self.items.values():
                 ret.append(self.filter_fields(item, fields))
-            return json_response({'files': ret})
+            return self._etagResponse(request, {'files': ret})
         else:
             raise HTTPBadRequest
 
@@ -439,6 +579,7 @@ class SimulatedGoogle(BaseServer):
             }, status=400)
         metadata = await request.json()
         id = self.generateId()
+        await self._simulateUploadTime(0)
 
         # Validate parents
         if 'parents' in metadata:
@@ -447,11 +588,13 @@ class SimulatedGoogle(BaseServer):
                     raise HTTPNotFound()
                 if parent in self.lostPermission:
                     return Response(status=403, content_type="application/json", text='{"error": {"errors": [{"reason": "forbidden"}]}}')
-        self._upload_info['size'] = size
-        self._upload_info['mime'] = mimeType
-        self._upload_info['item'] = self.formatItem(metadata, id)
-        self._upload_info['id'] = id
-        self._upload_info['next_start'] = 0
+        self._upload_info[id] = {
+            'size': size,
+            'mime': mimeType,
+            'item': self.formatItem(metadata, id),
+            'id': id,
+            'next_start': 0
+        }
         metadata['bytes'] = bytearray()
         metadata['size'] = size
         resp = Response()
@@ -468,14 +611,16 @@ class SimulatedGoogle(BaseServer):
                 self._current_chunk += 1
         id = request.match_info.get('id')
         await self._checkDriveHeaders(request)
-        if self._upload_info.get('id', "") != id:
+        if id not in self._upload_info:
             raise HTTPBadRequest()
+        upload_info = self._upload_info[id]
         chunk_size = int(request.headers['Content-Length'])
         info = request.headers['Content-Range']
         if resumeBytesPattern.match(info):
+            await self._simulateUploadTime(0)
             resp = Response(status=308)
-            if self._upload_info['next_start'] != 0:
-                resp.headers['Range'] = "bytes=0-{0}".format(self._upload_info['next_start'] - 1)
+            if upload_info['next_start'] != 0:
+                resp.headers['Range'] = "bytes=0-{0}".format(upload_info['next_start'] - 1)
             return resp
         if not bytesPattern.match(info):
             raise HTTPBadRequest()
@@ -483,9 +628,9 @@ class SimulatedGoogle(BaseServer):
         start = int(numbers[0])
         end = int(numbers[1])
         total = int(numbers[2])
-        if total != self._upload_info['size']:
+        if total != upload_info['size']:
             raise HTTPBadRequest()
-        if start != self._upload_info['next_start']:
+        if start != upload_info['next_start']:
             raise HTTPBadRequest()
         if not (end == total - 1 or chunk_size % (256 * 1024) == 0):
             raise HTTPBadRequest()
@@ -494,6 +639,7 @@ class SimulatedGoogle(BaseServer):
 
         # get the chunk
         received_bytes = await self.readAll(request)
+        await self._simulateUploadTime(len(received_bytes))
 
         # validate the chunk
         if len(received_bytes) != chunk_size:
@@ -502,21 +648,24 @@ class SimulatedGoogle(BaseServer):
         if len(received_bytes) != end - start + 1:
             raise HTTPBadRequest()
 
-        self._upload_info['item']['bytes'].extend(received_bytes)
+        upload_info['item']['bytes'].extend(received_bytes)
 
-        if len(self._upload_info['item']['bytes']) != end + 1:
+        if len(upload_info['item']['bytes']) != end + 1:
             raise HTTPBadRequest()
         self.usage += len(received_bytes)
         self.chunks.append(len(received_bytes))
         if end == total - 1:
             # upload is complete, so create the item
-            completed = self.formatItem(self._upload_info['item'], self._upload_info['id'])
+            if self._corrupt_uploads:
+                upload_info['item']['bytes'][0] ^= 0xFF
+            upload_info['item']['md5Checksum'] = hashlib.md5(upload_info['item']['bytes']).hexdigest()
+            completed = self.formatItem(upload_info['item'], upload_info['id'])
             self.items[completed['id']] = completed
             return json_response({"id": completed['id']})
         else:
             # Return an incomplete response
             # For some reason, the tests like to stop right here
             resp = Response(status=308)
-            self._upload_info['next_start'] = end + 1
+            upload_info['next_start'] = end + 1
             resp.headers['Range'] = "bytes=0-{0}".format(end)
             return resp
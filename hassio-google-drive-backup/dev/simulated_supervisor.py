@@ -7,9 +7,10 @@ import io
 
 from backup.config import Config, Version
 from backup.time import Time
+from aiohttp import WSMsgType
 from aiohttp.web import (HTTPBadRequest, HTTPNotFound,
                          HTTPUnauthorized, Request, Response, get,
-                         json_response, post, delete, FileResponse)
+                         json_response, post, delete, FileResponse, WebSocketResponse)
 from injector import inject, singleton
 from .base_server import BaseServer
 from .ports import Ports
@@ -29,6 +30,7 @@ URL_MATCH_SELF_OPTIONS = "^/addons/self/options$"
 URL_MATCH_SNAPSHOT = "^/snapshots.*$"
 URL_MATCH_BACKUPS = "^/backups.*$"
 URL_MATCH_MOUNT = "^/mounts*$"
+URL_MATCH_WEBSOCKET = "^/core/websocket$"
 
 
 @singleton
@@ -55,6 +57,14 @@ class SimulatedSupervisor(BaseServer):
         self._password = "pass"
         self._addons = all_addons.copy()
         self._super_version = Version(2023, 7)
+
+        # When set, the list of backups only has a summary of each one like the real supervisor does, so their
+        # details have to be requested separately.
+        self.summarize_backups = False
+
+        # Open connections to the websocket API, and the subscriptions made on each as (id, event_type)
+        self._websockets: Dict[WebSocketResponse, list] = {}
+        self.websocket_connected = asyncio.Event()
         self._mounts = {
             'default_backup_mount': None,
             'mounts': [
@@ -125,6 +135,7 @@ class SimulatedSupervisor(BaseServer):
             get('/backups/{slug}/download', self._backupDownload),
             get('/backups/{slug}/info', self._backupDetail),
             get('/debug/backups/lock', self._lock_backups),
+            get('/core/websocket', self._websocket),
 
             # TODO: remove once the api path is fully deprecated
             get('/snapshots', self._getSnapshots),
@@ -183,7 +194,25 @@ class SimulatedSupervisor(BaseServer):
 
     async def _getBackups(self, request: Request):
         await self._verifyHeader(request)
-        return self._formatDataResponse({'backups': list(self._backups.values())})
+        backups = list(self._backups.values())
+        if self.summarize_backups:
+            backups = [self._summarizeBackup(backup) for backup in backups]
+        return self._formatDataResponse({'backups': backups})
+
+    def _summarizeBackup(self, backup):
+        return {
+            'slug': backup['slug'],
+            'name': backup['name'],
+            'date': backup['date'],
+            'type': backup['type'],
+            'size': backup['size'],
+            'protected': backup['protected'],
+            'content': {
+                'homeassistant': backup.get('homeassistant') is not None,
+                'addons': [addon['slug'] for addon in backup.get('addons', [])],
+                'folders': backup.get('folders', []),
+            }
+        }
 
     async def _getMounts(self, request: Request):
         await self._verifyHeader(request)
@@ -303,6 +332,7 @@ class SimulatedSupervisor(BaseServer):
                 backup_info = parseBackupInfo(data)
                 self._backups[slug] = backup_info
                 self._backup_data[slug] = bytearray(data.getbuffer())
+                await self.sendJobEvent("backup_manager_{0}_backup".format(backup_info['type']), slug)
                 return slug
 
     async def createBackup(self, input_json, date=None):
@@ -333,6 +363,7 @@ class SimulatedSupervisor(BaseServer):
             info = parseBackupInfo(io.BytesIO(received_bytes))
             self._backups[info['slug']] = info
             self._backup_data[info['slug']] = received_bytes
+            await self.sendJobEvent("backup_manager_import_backup", info['slug'])
             return self._formatDataResponse({"slug": info['slug']})
         except Exception as e:
             print(str(e))
@@ -347,6 +378,53 @@ class SimulatedSupervisor(BaseServer):
         del self._backup_data[slug]
         return self._formatDataResponse("deleted")
 
+    async def _websocket(self, request: Request):
+        # Mimics the parts of Home Assistant's websocket API the addon uses
+        ws = WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"type": "auth_required"})
+        auth = await ws.receive_json()
+        if auth.get("type") != "auth" or auth.get("access_token") != self._auth_token:
+            await ws.send_json({"type": "auth_invalid"})
+            await ws.close()
+            return ws
+        await ws.send_json({"type": "auth_ok"})
+        self._websockets[ws] = []
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    break
+                message = msg.json()
+                if message.get("type") == "subscribe_events":
+                    self._websockets[ws].append((message["id"], message.get("event_type")))
+                    await ws.send_json({"id": message["id"], "type": "result", "success": True, "result": None})
+                    self.websocket_connected.set()
+        finally:
+            del self._websockets[ws]
+            if len(self._websockets) == 0:
+                self.websocket_connected.clear()
+        return ws
+
+    async def sendEvent(self, event_type: str, data: Dict[str, Any]):
+        for ws, subscriptions in list(self._websockets.items()):
+            for id, subscribed in subscriptions:
+                if subscribed is None or subscribed == event_type:
+                    await ws.send_json({"id": id, "type": "event", "event": {"event_type": event_type, "data": data}})
+
+    async def sendJobEvent(self, name: str, reference: str):
+        await self.sendEvent("supervisor_event", {
+            "event": "job",
+            "data": {
+                "name": name,
+                "reference": reference,
+                "done": True,
+            }
+        })
+
+    async def closeWebsockets(self):
+        for ws in list(self._websockets.keys()):
+            await ws.close()
+
     async def _backupDetail(self, request: Request):
         await self._verifyHeader(request)
         slug = request.match_info.get('slug')
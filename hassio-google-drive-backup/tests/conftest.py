@@ -17,7 +17,7 @@ from backup.model import Coordinator
 from dev.simulationserver import SimulationServer
 from backup.drive import DriveRequests, DriveSource, FolderFinder, AuthCodeQuery
 from backup.util import GlobalInfo, Estimator, Resolver, DataCache
-from backup.ha import HaRequests, HaSource, HaUpdater
+from backup.ha import HaRequests, HaSource, HaUpdater, EventListener
 from backup.logger import reset
 from backup.model import DummyBackup, DestinationPrecache, Model
 from backup.time import Time
@@ -156,6 +156,7 @@ async def generate_config(server_url: URL, ports, cleandir):
         Setting.RETAINED_FILE_PATH: "retained.json",
         Setting.ID_FILE_PATH: "id.json",
         Setting.DATA_CACHE_FILE_PATH: "data_cache.json",
+        Setting.RESTORE_SPOOL_FILE_PATH: "restore_spool.tar",
         Setting.STOP_ADDON_STATE_PATH: "stop_addon.json",
         Setting.INGRESS_TOKEN_FILE_PATH: "ingress.dat",
         Setting.DEFAULT_DRIVE_CLIENT_ID: "test_client_id",
@@ -410,6 +411,13 @@ async def watcher(injector):
     await watcher.stop()
 
 
+@pytest.fixture()
+async def event_listener(injector):
+    listener = injector.get(EventListener)
+    yield listener
+    await listener.stop()
+
+
 class BackupHelper():
     def __init__(self, uploader, time):
         self.time = time
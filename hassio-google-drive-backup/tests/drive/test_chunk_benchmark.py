@@ -0,0 +1,82 @@
+import math
+
+import pytest
+from backup.config import Config, Setting
+from backup.drive import DriveRequests
+from backup.drive.chunksizer import ChunkSizer, BASE_CHUNK_SIZE, CHUNK_UPLOAD_TARGET_SECONDS, CHUNK_OVERHEAD_TARGET
+from dev.simulated_google import SimulatedGoogle
+from ..faketime import FakeTime
+from ..conftest import Uploader
+
+# Benchmarks chunk sizing against simulated connections.  Time is faked, so this runs quickly and gives the
+# same result every time.
+
+UPLOAD_SIZE = BASE_CHUNK_SIZE * 100 + 1234
+MAX_CHUNK_BYTES = BASE_CHUNK_SIZE * 40
+
+# name, bytes/second, latency in seconds
+PROFILES = [
+    ("dsl", 128 * 1024, 0.05),
+    ("mobile", 512 * 1024, 0.3),
+    ("satellite", 1024 * 1024, 0.7),
+    ("rural", 64 * 1024, 1.5),
+    ("fiber", 10 * 1024 * 1024, 0.01),
+]
+
+
+class LegacyChunkSizer(ChunkSizer):
+    """How chunks were sized before, scaling only the duration of the last chunk to the target"""
+
+    def recordLatency(self, seconds):
+        pass
+
+    def recordChunk(self, size, seconds):
+        self.throughput = size / seconds if seconds > 0 else None
+
+    def initialSize(self, max_chunks):
+        return 1
+
+    def nextSize(self, max_chunks):
+        if self.throughput is None:
+            return max_chunks
+        return max(min(math.floor(self.throughput * CHUNK_UPLOAD_TARGET_SECONDS / BASE_CHUNK_SIZE), max_chunks), 1)
+
+
+async def measureUpload(drive_requests: DriveRequests, uploader: Uploader, google: SimulatedGoogle, time: FakeTime, name):
+    data = await uploader.upload(bytearray(UPLOAD_SIZE))
+    google.chunks.clear()
+    start = time.now()
+    async with data:
+        async for item in drive_requests.create(data, {"name": name}, "unused"):
+            pass
+    return (time.now() - start).total_seconds(), len(google.chunks)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("profile", PROFILES, ids=[profile[0] for profile in PROFILES])
+async def test_benchmark_chunk_size(drive_requests: DriveRequests, uploader: Uploader, google: SimulatedGoogle, time: FakeTime, config: Config, profile):
+    name, speed, latency = profile
+    config.override(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES, MAX_CHUNK_BYTES)
+    google.setUploadProfile(speed, latency)
+    ideal = UPLOAD_SIZE / speed
+
+    results = {}
+    for sizer in [LegacyChunkSizer(), ChunkSizer()]:
+        drive_requests.chunk_sizer = sizer
+        first = await measureUpload(drive_requests, uploader, google, time, "first")
+        second = await measureUpload(drive_requests, uploader, google, time, "second")
+        results[type(sizer).__name__] = (first, second)
+
+    legacy_first, legacy_second = results["LegacyChunkSizer"]
+    adaptive_first, adaptive_second = results["ChunkSizer"]
+
+    # Adaptive sizing should never be slower or need more requests
+    assert adaptive_first[0] <= legacy_first[0]
+    assert adaptive_second[0] <= legacy_second[0]
+    assert adaptive_first[1] <= legacy_first[1]
+    assert adaptive_second[1] <= legacy_second[1]
+
+    # Once warmed up, time spent on request latency should be within the target, except for the request that
+    # starts the upload and when chunks can't get any bigger.
+    overhead = 1 - ideal / (adaptive_second[0] - latency)
+    assert overhead <= CHUNK_OVERHEAD_TARGET or adaptive_second[1] <= math.ceil(UPLOAD_SIZE / MAX_CHUNK_BYTES)
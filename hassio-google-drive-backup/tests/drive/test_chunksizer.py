@@ -0,0 +1,75 @@
+from backup.drive.chunksizer import ChunkSizer, BASE_CHUNK_SIZE, CHUNK_UPLOAD_TARGET_SECONDS, CHUNK_OVERHEAD_TARGET
+
+
+def test_chunk_size():
+    max = 40
+    assert ChunkSizer().nextSize(max) == 1
+
+    sizer = ChunkSizer()
+    sizer.recordChunk(BASE_CHUNK_SIZE * 1000000000, 0)
+    assert sizer.nextSize(max) == max
+
+    sizer = ChunkSizer()
+    sizer.recordChunk(BASE_CHUNK_SIZE, CHUNK_UPLOAD_TARGET_SECONDS)
+    assert sizer.nextSize(max) == 1
+
+    sizer = ChunkSizer()
+    sizer.recordChunk(BASE_CHUNK_SIZE, 1)
+    assert sizer.nextSize(max) == CHUNK_UPLOAD_TARGET_SECONDS
+
+    sizer = ChunkSizer()
+    sizer.recordChunk(BASE_CHUNK_SIZE, 1.01)
+    assert sizer.nextSize(max) == CHUNK_UPLOAD_TARGET_SECONDS - 1
+
+
+def test_chunk_size_limits():
+    sizer = ChunkSizer()
+    sizer.recordChunk(BASE_CHUNK_SIZE * 1000000000, 0)
+    assert sizer.nextSize(1) == 1
+    assert sizer.nextSize(3) == 3
+
+    sizer = ChunkSizer()
+    sizer.recordChunk(BASE_CHUNK_SIZE, 1000000)
+    assert sizer.nextSize(3) == 1
+
+
+def test_smoothing():
+    sizer = ChunkSizer(smoothing=0.5)
+    sizer.recordChunk(BASE_CHUNK_SIZE, 1)
+    assert sizer.throughput == BASE_CHUNK_SIZE
+
+    # A single slow chunk only moves the estimate part of the way
+    sizer.recordChunk(BASE_CHUNK_SIZE, 2)
+    assert sizer.throughput == BASE_CHUNK_SIZE * 0.75
+    assert sizer.nextSize(100) == 7
+
+
+def test_latency_excluded_from_throughput():
+    sizer = ChunkSizer()
+    sizer.recordLatency(1)
+    sizer.recordChunk(BASE_CHUNK_SIZE, 2)
+    assert sizer.throughput == BASE_CHUNK_SIZE
+    assert sizer.nextSize(100) == CHUNK_UPLOAD_TARGET_SECONDS
+
+
+def test_overhead_target():
+    # With 5 seconds of latency, 10 second chunks would spend a third of their time waiting
+    sizer = ChunkSizer()
+    sizer.recordLatency(5)
+    sizer.recordChunk(BASE_CHUNK_SIZE * 2, 7)
+    size = sizer.nextSize(1000)
+    assert size == 45
+    assert 5 / (5 + size * BASE_CHUNK_SIZE / sizer.throughput) <= CHUNK_OVERHEAD_TARGET
+
+
+def test_remembers_size_between_uploads():
+    sizer = ChunkSizer()
+    assert sizer.initialSize(100) == 1
+    sizer.recordChunk(BASE_CHUNK_SIZE, 0.5)
+    assert sizer.initialSize(100) == 20
+
+    # Start over at the minimum after a failure, until a chunk succeeds again
+    sizer.recordFailure()
+    assert sizer.initialSize(100) == 1
+    sizer.recordChunk(BASE_CHUNK_SIZE, 0.5)
+    assert sizer.initialSize(100) == 20
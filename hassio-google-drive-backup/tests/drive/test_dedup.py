@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import tarfile
+from io import BytesIO
+
+import pytest
+
+from backup.config import Config, Setting
+from backup.drive import DriveSource
+from backup.drive.dedup import MINIMUM_DEDUP_SIZE
+from backup.model import DummyBackup
+from backup.model.backups import PROP_DEDUP_BLOB
+from backup.util import LocalFileStream
+from dev.simulated_google import SimulatedGoogle
+from ..faketime import FakeTime
+from ..helpers import compareStreams, getTestStream
+
+
+def makeArchive(seed: int, size: int = MINIMUM_DEDUP_SIZE * 2) -> bytes:
+    data = bytearray(getTestStream(size).getbuffer())
+    data[0] = seed
+    return bytes(data)
+
+
+class DedupHelper():
+    def __init__(self, uploader, time: FakeTime):
+        self.uploader = uploader
+        self.time = time
+
+    def createTar(self, slug, archives) -> BytesIO:
+        stream = BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as tar:
+            for name, data in [("backup.json", json.dumps({"slug": slug}).encode())] + list(archives.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, BytesIO(data))
+        stream.seek(0)
+        return stream
+
+    async def createBackup(self, slug, archives):
+        stream = self.createTar(slug, archives)
+        backup = DummyBackup(slug, self.time.now(), "fake source", slug, size=len(stream.getbuffer()))
+        return backup, await self.uploader.upload(stream)
+
+    def createLocalBackup(self, directory, slug, archives):
+        # The uploader only holds one file at a time, so backups read at the same time have to come from disk
+        path = os.path.join(directory, slug + ".tar")
+        with open(path, "wb") as f:
+            f.write(self.createTar(slug, archives).getbuffer())
+        backup = DummyBackup(slug, self.time.now(), "fake source", slug, size=os.path.getsize(path))
+        return backup, LocalFileStream(path, self.time)
+
+
+@pytest.fixture
+def dedup_helper(uploader, time):
+    return DedupHelper(uploader, time)
+
+
+def archivesInDrive(google: SimulatedGoogle):
+    return [item for item in google.items.values() if PROP_DEDUP_BLOB in item.get('appProperties', {})]
+
+
+@pytest.mark.asyncio
+async def test_upload_and_restore(drive: DriveSource, config: Config, google: SimulatedGoogle, dedup_helper: DedupHelper):
+    config.override(Setting.DEDUPLICATE_UPLOADS, True)
+    backup, data = await dedup_helper.createBackup("slug1", {"./addon.tar.gz": makeArchive(1), "./homeassistant.tar.gz": makeArchive(2), "./small.tar.gz": b"small"})
+    drive_backup = await drive.save(backup, data)
+    assert drive_backup.deduplicated()
+    assert drive_backup.size() == data.size()
+    assert drive_backup.fileSize() < MINIMUM_DEDUP_SIZE
+    assert len(archivesInDrive(google)) == 2
+
+    # Listing the backup should give the original size, and reading it should give back the original tar
+    backups = await drive.get()
+    assert backups["slug1"].size() == data.size()
+    backup.addSource(backups["slug1"])
+    restored = await drive.read(backup)
+    async with restored:
+        data.position(0)
+        await compareStreams(data, restored)
+
+
+@pytest.mark.asyncio
+async def test_only_uploads_changed_archives(drive: DriveSource, config: Config, google: SimulatedGoogle, dedup_helper: DedupHelper):
+    config.override(Setting.DEDUPLICATE_UPLOADS, True)
+    backup1, data1 = await dedup_helper.createBackup("slug1", {"./addon.tar.gz": makeArchive(1), "./homeassistant.tar.gz": makeArchive(2)})
+    backup1.addSource(await drive.save(backup1, data1))
+    google.chunks.clear()
+
+    backup2, data2 = await dedup_helper.createBackup("slug2", {"./addon.tar.gz": makeArchive(1), "./homeassistant.tar.gz": makeArchive(3)})
+    backup2.addSource(await drive.save(backup2, data2))
+    assert len(archivesInDrive(google)) == 3
+
+    # Only the changed archive and the manifest should have been uploaded
+    assert sum(google.chunks) < len(makeArchive(3)) + MINIMUM_DEDUP_SIZE
+
+    # Deleting the first backup should only remove the archive the second doesn't use
+    await drive.get()
+    await drive.delete(backup1)
+    assert len(archivesInDrive(google)) == 2
+    restored = await drive.read(backup2)
+    async with restored:
+        data2.position(0)
+        await compareStreams(data2, restored)
+
+    await drive.get()
+    await drive.delete(backup2)
+    assert len(archivesInDrive(google)) == 0
+
+
+@pytest.mark.asyncio
+async def test_non_tar_uploads_whole(drive: DriveSource, config: Config, dedup_helper: DedupHelper, uploader, time: FakeTime):
+    config.override(Setting.DEDUPLICATE_UPLOADS, True)
+    data = await uploader.upload(BytesIO(b"not a tar" * 1000))
+    backup = DummyBackup("name", time.now(), "fake source", "slug", size=9000)
+    drive_backup = await drive.save(backup, data)
+    assert not drive_backup.deduplicated()
+    assert drive_backup.size() == 9000
+
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads_share_archive(drive: DriveSource, config: Config, google: SimulatedGoogle, dedup_helper: DedupHelper, tmpdir):
+    config.override(Setting.DEDUPLICATE_UPLOADS, True)
+    config.override(Setting.MAXIMUM_CONCURRENT_UPLOADS, 2)
+    backup1, data1 = dedup_helper.createLocalBackup(str(tmpdir), "slug1", {"./addon.tar.gz": makeArchive(1), "./homeassistant.tar.gz": makeArchive(2)})
+    backup2, data2 = dedup_helper.createLocalBackup(str(tmpdir), "slug2", {"./addon.tar.gz": makeArchive(1), "./homeassistant.tar.gz": makeArchive(3)})
+    async with data1:
+        async with data2:
+            await asyncio.gather(drive.save(backup1, data1), drive.save(backup2, data2))
+
+    # The archive both backups have only got uploaded once
+    assert len(archivesInDrive(google)) == 3
+
+
+@pytest.mark.asyncio
+async def test_trashed_backup_keeps_archives(drive: DriveSource, config: Config, google: SimulatedGoogle, dedup_helper: DedupHelper):
+    config.override(Setting.DEDUPLICATE_UPLOADS, True)
+    backup1, data1 = await dedup_helper.createBackup("slug1", {"./addon.tar.gz": makeArchive(1)})
+    drive_backup = await drive.save(backup1, data1)
+    backup1.addSource(drive_backup)
+    backup2, data2 = await dedup_helper.createBackup("slug2", {"./addon.tar.gz": makeArchive(2)})
+    backup2.addSource(await drive.save(backup2, data2))
+
+    # A backup in a shared drive that can't be deleted directly gets trashed, and could be restored from the trash later
+    google.items[drive_backup.id()]['capabilities'] = {'canDelete': False, 'canTrash': True}
+    google.items[drive_backup.id()]['driveId'] = "test_shared_drive_id"
+    backup1.addSource((await drive.get())["slug1"])
+    await drive.delete(backup1)
+    assert google.items[drive_backup.id()]['trashed']
+    assert len(archivesInDrive(google)) == 2
+
+    # Cleaning up after deleting another backup still leaves the trashed backup's archive alone
+    await drive.get()
+    await drive.delete(backup2)
+    assert len(archivesInDrive(google)) == 1
+    google.items[drive_backup.id()]['trashed'] = False
+    backup1.addSource((await drive.get())["slug1"])
+    restored = await drive.read(backup1)
+    _, expected = await dedup_helper.createBackup("slug1", {"./addon.tar.gz": makeArchive(1)})
+    async with restored:
+        await compareStreams(expected, restored)
+
+
+@pytest.mark.asyncio
+async def test_deleting_several_collects_garbage_once(drive: DriveSource, config: Config, google: SimulatedGoogle, dedup_helper: DedupHelper, monkeypatch):
+    config.override(Setting.DEDUPLICATE_UPLOADS, True)
+    backups = []
+    for x in range(4):
+        backup, data = await dedup_helper.createBackup("slug{0}".format(x), {"./addon.tar.gz": makeArchive(x)})
+        backup.addSource(await drive.save(backup, data))
+        backups.append(backup)
+    assert len(archivesInDrive(google)) == 4
+
+    read = []
+    readManifest = drive.dedup._readManifest
+
+    async def recordRead(id, size):
+        read.append(id)
+        return await readManifest(id, size)
+    monkeypatch.setattr(drive.dedup, "_readManifest", recordRead)
+
+    # Each remaining manifest only gets read once to find the archives nobody uses anymore
+    await drive.get()
+    await drive.deleteMany(backups[:3])
+    assert len(read) == 1
+    assert len(archivesInDrive(google)) == 1
@@ -1,25 +1,32 @@
 import os
 import json
+import hashlib
 from time import sleep
+from datetime import timedelta, timezone
+from email.utils import format_datetime
 
 import pytest
 import asyncio
 from yarl import URL
 from aiohttp.client_exceptions import ClientResponseError
+from aiohttp.web import Response
 from backup.config import Config, Setting
 from dev.simulationserver import SimulationServer
-from dev.simulated_google import SimulatedGoogle, URL_MATCH_UPLOAD_PROGRESS, URL_MATCH_FILE
+from dev.simulated_google import SimulatedGoogle, URL_MATCH_UPLOAD_PROGRESS, URL_MATCH_FILE, URL_MATCH_BATCH
 from dev.request_interceptor import RequestInterceptor
 from backup.drive import DriveSource, FolderFinder, DriveRequests, RETRY_SESSION_ATTEMPTS, UPLOAD_SESSION_EXPIRATION_DURATION, URL_START_UPLOAD
-from backup.drive.driverequests import (BASE_CHUNK_SIZE, CHUNK_UPLOAD_TARGET_SECONDS)
+from backup.drive.driverequests import (BASE_CHUNK_SIZE, CHUNK_UPLOAD_TARGET_SECONDS, MAX_BATCH_SIZE, DRIVE_RETRY_INITIAL_SECONDS)
 from backup.drive.drivesource import FOLDER_MIME_TYPE
 from backup.exceptions import (BackupFolderInaccessible, BackupFolderMissingError,
                                DriveQuotaExceeded, ExistingBackupFolderError,
                                GoogleCantConnect, GoogleCredentialsExpired,
                                GoogleInternalError, GoogleUnexpectedError,
-                               GoogleSessionError, GoogleTimeoutError, CredRefreshMyError, CredRefreshGoogleError)
-from backup.creds import Creds
+                               GoogleSessionError, GoogleTimeoutError, CredRefreshMyError, CredRefreshGoogleError,
+                               UploadChecksumMismatch)
+from backup.creds import Creds, DriveRequester
+from backup.creds.driverequester import MAX_CONCURRENT_REQUESTS
 from backup.model import DriveBackup, DummyBackup
+from backup.model.backups import PROP_SHA256
 from ..faketime import FakeTime
 from ..helpers import compareStreams, createBackupTar
 
@@ -69,3 +76,366 @@ async def test_higher_speed_limit(drive_requests: DriveRequests, time: FakeTime,
             assert time.sleeps[-1] == 0.5
     assert len(time.sleeps) == 11
 
+
+@pytest.mark.asyncio
+async def test_reads_ahead_while_uploading(drive_requests: DriveRequests, backup_helper: BackupHelper, interceptor: RequestInterceptor, google: SimulatedGoogle):
+    from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 10)
+
+    # Hold the first chunk's upload and verify the next chunk gets read in the meantime.
+    matcher = interceptor.setWaiter(URL_MATCH_UPLOAD_PROGRESS, attempts=1)
+    async with data:
+        async def upload():
+            async for progress in drive_requests.create(data, {}, "unused"):
+                pass
+        upload_task = asyncio.create_task(upload())
+        await matcher.waitForCall()
+        for x in range(50):
+            if data.position() > BASE_CHUNK_SIZE:
+                break
+            await asyncio.sleep(0.01)
+        assert data.position() > BASE_CHUNK_SIZE
+
+        matcher.clear()
+        await upload_task
+    assert sum(google.chunks) == data.size()
+
+
+@pytest.mark.asyncio
+async def test_reuses_upload_buffer(drive_requests: DriveRequests, backup_helper: BackupHelper, config: Config):
+    config.override(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES, BASE_CHUNK_SIZE * 2)
+    for slug in ["slug1", "slug2"]:
+        from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 5 + 10, slug=slug)
+        async with data:
+            async for item in drive_requests.create(data, {"name": slug}, "unused"):
+                pass
+        data.position(0)
+        uploaded = await drive_requests.download(item['id'], data.size())
+        async with uploaded:
+            await compareStreams(data, uploaded)
+
+    # Both uploads should have shared a single chunk buffer
+    assert drive_requests.buffer_pool.allocated() == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads_share_limit(drive_requests: DriveRequests, time: FakeTime, backup_helper: BackupHelper, config: Config):
+    config.override(Setting.UPLOAD_LIMIT_BYTES_PER_SECOND, BASE_CHUNK_SIZE)
+    config.override(Setting.MAXIMUM_CONCURRENT_UPLOADS, 2)
+
+    async def upload(slug):
+        from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 5, slug=slug)
+        async with data:
+            async for item in drive_requests.create(data, {"name": slug}, "unused"):
+                pass
+        return data, item
+
+    # Each upload is 6 chunks, and together they should be limited to one chunk per second
+    results = await asyncio.gather(upload("slug1"), upload("slug2"))
+    assert time.sleeps == [1] * 12
+    assert drive_requests.buffer_pool.allocated() == 2
+
+    for data, item in results:
+        data.position(0)
+        uploaded = await drive_requests.download(item['id'], data.size())
+        async with uploaded:
+            await compareStreams(data, uploaded)
+
+
+@pytest.mark.asyncio
+async def test_bandwidth_governor_limits_uploads(drive_requests: DriveRequests, time: FakeTime, backup_helper: BackupHelper, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, BASE_CHUNK_SIZE)
+    config.override(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES, BASE_CHUNK_SIZE)
+    from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 10)
+    async with data:
+        async for progress in drive_requests.create(data, {}, "unused"):
+            pass
+
+    # The first chunk goes right away, then every chunk waits for the one before it to be paid for
+    assert time.sleeps == [1] * 10
+
+
+@pytest.mark.asyncio
+async def test_upload_checksum(drive_requests: DriveRequests, backup_helper: BackupHelper, google: SimulatedGoogle):
+    from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 3 + 10)
+    async with data:
+        async for item in drive_requests.create(data, {"appProperties": {"key": "value"}}, "unused"):
+            pass
+    data.position(0)
+    sent = (await data.read(data.size())).getbuffer()
+    assert item['md5Checksum'] == hashlib.md5(sent).hexdigest()
+    assert item['appProperties'] == {"key": "value", PROP_SHA256: hashlib.sha256(sent).hexdigest()}
+    assert google.items[item['id']]['appProperties'] == item['appProperties']
+
+
+@pytest.mark.asyncio
+async def test_upload_checksum_not_saved(drive_requests: DriveRequests, backup_helper: BackupHelper, google: SimulatedGoogle, interceptor: RequestInterceptor):
+    # Failing to save the checksum doesn't fail an upload that otherwise made it intact
+    # The first request is for the uploaded file, and the second saves the checksum
+    interceptor.setError("^/drive/v3/files/[^/]*/$", 400, fail_after=1)
+    from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 3 + 10)
+    async with data:
+        async for item in drive_requests.create(data, {"appProperties": {"key": "value"}}, "unused"):
+            pass
+    assert item['id'] in google.items
+    assert item['appProperties'] == {"key": "value"}
+
+
+@pytest.mark.asyncio
+async def test_upload_checksum_mismatch(drive_requests: DriveRequests, backup_helper: BackupHelper, google: SimulatedGoogle):
+    google.setCorruptUploads()
+    from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 3 + 10)
+    with pytest.raises(UploadChecksumMismatch):
+        async with data:
+            async for item in drive_requests.create(data, {}, "unused"):
+                pass
+
+    # The corrupted file shouldn't be left behind
+    assert len(google.items) == 0
+
+
+@pytest.mark.asyncio
+async def test_parallel_download(drive_requests: DriveRequests, backup_helper: BackupHelper, config: Config, interceptor: RequestInterceptor):
+    config.override(Setting.DOWNLOAD_CONNECTIONS, 3)
+    config.override(Setting.DOWNLOAD_PART_BYTES, BASE_CHUNK_SIZE)
+    from_backup, data = await backup_helper.createFile(BASE_CHUNK_SIZE * 5 + 10)
+    async with data:
+        async for item in drive_requests.create(data, {}, "unused"):
+            pass
+
+    # The file should be fetched as 6 separate ranges
+    match = interceptor.setError(URL_MATCH_FILE)
+    data.position(0)
+    downloaded = await drive_requests.download(item['id'], data.size(), parallel=True)
+    async with downloaded:
+        await compareStreams(data, downloaded)
+    assert match.callCount() == 6
+
+    # Downloads that aren't asked to be parallel still use a single request, which compareStreams() sets up twice
+    data.position(0)
+    downloaded = await drive_requests.download(item['id'], data.size())
+    async with downloaded:
+        await compareStreams(data, downloaded)
+    assert match.callCount() == 8
+
+
+def addItems(google: SimulatedGoogle, count):
+    ids = ["item{0}".format(x) for x in range(count)]
+    for id in ids:
+        google.items[id] = {'id': id, 'name': id, 'appProperties': {'existing': 'value'}}
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_batch_deletes(drive_requests: DriveRequests, google: SimulatedGoogle, interceptor: RequestInterceptor):
+    ids = addItems(google, 5)
+    file_match = interceptor.setError(URL_MATCH_FILE)
+    batch_match = interceptor.setError(URL_MATCH_BATCH)
+    await asyncio.gather(*[drive_requests.delete(id) for id in ids])
+    assert google.batches == [5]
+    assert batch_match.callCount() == 1
+    assert file_match.callCount() == 0
+    assert len(google.items) == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_updates(drive_requests: DriveRequests, google: SimulatedGoogle):
+    ids = addItems(google, 3)
+    await asyncio.gather(*[drive_requests.update(id, {'appProperties': {'retained': id}}) for id in ids] + [drive_requests.delete(ids[0])])
+    assert google.batches == [4]
+    assert ids[0] not in google.items
+    for id in ids[1:]:
+        assert google.items[id]['appProperties'] == {'existing': 'value', 'retained': id}
+
+
+@pytest.mark.asyncio
+async def test_single_request_not_batched(drive_requests: DriveRequests, google: SimulatedGoogle, interceptor: RequestInterceptor):
+    ids = addItems(google, 1)
+    file_match = interceptor.setError(URL_MATCH_FILE)
+    await drive_requests.delete(ids[0])
+    assert google.batches == []
+    assert file_match.callCount() == 1
+    assert len(google.items) == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_item_failure(drive_requests: DriveRequests, google: SimulatedGoogle, interceptor: RequestInterceptor):
+    ids = addItems(google, 3)
+    file_match = interceptor.setError(URL_MATCH_FILE)
+    results = await asyncio.gather(*[drive_requests.delete(id) for id in ids + ["missing"]], return_exceptions=True)
+    assert results[0:3] == [None, None, None]
+
+    # The failed request gets retried on its own, and fails the same way it would have unbatched
+    assert isinstance(results[3], ClientResponseError)
+    assert results[3].status == 404
+    assert google.batches == [4]
+    assert file_match.callCount() == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_failure(drive_requests: DriveRequests, google: SimulatedGoogle, interceptor: RequestInterceptor):
+    ids = addItems(google, 3)
+    interceptor.setError(URL_MATCH_BATCH, status=400)
+    results = await asyncio.gather(*[drive_requests.delete(id) for id in ids], return_exceptions=True)
+    for result in results:
+        assert isinstance(result, ClientResponseError)
+    assert len(google.items) == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_size_limit(drive_requests: DriveRequests, google: SimulatedGoogle):
+    ids = addItems(google, MAX_BATCH_SIZE + 3)
+    await asyncio.gather(*[drive_requests.delete(id) for id in ids])
+    assert google.batches == [MAX_BATCH_SIZE, 3]
+    assert len(google.items) == 0
+
+
+@pytest.mark.asyncio
+async def test_conditional_about_info(drive_requests: DriveRequests, google: SimulatedGoogle):
+    first = await drive_requests.getAboutInfo()
+    assert google.not_modified == 0
+
+    # Asking again gets a 304 from Drive, and the same info as before
+    assert await drive_requests.getAboutInfo() == first
+    assert google.not_modified == 1
+
+    google.usage = 1234
+    assert (await drive_requests.getAboutInfo())['storageQuota']['usage'] == 1234
+    assert google.not_modified == 1
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_and_query(drive_requests: DriveRequests, google: SimulatedGoogle):
+    ids = addItems(google, 2)
+    first = await drive_requests.get(ids[0])
+    first['name'] = "changed by the caller"
+    assert (await drive_requests.get(ids[0]))['name'] == ids[0]
+    assert google.not_modified == 1
+
+    listed = [item async for item in drive_requests.query("")]
+    assert [item async for item in drive_requests.query("")] == listed
+    assert google.not_modified == 2
+
+
+@pytest.mark.asyncio
+async def test_conditional_request_expires(drive_requests: DriveRequests, google: SimulatedGoogle, time: FakeTime):
+    await drive_requests.getAboutInfo()
+    time.advance(hours=13)
+    await drive_requests.getAboutInfo()
+    assert google.not_modified == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_token_refreshes_share_one_request(drive_requests: DriveRequests, interceptor: RequestInterceptor, time: FakeTime):
+    drive_requests.creds._secret = None
+    time.advanceDay()
+    waiter = interceptor.setWaiter(".*/oauth2/v4/token.*")
+    tokens = [asyncio.create_task(drive_requests.getToken()) for x in range(3)]
+    tokens.append(asyncio.create_task(drive_requests.getToken(refresh=True)))
+    await waiter.waitForCall()
+    await asyncio.sleep(0)
+    waiter.clear()
+
+    tokens = await asyncio.gather(*tokens)
+    assert waiter.callCount() == 1
+    assert len(set(tokens)) == 1
+    assert tokens[0] == drive_requests.creds.access_token
+
+
+@pytest.mark.asyncio
+async def test_token_refreshed_before_it_expires(drive_requests: DriveRequests, interceptor: RequestInterceptor, time: FakeTime):
+    drive_requests.creds._secret = None
+    await drive_requests.getToken(refresh=True)
+    refreshes = interceptor.setError(".*/oauth2/v4/token.*")
+    old_token = drive_requests.creds.access_token
+
+    # Nothing happens while the token has a while left
+    time.advance(minutes=50)
+    assert await drive_requests.getToken() == old_token
+    assert refreshes.callCount() == 0
+
+    # Close to expiring, the old token still gets used while a new one is requested in the background
+    time.advance(minutes=6)
+    assert await drive_requests.getToken() == old_token
+    await drive_requests._background_refresh
+    assert refreshes.callCount() == 1
+    assert await drive_requests.getToken() != old_token
+    assert refreshes.callCount() == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_start_one_background_refresh(drive_requests: DriveRequests, interceptor: RequestInterceptor, time: FakeTime, monkeypatch):
+    drive_requests.creds._secret = None
+    await drive_requests.getToken(refresh=True)
+    refreshes = interceptor.setError(".*/oauth2/v4/token.*")
+    old_token = drive_requests.creds.access_token
+
+    started = []
+    refreshInBackground = drive_requests._refreshInBackground
+
+    async def recordRefresh():
+        started.append(True)
+        await refreshInBackground()
+    monkeypatch.setattr(drive_requests, "_refreshInBackground", recordRefresh)
+
+    # Several callers close to the token expiring all show up before the background refresh gets to run
+    time.advance(minutes=56)
+    tokens = await asyncio.gather(*[drive_requests.getToken() for x in range(5)])
+    assert tokens == [old_token] * 5
+    await drive_requests._background_refresh
+    assert len(started) == 1
+    assert refreshes.callCount() == 1
+    assert await drive_requests.getToken() != old_token
+
+
+@pytest.mark.asyncio
+async def test_failed_background_token_refresh(drive_requests: DriveRequests, interceptor: RequestInterceptor, time: FakeTime):
+    drive_requests.creds._secret = None
+    await drive_requests.getToken(refresh=True)
+    old_token = drive_requests.creds.access_token
+    refreshes = interceptor.setError(".*/oauth2/v4/token.*", status=510)
+
+    time.advance(minutes=56)
+    assert await drive_requests.getToken() == old_token
+    await drive_requests._background_refresh
+
+    # The failure isn't retried until the token actually expires
+    assert await drive_requests.getToken() == old_token
+    assert refreshes.callCount() == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_honors_retry_after(drive_requests: DriveRequests, drive_requester: DriveRequester, interceptor: RequestInterceptor, time: FakeTime):
+    about = interceptor.setError("^/drive/v3/about.*$")
+    about.addResponse(Response(status=429, headers={"Retry-After": "30"}))
+    time.clearSleeps()
+    await drive_requests.getAboutInfo()
+
+    # The only wait is the one Google asked for, and fewer requests get sent at once afterward
+    assert time.sleeps == [30]
+    assert about.callCount() == 2
+    assert drive_requester.limiter.limit() == MAX_CONCURRENT_REQUESTS // 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_retry_after_date(drive_requests: DriveRequests, interceptor: RequestInterceptor, time: FakeTime):
+    about = interceptor.setError("^/drive/v3/about.*$")
+    about.addResponse(Response(status=403, headers={"Retry-After": format_datetime((time.now() + timedelta(minutes=2)).astimezone(timezone.utc), usegmt=True)}))
+    time.clearSleeps()
+    await drive_requests.getAboutInfo()
+    assert time.sleeps == [120]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("retry_after", ["0", "-5", "past_date"])
+async def test_rate_limit_retry_after_now_backs_off(drive_requests: DriveRequests, drive_requester: DriveRequester, interceptor: RequestInterceptor, time: FakeTime, retry_after):
+    if retry_after == "past_date":
+        retry_after = format_datetime((time.now() - timedelta(minutes=2)).astimezone(timezone.utc), usegmt=True)
+    about = interceptor.setError("^/drive/v3/about.*$")
+    about.addResponse(Response(status=429, headers={"Retry-After": retry_after}))
+    time.clearSleeps()
+    await drive_requests.getAboutInfo()
+
+    # Nothing to wait on from Google, so the usual backoff applies instead of retrying right away
+    assert time.sleeps == [DRIVE_RETRY_INITIAL_SECONDS]
+    assert about.callCount() == 2
+    assert drive_requester.limiter.limit() == MAX_CONCURRENT_REQUESTS // 2
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import tarfile
 import pytest
@@ -167,6 +168,8 @@ class HelperTestSource(SimulatedSource):
         self.allow_create = True
         self.allow_save = True
         self.queries = 0
+        self.saving = 0
+        self.most_saving = 0
 
     def reset(self):
         self.saved = []
@@ -201,7 +204,14 @@ class HelperTestSource(SimulatedSource):
     async def save(self, backup, bytes: IOBase = None):
         if not self.allow_save:
             raise IntentionalFailure()
-        return await super().save(backup, bytes=bytes)
+        self.saving += 1
+        self.most_saving = max(self.most_saving, self.saving)
+        try:
+            # Give other saves a chance to start, like a real upload would
+            await asyncio.sleep(0)
+            return await super().save(backup, bytes=bytes)
+        finally:
+            self.saving -= 1
 
 
 @singleton
@@ -212,8 +222,8 @@ class Uploader():
         self.session = session
         self.time = time
 
-    async def upload(self, data) -> AsyncHttpGetter:
+    async def upload(self, data, read_ahead=0) -> AsyncHttpGetter:
         async with await self.session.post(self.host + "/uploadfile", data=data) as resp:
             resp.raise_for_status()
-        source = AsyncHttpGetter(self.host + "/readfile", {}, self.session, time=self.time)
+        source = AsyncHttpGetter(self.host + "/readfile", {}, self.session, time=self.time, read_ahead=read_ahead)
         return source
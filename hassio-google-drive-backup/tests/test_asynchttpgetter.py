@@ -1,3 +1,4 @@
+import asyncio
 from datetime import timedelta
 import pytest
 from aiohttp import ClientSession
@@ -115,3 +116,111 @@ async def test_speed(uploader: Uploader, server, time: FakeTime):
     assert getter.speed(period=timedelta(seconds=10)) == 2
     time.advance(seconds=5)
     assert getter.speed(period=timedelta(seconds=10)) == 1
+
+
+async def waitForPrefetch(getter, amount):
+    for x in range(200):
+        if getter.prefetched() >= amount:
+            return
+        await asyncio.sleep(0.01)
+    assert getter.prefetched() >= amount
+
+
+@pytest.mark.asyncio
+async def test_read_ahead(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(100)), read_ahead=10)
+    async with getter:
+        # Reading ahead starts right away, but stops once enough has been buffered
+        await waitForPrefetch(getter, 10)
+        await asyncio.sleep(0.05)
+        assert getter.prefetched() == 10
+        assert getter.position() == 0
+
+        assert (await getter.read(4)).read() == bytearray(range(0, 4))
+        assert getter.position() == 4
+        await waitForPrefetch(getter, 10)
+
+        # Reads larger than the read ahead still work
+        assert (await getter.read(30)).read() == bytearray(range(4, 34))
+        assert (await getter.read(100)).read() == bytearray(range(34, 100))
+        assert (await getter.read(100)).read() == bytearray([])
+        assert getter.prefetched() == 0
+
+
+@pytest.mark.asyncio
+async def test_read_ahead_seek(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(100)), read_ahead=10)
+    async with getter:
+        assert (await getter.read(2)).read() == bytearray([0, 1])
+        await waitForPrefetch(getter, 10)
+
+        # Seeking within what's been read ahead just skips over it
+        getter.position(7)
+        assert getter.prefetched() == 5
+        assert (await getter.read(2)).read() == bytearray([7, 8])
+
+        # Seeking anywhere else throws it away
+        getter.position(50)
+        assert getter.prefetched() == 0
+        assert (await getter.read(3)).read() == bytearray([50, 51, 52])
+        getter.position(1)
+        assert (await getter.read(3)).read() == bytearray([1, 2, 3])
+        await waitForPrefetch(getter, 10)
+        assert (await getter.read(10)).read() == bytearray(range(4, 14))
+
+
+@pytest.mark.asyncio
+async def test_read_ahead_error_discarded_by_seek(uploader: Uploader, server, monkeypatch):
+    getter = await uploader.upload(bytearray(range(100)), read_ahead=10)
+    async with getter:
+        assert (await getter.read(2)).read() == bytearray([0, 1])
+        await waitForPrefetch(getter, 10)
+
+        # Make the next read ahead fail
+        failed = asyncio.Event()
+        readRemote = getter._readRemote
+
+        async def failOnce(count):
+            if not failed.is_set():
+                failed.set()
+                raise Exception("Connection dropped")
+            return await readRemote(count)
+        monkeypatch.setattr(getter, "_readRemote", failOnce)
+        getter.position(4)
+        await failed.wait()
+        await asyncio.sleep(0)
+
+        # The error belonged to the old response, so it shouldn't show up after moving somewhere else
+        getter.position(50)
+        assert (await getter.read(3)).read() == bytearray([50, 51, 52])
+
+
+@pytest.mark.asyncio
+async def test_disable_read_ahead(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(100)), read_ahead=10)
+    await getter.disableReadAhead()
+    async with getter:
+        await asyncio.sleep(0.05)
+        assert getter.prefetched() == 0
+        assert (await getter.read(4)).read() == bytearray(range(0, 4))
+        await asyncio.sleep(0.05)
+        assert getter.prefetched() == 0
+
+    # Turning it off partway through throws away what was already read ahead
+    getter = await uploader.upload(bytearray(range(100)), read_ahead=10)
+    async with getter:
+        assert (await getter.read(2)).read() == bytearray([0, 1])
+        await waitForPrefetch(getter, 10)
+        await getter.disableReadAhead()
+        assert getter.prefetched() == 0
+        assert (await getter.read(20)).read() == bytearray(range(2, 22))
+
+
+@pytest.mark.asyncio
+async def test_read_ahead_setup_twice(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(100)), read_ahead=10)
+    await getter.setup()
+    await waitForPrefetch(getter, 10)
+    await getter.setup()
+    assert (await getter.read(20)).read() == bytearray(range(0, 20))
+    await getter.__aexit__(None, None, None)
@@ -87,6 +87,15 @@ def test_validate_regex():
         Config().validate({Setting.DRIVE_IPV4: "192.168.1"})
 
 
+def test_validate_limit_hours():
+    assert Config().validate({Setting.BANDWIDTH_LIMIT_HOURS: "23:00-06:30"}) == defaultAnd(
+        {Setting.BANDWIDTH_LIMIT_HOURS: "23:00-06:30"})
+    with raises(InvalidConfigurationValue):
+        Config().validate({Setting.BANDWIDTH_LIMIT_HOURS: "29:59-00:00"})
+    with raises(InvalidConfigurationValue):
+        Config().validate({Setting.BANDWIDTH_LIMIT_HOURS: "06:00-24:00"})
+
+
 def test_remove_ssl():
     assert Config().validate({Setting.USE_SSL: True}) == defaultAnd({Setting.USE_SSL: True})
     assert Config().validate({Setting.USE_SSL: False}) == defaultAnd()
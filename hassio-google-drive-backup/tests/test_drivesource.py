@@ -8,10 +8,10 @@ from yarl import URL
 from aiohttp.client_exceptions import ClientResponseError
 from backup.config import Config, Setting
 from dev.simulationserver import SimulationServer
-from dev.simulated_google import SimulatedGoogle, URL_MATCH_UPLOAD_PROGRESS, URL_MATCH_FILE
+from dev.simulated_google import SimulatedGoogle, URL_MATCH_UPLOAD_PROGRESS, URL_MATCH_FILE, URL_MATCH_CHANGES
 from dev.request_interceptor import RequestInterceptor
 from backup.drive import DriveSource, FolderFinder, DriveRequests, RETRY_SESSION_ATTEMPTS, UPLOAD_SESSION_EXPIRATION_DURATION, URL_START_UPLOAD
-from backup.drive.driverequests import (BASE_CHUNK_SIZE, CHUNK_UPLOAD_TARGET_SECONDS)
+from backup.drive.driverequests import BASE_CHUNK_SIZE
 from backup.drive.drivesource import FOLDER_MIME_TYPE
 from backup.exceptions import (BackupFolderInaccessible, BackupFolderMissingError,
                                DriveQuotaExceeded, ExistingBackupFolderError,
@@ -19,7 +19,9 @@ from backup.exceptions import (BackupFolderInaccessible, BackupFolderMissingErro
                                GoogleInternalError, GoogleUnexpectedError,
                                GoogleSessionError, GoogleTimeoutError, CredRefreshMyError, CredRefreshGoogleError)
 from backup.creds import Creds
-from backup.model import DriveBackup, DummyBackup
+from backup.model import DriveBackup, DummyBackup, Model
+from backup.util import DataCache
+from injector import ClassAssistedBuilder
 from .faketime import FakeTime
 from .helpers import compareStreams, createBackupTar
 
@@ -234,34 +236,51 @@ async def test_upload_resume(drive: DriveSource, time, backup_helper: BackupHelp
     await compareStreams(data, await drive.read(from_backup))
 
 
-def test_chunk_size(drive: DriveSource, config: Config):
-    max = config.get(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES) / BASE_CHUNK_SIZE
-    assert drive.drivebackend._getNextChunkSize(
-        1000000000, 0) == max
-    assert drive.drivebackend._getNextChunkSize(
-        1, CHUNK_UPLOAD_TARGET_SECONDS) == 1
-    assert drive.drivebackend._getNextChunkSize(
-        1000000000, CHUNK_UPLOAD_TARGET_SECONDS) == max
-    assert drive.drivebackend._getNextChunkSize(
-        1, CHUNK_UPLOAD_TARGET_SECONDS) == 1
-    assert drive.drivebackend._getNextChunkSize(
-        1, 1) == CHUNK_UPLOAD_TARGET_SECONDS
-    assert drive.drivebackend._getNextChunkSize(
-        1, 1.01) == CHUNK_UPLOAD_TARGET_SECONDS - 1
+@pytest.mark.asyncio
+async def test_upload_resume_after_restart(drive: DriveSource, time, config: Config, backup_helper: BackupHelper, google: SimulatedGoogle, interceptor: RequestInterceptor, injector):
+    from_backup, data = await backup_helper.createFile()
+    interceptor.setError(URL_MATCH_UPLOAD_PROGRESS, fail_after=1, status=500)
+    with pytest.raises(GoogleInternalError):
+        await drive.save(from_backup, data)
+    assert google.chunks == [BASE_CHUNK_SIZE]
+    location = drive.drivebackend.last_attempt_location
 
+    # Simulate an addon restart, which loses everything in memory
+    restarted = injector.get(ClassAssistedBuilder[DriveRequests]).build(data_cache=DataCache(config, time))
+    assert restarted is not drive.drivebackend
+    assert restarted.last_attempt_location == location
+    assert restarted.last_attempt_count == 1
+    drive.drivebackend = restarted
 
-def test_chunk_size_limits(drive: DriveSource, config: Config):
-    config.override(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES, 1)
-    assert drive.drivebackend._getNextChunkSize(1000000000, 0) == 1
-    assert drive.drivebackend._getNextChunkSize(1, 1000000) == 1
+    # The upload should pick up where it left off
+    interceptor.clear()
+    data.position(0)
+    drive_backup = await drive.save(from_backup, data)
+    from_backup.addSource(drive_backup)
+    assert google.chunks == [BASE_CHUNK_SIZE,
+                             BASE_CHUNK_SIZE, (data.size()) - BASE_CHUNK_SIZE * 2]
+    assert not interceptor.urlWasCalled(URL_START_UPLOAD)
+    data.position(0)
+    await compareStreams(data, await drive.read(from_backup))
+
+    # The saved session is removed once the upload completes
+    assert DataCache(config, time).uploadSession is None
+
+
+@pytest.mark.asyncio
+async def test_saved_upload_session_for_other_backup(drive: DriveSource, time, config: Config, backup_helper: BackupHelper, google: SimulatedGoogle, interceptor: RequestInterceptor, injector):
+    from_backup, data = await backup_helper.createFile()
+    interceptor.setError(URL_MATCH_UPLOAD_PROGRESS, fail_after=1, status=500)
+    with pytest.raises(GoogleInternalError):
+        await drive.save(from_backup, data)
 
-    config.override(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES, BASE_CHUNK_SIZE * 1.5)
-    assert drive.drivebackend._getNextChunkSize(1000000000, 0) == 1
-    assert drive.drivebackend._getNextChunkSize(1, 1000000) == 1
+    drive.drivebackend = injector.get(ClassAssistedBuilder[DriveRequests]).build(data_cache=DataCache(config, time))
 
-    config.override(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES, BASE_CHUNK_SIZE * 3.5)
-    assert drive.drivebackend._getNextChunkSize(1000000000, 0) == 3
-    assert drive.drivebackend._getNextChunkSize(1, 1000000) == 1
+    # A different backup shouldn't try to use the saved session
+    other_backup, other_data = await backup_helper.createFile(slug="otherslug", name="Other Name")
+    interceptor.clear()
+    await drive.save(other_backup, other_data)
+    assert interceptor.urlWasCalled(URL_START_UPLOAD)
 
 
 @pytest.mark.asyncio
@@ -281,6 +300,30 @@ async def test_working_through_upload(drive: DriveSource, server: SimulationServ
     assert not drive.isWorking()
 
 
+@pytest.mark.asyncio
+async def test_upload_buffers_at_most_two_chunks(drive: DriveSource, config: Config, uploader, google: SimulatedGoogle, time: FakeTime, interceptor: RequestInterceptor):
+    max_chunk = BASE_CHUNK_SIZE * 2
+    config.override(Setting.MAXIMUM_UPLOAD_CHUNK_BYTES, max_chunk)
+    from_backup = DummyBackup("Test Name", time.toUtc(time.local(1985, 12, 6)), "fake source", "testslug")
+
+    # A supervisor download that would otherwise read far ahead of the upload
+    data = await uploader.upload(createBackupTar("testslug", "Test Name", time.now(), BASE_CHUNK_SIZE * 16), read_ahead=BASE_CHUNK_SIZE * 32)
+
+    # Let a chunk upload, then hold up the next one while the source keeps reading
+    matcher = interceptor.setWaiter(URL_MATCH_UPLOAD_PROGRESS, attempts=1)
+    save_task = asyncio.create_task(drive.save(from_backup, data))
+    await matcher.waitForCall()
+    for x in range(20):
+        await asyncio.sleep(0.01)
+
+    # Only the chunk being sent and the one read ahead of it are held in memory
+    assert data.prefetched() == 0
+    assert data.position() - sum(google.chunks) <= max_chunk * 2
+
+    matcher.clear()
+    await save_task
+
+
 @pytest.mark.asyncio
 async def test_drive_timeout(drive, config, time: FakeTime):
     # Ensure we have credentials
@@ -595,6 +638,43 @@ async def test_folder_missing_on_upload(time, drive: DriveSource, config: Config
         await drive.save(from_backup, data)
 
 
+@pytest.mark.asyncio
+async def test_folder_verification_survives_restart(time: FakeTime, drive: DriveSource, config: Config, data_cache: DataCache, google: SimulatedGoogle, interceptor: RequestInterceptor):
+    await drive.get()
+    folder_id = await drive.getFolderId()
+    assert data_cache.driveFolder['id'] == folder_id
+
+    # A new FolderFinder, like after a restart, trusts the recent verification without asking Drive
+    check = interceptor.setError(URL_MATCH_FILE)
+    restarted = FolderFinder(config, time, drive.drivebackend, data_cache)
+    assert await restarted.get() == folder_id
+    assert check.callCount() == 0
+
+    # Once the verification is old, the folder gets checked again
+    time.advance(minutes=32)
+    assert await restarted.get() == folder_id
+    assert await restarted.get() == folder_id
+    assert check.callCount() == 1
+
+    # Checking it after that is a conditional request that Drive answers with 304
+    time.advance(minutes=32)
+    assert await restarted.get() == folder_id
+    assert check.callCount() == 2
+    assert google.not_modified == 1
+
+
+@pytest.mark.asyncio
+async def test_folder_cache_cleared_on_upload_error(time, drive: DriveSource, config: Config, data_cache: DataCache, backup_helper):
+    await drive.get()
+    assert data_cache.driveFolder is not None
+    config.override(Setting.SPECIFY_BACKUP_FOLDER, True)
+    await drive.drivebackend.delete(await drive.getFolderId())
+
+    with pytest.raises(BackupFolderInaccessible):
+        await drive.save(*await backup_helper.createFile())
+    assert data_cache.driveFolder is None
+
+
 @pytest.mark.asyncio
 async def test_folder_error_on_upload_lost_permission(time, drive: DriveSource, config: Config, google: SimulatedGoogle, backup_helper, session):
     # Make the folder
@@ -1046,3 +1126,101 @@ async def test_note_creation(drive: DriveSource, time: FakeTime, folder_finder:
     from_backup, data = await backup_helper.createFile(note="test")
     backup = await drive.save(from_backup, data)
     assert backup.note() == "test"
+
+
+@pytest.mark.asyncio
+async def test_purge_sends_one_batch(model: Model, drive: DriveSource, time: FakeTime, config: Config, google: SimulatedGoogle, backup_helper: BackupHelper):
+    config.override(Setting.DAYS_BETWEEN_BACKUPS, 0)
+    config.override(Setting.CONFIRM_MULTIPLE_DELETES, False)
+    for x in range(30):
+        from_backup, data = await backup_helper.createFile(size=1024, slug="slug{0}".format(x), name="Backup {0}".format(x))
+        await drive.save(from_backup, data)
+
+    # Lowering the limit should delete all of the extra backups in one request
+    config.override(Setting.MAX_BACKUPS_IN_GOOGLE_DRIVE, 5)
+    await model.sync(time.now())
+    assert google.batches == [25]
+    assert len(await drive.get()) == 5
+
+
+@pytest.mark.asyncio
+async def test_incremental_listing(drive: DriveSource, time: FakeTime, google: SimulatedGoogle, interceptor: RequestInterceptor, backup_helper: BackupHelper, data_cache: DataCache, config: Config):
+    from_backup, data = await backup_helper.createFile(slug="first")
+    await drive.save(from_backup, data)
+    query = interceptor.setError("^/drive/v3/files/$")
+    changes = interceptor.setError(URL_MATCH_CHANGES)
+    assert list((await drive.get()).keys()) == ["first"]
+    assert query.callCount() == 1
+    assert changes.callCount() == 0
+
+    # Later listings only ask what changed
+    from_backup, data = await backup_helper.createFile(slug="second")
+    await drive.save(from_backup, data)
+    assert set((await drive.get()).keys()) == {"first", "second"}
+    assert query.callCount() == 1
+    assert changes.callCount() == 1
+
+    # Changes made somewhere else show up too
+    id = (await drive.get())["first"].id()
+    google.items[id]['appProperties']['retained'] = "True"
+    backups = await drive.get()
+    assert backups["first"].retained()
+    del google.items[id]
+    assert list((await drive.get()).keys()) == ["second"]
+    assert query.callCount() == 1
+
+    # Where the changes left off survives a restart
+    assert DataCache(config, time).driveChanges['token'] == data_cache.driveChanges['token']
+
+
+@pytest.mark.asyncio
+async def test_listing_with_rejected_token(drive: DriveSource, google: SimulatedGoogle, interceptor: RequestInterceptor, backup_helper: BackupHelper):
+    from_backup, data = await backup_helper.createFile()
+    await drive.save(from_backup, data)
+    await drive.get()
+    query = interceptor.setError("^/drive/v3/files/$")
+
+    google.expireChangeTokens()
+    assert len(await drive.get()) == 1
+    assert query.callCount() == 1
+    assert len(await drive.get()) == 1
+    assert query.callCount() == 1
+
+
+@pytest.mark.asyncio
+async def test_full_listing_every_day(drive: DriveSource, time: FakeTime, interceptor: RequestInterceptor, backup_helper: BackupHelper):
+    from_backup, data = await backup_helper.createFile()
+    await drive.save(from_backup, data)
+    await drive.get()
+    query = interceptor.setError("^/drive/v3/files/$")
+    time.advance(hours=23)
+    await drive.get()
+    assert query.callCount() == 0
+    time.advance(hours=2)
+    await drive.get()
+    assert query.callCount() == 1
+
+
+@pytest.mark.asyncio
+async def test_get_requests_concurrently(drive: DriveSource, interceptor: RequestInterceptor, backup_helper: BackupHelper):
+    from_backup, data = await backup_helper.createFile()
+    await drive.save(from_backup, data)
+    await drive.get()
+
+    about = interceptor.setWaiter("^/drive/v3/about$")
+    changes = interceptor.setError(URL_MATCH_CHANGES)
+    task = asyncio.create_task(drive.get())
+    await about.waitForCall()
+
+    # Listing the folder doesn't wait for Drive's storage info
+    for x in range(100):
+        if changes.callCount() > 0:
+            break
+        await asyncio.sleep(0.01)
+    assert changes.callCount() == 1
+    assert not task.done()
+
+    about.clear()
+    assert len(await task) == 1
+    assert set(drive.get_timing.keys()) == {'info', 'list', 'total', 'saved'}
+    assert drive.get_timing['saved'] >= 0
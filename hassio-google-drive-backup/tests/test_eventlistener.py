@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from backup.config import Config, Setting
+from backup.exceptions import SupervisorPermissionError
+from backup.ha import EventListener, HaRequests, HaSource
+from dev.simulated_supervisor import SimulatedSupervisor
+
+WAIT_SECONDS = 10
+
+
+async def startListening(listener: EventListener):
+    await listener.start()
+    await asyncio.wait_for(listener.connected_signal.wait(), WAIT_SECONDS)
+
+
+@pytest.mark.asyncio
+async def test_trigger_on_new_backup(event_listener: EventListener, supervisor: SimulatedSupervisor, ha: HaSource):
+    await ha.get()
+    await startListening(event_listener)
+    assert not await event_listener.check()
+
+    await supervisor.createBackup({'name': "Test Backup"})
+    await asyncio.wait_for(event_listener.noticed_change_signal.wait(), WAIT_SECONDS)
+    assert await event_listener.check()
+    assert not await event_listener.check()
+
+
+@pytest.mark.asyncio
+async def test_no_trigger_without_changes(event_listener: EventListener, supervisor: SimulatedSupervisor, ha: HaSource):
+    await ha.get()
+    await startListening(event_listener)
+
+    # Jobs that have nothing to do with backups get ignored
+    await supervisor.sendJobEvent("addon_manager_update", "test")
+    await supervisor.sendJobEvent("backup_manager_full_backup", "test")
+    await asyncio.wait_for(event_listener.noticed_change_signal.wait(), WAIT_SECONDS)
+
+    # A backup job finished but the backups didn't change, so there is nothing to sync
+    assert not await event_listener.check()
+
+
+@pytest.mark.asyncio
+async def test_reconnect(event_listener: EventListener, supervisor: SimulatedSupervisor, ha: HaSource):
+    await ha.get()
+    await startListening(event_listener)
+    await supervisor.closeWebsockets()
+    await asyncio.wait_for(event_listener.connected_signal.wait(), WAIT_SECONDS)
+
+    await supervisor.createBackup({'name': "Test Backup"})
+    await asyncio.wait_for(event_listener.noticed_change_signal.wait(), WAIT_SECONDS)
+    assert await event_listener.check()
+
+
+@pytest.mark.asyncio
+async def test_disable_listening(event_listener: EventListener, config: Config, server):
+    config.override(Setting.WATCH_BACKUP_EVENTS, False)
+    await event_listener.start()
+    assert not event_listener.isRunning()
+
+
+@pytest.mark.asyncio
+async def test_connect_bad_token(ha_requests: HaRequests, config: Config, server):
+    config.override(Setting.SUPERVISOR_TOKEN, "wrong_token")
+    with pytest.raises(SupervisorPermissionError):
+        await ha_requests.connectEvents()
@@ -9,12 +9,14 @@ from backup.config import Config, Setting, CreateOptions, Version
 from backup.const import SOURCE_HA
 from backup.exceptions import (HomeAssistantDeleteError, BackupInProgress,
                                BackupPasswordKeyInvalid, UploadFailed, SupervisorConnectionError, SupervisorPermissionError, SupervisorTimeoutError, UnknownNetworkStorageError, InactiveNetworkStorageError)
-from backup.util import GlobalInfo, DataCache, KEY_CREATED, KEY_LAST_SEEN, KEY_NAME
-from backup.ha import HaSource, PendingBackup, EVENT_BACKUP_END, EVENT_BACKUP_START, HABackup, Password, AddonStopper
+from backup.util import GlobalInfo, DataCache, KEY_CREATED, KEY_LAST_SEEN, KEY_NAME, AsyncHttpGetter, LocalFileStream
+from backup.ha import HaSource, HaRequests, PendingBackup, EVENT_BACKUP_END, EVENT_BACKUP_START, HABackup, Password, AddonStopper
+from backup.ha import harequests
+from backup.ha.restorespool import SPOOL_FREE_SPACE_MARGIN
 from backup.model import DummyBackup
 from dev.simulationserver import SimulationServer
 from .faketime import FakeTime
-from .helpers import all_addons, all_folders, createBackupTar, getTestStream
+from .helpers import all_addons, all_folders, createBackupTar, getTestStream, IntentionalFailure
 from dev.simulated_supervisor import SimulatedSupervisor, URL_MATCH_SELF_OPTIONS, URL_MATCH_START_ADDON, URL_MATCH_STOP_ADDON, URL_MATCH_BACKUP_FULL, URL_MATCH_BACKUP_DELETE, URL_MATCH_MISC_INFO, URL_MATCH_BACKUP_DOWNLOAD, URL_MATCH_BACKUPS, URL_MATCH_SNAPSHOT, URL_MATCH_MOUNT
 from dev.request_interceptor import RequestInterceptor
 from backup.model import Model
@@ -27,6 +29,53 @@ async def test_sync_empty(ha) -> None:
     assert len(await ha.get()) == 0
 
 
+@pytest.mark.asyncio
+async def test_read_from_backup_directory(ha: HaSource, time, config: Config, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor) -> None:
+    backup: HABackup = await ha.create(CreateOptions(time.now(), "Test Name"))
+    full = DummyBackup(backup.name(), backup.date(), backup.size(), backup.slug(), "dummy")
+    full.addSource(backup)
+
+    # Without a local file, the backup gets downloaded from the supervisor
+    download = await ha.read(full)
+    assert isinstance(download, AsyncHttpGetter)
+
+    # With the file in the backup directory, it should be read directly from disk
+    data = supervisor._backup_data[backup.slug()]
+    with open(os.path.join(config.get(Setting.BACKUP_DIRECTORY_PATH), backup.slug() + ".tar"), "wb") as f:
+        f.write(data)
+    download = await ha.read(full)
+    assert isinstance(download, LocalFileStream)
+    async with download:
+        assert download.size() == len(data)
+        assert (await download.read(10)).getbuffer() == data[:10]
+        download.position(len(data) - 10)
+        assert (await download.read(100)).getbuffer() == data[-10:]
+        assert download.progress() == 100
+        assert len((await download.read(100)).getbuffer()) == 0
+    assert not interceptor.urlWasCalled(URL_MATCH_BACKUP_DOWNLOAD)
+
+
+@pytest.mark.asyncio
+async def test_read_from_backup_directory_named_file(ha: HaSource, time, config: Config, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor) -> None:
+    backup: HABackup = await ha.create(CreateOptions(time.now(), "Test Name"))
+    full = DummyBackup(backup.name(), backup.date(), backup.size(), backup.slug(), "dummy")
+    full.addSource(backup)
+
+    # Newer supervisors name the file after the backup, so it has to be found by the slug in its backup.json
+    other = createBackupTar("other_slug", "Other", time.now(), 1024)
+    with open(os.path.join(config.get(Setting.BACKUP_DIRECTORY_PATH), "Other.tar"), "wb") as f:
+        f.write(other.getbuffer())
+    data = supervisor._backup_data[backup.slug()]
+    with open(os.path.join(config.get(Setting.BACKUP_DIRECTORY_PATH), "Test_Name.tar"), "wb") as f:
+        f.write(data)
+    download = await ha.read(full)
+    assert isinstance(download, LocalFileStream)
+    async with download:
+        assert download.size() == len(data)
+        assert (await download.read(len(data))).getbuffer() == data
+    assert not interceptor.urlWasCalled(URL_MATCH_BACKUP_DOWNLOAD)
+
+
 @pytest.mark.asyncio
 async def test_CRUD(ha: HaSource, time, interceptor: RequestInterceptor, data_cache: DataCache) -> None:
     backup: HABackup = await ha.create(CreateOptions(time.now(), "Test Name"))
@@ -374,6 +423,113 @@ async def test_upload(time, ha, server, uploader):
     assert list((await ha.get()).values())[0].retained()
 
 
+class FlakyStream():
+    """Wraps a stream so its generator fails after a given position, like a download over a bad connection"""
+
+    def __init__(self, stream, fail_after=None):
+        self._stream = stream
+        self._fail_after = fail_after
+        self.started_at = None
+
+    def size(self):
+        return self._stream.size()
+
+    def position(self, pos=None):
+        return self._stream.position(pos)
+
+    def __format__(self, format_spec: str) -> str:
+        return format(self._stream, format_spec)
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+
+    async def __aexit__(self, type, value, traceback):
+        await self._stream.__aexit__(type, value, traceback)
+
+    async def generator(self, chunk_size):
+        self.started_at = self._stream.position()
+        async for chunk in self._stream.generator(chunk_size):
+            if self._fail_after is not None and self._stream.position() > self._fail_after:
+                raise IntentionalFailure()
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_upload_resumes_after_failure(time, ha: HaSource, server, uploader):
+    tar = createBackupTar("slug", "Test Name", time.now(), 1024 * 1024 * 3).getvalue()
+    dummy = DummyBackup("Test Name", time.now(), "src", "slug", "dummy")
+    ha._spool._checkpoint_bytes = 1
+
+    # The first attempt fails partway through, but what it downloaded so far gets kept
+    with pytest.raises(UploadFailed):
+        await ha.save(dummy, FlakyStream(await uploader.upload(tar), fail_after=2 * 1024 * 1024))
+    assert ha._spool.checkpoint() == 2 * 1024 * 1024
+    assert os.path.exists(ha._spool.path())
+
+    # So the next attempt picks up from there
+    data = FlakyStream(await uploader.upload(tar))
+    backup: HABackup = await ha.save(dummy, data)
+    assert data.started_at == 2 * 1024 * 1024
+    assert backup.slug() == "slug"
+    downloaded = await ha.harequests.download("slug")
+    async with downloaded:
+        assert (await downloaded.read(len(tar) + 1)).getvalue() == tar
+
+    # And the spool is cleaned up afterward
+    assert not os.path.exists(ha._spool.path())
+    assert ha._spool.checkpoint() == 0
+
+
+@pytest.mark.asyncio
+async def test_upload_restarts_for_different_backup(time, ha: HaSource, server, uploader):
+    ha._spool._checkpoint_bytes = 1
+    tar = createBackupTar("slug", "Test Name", time.now(), 1024 * 1024 * 3).getvalue()
+    with pytest.raises(UploadFailed):
+        await ha.save(DummyBackup("Test Name", time.now(), "src", "slug", "dummy"), FlakyStream(await uploader.upload(tar), fail_after=2 * 1024 * 1024))
+
+    other = createBackupTar("other", "Other Name", time.now(), 1024 * 1024 * 3).getvalue()
+    data = FlakyStream(await uploader.upload(other))
+    backup = await ha.save(DummyBackup("Other Name", time.now(), "src", "other", "dummy"), data)
+    assert data.started_at == 0
+    assert backup.slug() == "other"
+
+
+@pytest.mark.asyncio
+async def test_stale_restore_spool_deleted(time: FakeTime, ha: HaSource, server, uploader):
+    ha._spool._checkpoint_bytes = 1
+    tar = createBackupTar("slug", "Test Name", time.now(), 1024 * 1024 * 3).getvalue()
+    with pytest.raises(UploadFailed):
+        await ha.save(DummyBackup("Test Name", time.now(), "src", "slug", "dummy"), FlakyStream(await uploader.upload(tar), fail_after=2 * 1024 * 1024))
+
+    time.advance(hours=23)
+    await ha.refresh()
+    assert os.path.exists(ha._spool.path())
+
+    time.advance(hours=2)
+    await ha.refresh()
+    assert not os.path.exists(ha._spool.path())
+    assert ha._spool.checkpoint() == 0
+
+
+@pytest.mark.asyncio
+async def test_restore_streams_without_room_to_spool(time, ha: HaSource, server, uploader):
+    tar = createBackupTar("slug", "Test Name", time.now(), 1024 * 1024 * 3).getvalue()
+
+    # The supervisor's copy of the backup goes on the same disk as the spool, so there has to be room for both
+    ha._spool._bytesFree = lambda directory: len(tar) * 2 + SPOOL_FREE_SPACE_MARGIN - 1
+    assert not ha._spool.fits("slug", len(tar))
+    ha._spool._bytesFree = lambda directory: len(tar) * 2 + SPOOL_FREE_SPACE_MARGIN
+    assert ha._spool.fits("slug", len(tar))
+
+    ha._spool._bytesFree = lambda directory: 0
+    backup: HABackup = await ha.save(DummyBackup("Test Name", time.now(), "src", "slug", "dummy"), await uploader.upload(tar))
+    assert backup.slug() == "slug"
+    assert not os.path.exists(ha._spool.path())
+    downloaded = await ha.harequests.download("slug")
+    async with downloaded:
+        assert (await downloaded.read(len(tar) + 1)).getvalue() == tar
+
+
 @pytest.mark.asyncio
 async def test_corrupt_upload(time, ha, server, uploader):
     # verify a corrupt backup throws the right exception
@@ -1166,3 +1322,151 @@ async def test_exclude_database(ha: HaSource, time, config: Config, supervisor:
         backup = await ha.create(CreateOptions(time.now(), "Test Name"))
         assert isinstance(backup, PendingBackup)
         assert backup._request_info['homeassistant_exclude_database']
+
+
+@pytest.mark.asyncio
+async def test_backups_from_list_skip_detail_requests(ha: HaSource, time, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor):
+    await supervisor.createBackup({"name": "Test Backup"}, date=time.now())
+    details = interceptor.setError("^/backups/.*/info$")
+    backups = await ha.get()
+    assert len(backups) == 1
+    assert details.callCount() == 0
+    assert next(iter(backups.values())).name() == "Test Backup"
+
+
+@pytest.mark.asyncio
+async def test_backup_details_requested_concurrently(ha: HaSource, time, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor):
+    supervisor.summarize_backups = True
+    for x in range(3):
+        await supervisor.createBackup({"name": "Test Backup {0}".format(x)}, date=time.now() - timedelta(hours=x))
+    await ha.init()
+
+    details = interceptor.setWaiter("^/backups/.*/info$")
+    task = asyncio.create_task(ha.get())
+    await details.waitForCall()
+    for x in range(10):
+        await asyncio.sleep(0.01)
+
+    # Every backup's details were requested before any of them came back
+    assert details.callCount() == 3
+    details.clear()
+    backups = await task
+    assert len(backups) == 3
+    for backup in backups.values():
+        assert len(backup.details()['addons']) > 0
+        assert isinstance(backup.details()['addons'][0], dict)
+
+    # They're only requested once
+    await ha.get()
+    assert details.callCount() == 3
+
+
+async def lookupAll(requests: HaRequests):
+    await requests.supervisorInfo()
+    query = await requests.backups()
+    return [await requests.backup(listed['slug'], listed) for listed in query['backups']]
+
+
+@pytest.mark.asyncio
+async def test_backup_details_remembered_across_restart(ha: HaSource, time, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor, injector, data_cache: DataCache):
+    supervisor.summarize_backups = True
+    for x in range(2):
+        await supervisor.createBackup({"name": "Test Backup {0}".format(x)}, date=time.now() - timedelta(hours=x))
+    details = interceptor.setError("^/backups/.*/info$")
+    await lookupAll(injector.get(HaRequests))
+    assert details.callCount() == 2
+    assert len(data_cache.haBackupInfo['backups']) == 2
+
+    # A new HaRequests, like after a restart, uses what was remembered
+    restarted: HaRequests = injector.get(HaRequests)
+    backups = await lookupAll(restarted)
+    assert details.callCount() == 2
+    assert set(backup.name() for backup in backups) == {"Test Backup 0", "Test Backup 1"}
+
+    # Backups that go away get forgotten
+    await restarted.delete(backups[0].slug())
+    first = injector.get(HaRequests)
+    assert len(await lookupAll(first)) == 1
+    assert list(data_cache.haBackupInfo['backups'].keys()) == [backups[1].slug()]
+
+
+@pytest.mark.asyncio
+async def test_backup_details_forgotten_on_supervisor_update(ha: HaSource, time, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor, injector, data_cache: DataCache):
+    supervisor.summarize_backups = True
+    await supervisor.createBackup({"name": "Test Backup"}, date=time.now())
+    details = interceptor.setError("^/backups/.*/info$")
+    await lookupAll(injector.get(HaRequests))
+    assert details.callCount() == 1
+
+    supervisor._super_version = Version(2023, 8)
+    await lookupAll(injector.get(HaRequests))
+    assert details.callCount() == 2
+    assert data_cache.haBackupInfo['supervisor'] == "2023.8"
+
+
+@pytest.mark.asyncio
+async def test_backup_details_cache_size(ha: HaSource, time, supervisor: SimulatedSupervisor, injector, data_cache: DataCache, monkeypatch):
+    monkeypatch.setattr(harequests, "MAX_CACHED_BACKUPS", 2)
+    for x in range(3):
+        await supervisor.createBackup({"name": "Test Backup {0}".format(x)}, date=time.now() - timedelta(hours=x))
+    requests: HaRequests = injector.get(HaRequests)
+    backups = await lookupAll(requests)
+
+    # The least recently used backup was dropped
+    assert list(requests.cache.keys()) == [backups[1].slug(), backups[2].slug()]
+    assert list(data_cache.haBackupInfo['backups'].keys()) == [backups[1].slug(), backups[2].slug()]
+
+
+@pytest.mark.asyncio
+async def test_info_requested_concurrently(ha: HaSource, time, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor):
+    core_info = interceptor.setWaiter("^/core/info$")
+    host_info = interceptor.setWaiter(URL_MATCH_MISC_INFO)
+    init = asyncio.create_task(ha.init())
+
+    # Both requests are waiting for a reply at the same time
+    await asyncio.wait_for(core_info.waitForCall(), 10)
+    await asyncio.wait_for(host_info.waitForCall(), 10)
+    assert not init.done()
+
+    core_info.clear()
+    host_info.clear()
+    await init
+    assert ha.isInitialized()
+
+
+@pytest.mark.asyncio
+async def test_create_reuses_recent_info(ha: HaSource, time, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor):
+    await ha.init()
+    interceptor.clear()
+    await ha.create(CreateOptions(time.now(), "Test Name"))
+    assert not interceptor.urlWasCalled("^/addons/self/info$")
+    assert not interceptor.urlWasCalled("^/core/info$")
+    assert not interceptor.urlWasCalled(URL_MATCH_MISC_INFO)
+    assert not interceptor.urlWasCalled("^/addons$")
+
+    # Only the info that changes more often gets requested again after a few minutes
+    time.advance(minutes=2)
+    interceptor.clear()
+    await ha.create(CreateOptions(time.now(), "Test Name"))
+    assert interceptor.urlWasCalled("^/addons/self/info$")
+    assert interceptor.urlWasCalled("^/core/info$")
+    assert not interceptor.urlWasCalled(URL_MATCH_MISC_INFO)
+    assert not interceptor.urlWasCalled("^/addons$")
+
+
+@pytest.mark.asyncio
+async def test_slow_info_refreshed_in_background(ha: HaSource, time, supervisor: SimulatedSupervisor, interceptor: RequestInterceptor):
+    await ha.init()
+    time.advance(hours=2)
+    interceptor.clear()
+    host_info = interceptor.setWaiter(URL_MATCH_MISC_INFO)
+
+    # The backup gets made with the old host info, without waiting for the new info
+    await ha.create(CreateOptions(time.now(), "Test Name"))
+    await host_info.waitForCall()
+    assert interceptor.urlWasCalled("^/addons$")
+
+    host_info.clear()
+    await ha._info_refresh_task
+    assert not ha._infoExpired("host")
+    assert not ha._infoExpired("addons")
@@ -416,6 +416,67 @@ async def test_dont_upload_deletable(time, model: Model, source, dest):
     assertBackup(model, [old])
 
 
+@pytest.mark.asyncio
+async def test_concurrent_uploads(time, model: Model, source, dest, simple_config: Config):
+    now = time.now()
+    simple_config.override(Setting.MAXIMUM_CONCURRENT_UPLOADS, 2)
+    dest.setMax(3)
+    source.setMax(3)
+    for x in range(3):
+        source.insert("backup" + str(x), now - timedelta(days=x))
+
+    await model.sync(now)
+    dest.assertThat(saved=3, current=3)
+    assert dest.most_saving == 2
+
+    # Newest backups should be uploaded first
+    assert [backup.slug() for backup in dest.saved] == ["backup0", "backup1", "backup2"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads_dont_upload_deletable(time, model: Model, source, dest, simple_config: Config):
+    now = time.now()
+    simple_config.override(Setting.MAXIMUM_CONCURRENT_UPLOADS, 3)
+    dest.setMax(2)
+    source.setMax(3)
+    for x in range(3):
+        source.insert("backup" + str(x), now - timedelta(days=x))
+
+    # Only the two newest backups get uploaded, since the oldest would be deleted right after.
+    await model.sync(now)
+    dest.assertThat(saved=2, current=2)
+    assert dest.most_saving == 2
+    assert [backup.slug() for backup in dest.saved] == ["backup0", "backup1"]
+
+    # Nothing changes on the next sync
+    dest.reset()
+    await model.sync(now)
+    dest.assertThat(current=2)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_upload_failure(time, model: Model, source, dest, simple_config: Config):
+    now = time.now()
+    simple_config.override(Setting.MAXIMUM_CONCURRENT_UPLOADS, 2)
+    dest.setMax(3)
+    source.setMax(3)
+    source.insert("backup0", now)
+    source.insert("backup1", now - timedelta(days=1))
+    original_save = dest.save
+
+    async def save(backup, bytes=None):
+        if backup.slug() == "backup0":
+            raise IntentionalFailure()
+        return await original_save(backup, bytes)
+    dest.save = save
+
+    # The other upload should still finish
+    with pytest.raises(IntentionalFailure):
+        await model.sync(now)
+    dest.assertThat(saved=1, current=1)
+    assert model.backups["backup1"].getSource(dest.name()) is not None
+
+
 @pytest.mark.asyncio
 async def test_dont_upload_when_disabled(time, model: Model, source, dest):
     now = time.now()
@@ -679,6 +679,85 @@ async def test_download_home_assistant(reader: ReaderHelper, ui_server, backup,
     await compareStreams(from_ha, from_server)
 
 
+async def readAll(stream) -> bytes:
+    await stream.setup()
+    return (await stream.read(stream.size())).getvalue()
+
+
+@pytest.mark.asyncio
+async def test_download_range_drive(reader: ReaderHelper, ui_server, backup, drive: DriveSource, ha: HaSource, session: ClientSession):
+    await ha.delete(backup)
+    data = await readAll(await drive.read(backup))
+    async with session.get(reader.getUrl() + "download?slug=" + backup.slug(), headers={"Range": "bytes=10-99"}) as resp:
+        assert resp.status == 206
+        assert resp.headers["Content-Range"] == "bytes 10-99/{0}".format(len(data))
+        assert resp.headers["Accept-Ranges"] == "bytes"
+        assert resp.headers["ETag"] == '"{0}-{1}"'.format(backup.slug(), len(data))
+        assert await resp.read() == data[10:100]
+
+
+@pytest.mark.asyncio
+async def test_download_range_local(reader: ReaderHelper, ui_server, backup, ha: HaSource, config: Config, session: ClientSession):
+    data = await readAll(await ha.read(backup))
+    with open(os.path.join(config.get(Setting.BACKUP_DIRECTORY_PATH), backup.slug() + ".tar"), "wb") as f:
+        f.write(data)
+    url = reader.getUrl() + "download?slug=" + backup.slug()
+
+    async with session.get(url) as resp:
+        assert resp.status == 200
+        assert await resp.read() == data
+    async with session.get(url, headers={"Range": "bytes=-100"}) as resp:
+        assert resp.status == 206
+        assert await resp.read() == data[-100:]
+
+
+@pytest.mark.asyncio
+async def test_download_multiple_ranges(reader: ReaderHelper, ui_server, backup, ha: HaSource, session: ClientSession):
+    data = await readAll(await ha.read(backup))
+    async with session.get(reader.getUrl() + "download?slug=" + backup.slug(), headers={"Range": "bytes=0-9,100-199"}) as resp:
+        assert resp.status == 206
+        assert resp.content_type == "multipart/byteranges"
+        parts = []
+        multipart = aiohttp.MultipartReader.from_response(resp)
+        while True:
+            part = await multipart.next()
+            if part is None:
+                break
+            parts.append((part.headers["Content-Range"], await part.read()))
+    assert parts == [
+        ("bytes 0-9/{0}".format(len(data)), data[0:10]),
+        ("bytes 100-199/{0}".format(len(data)), data[100:200]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_download_if_range(reader: ReaderHelper, ui_server, backup, ha: HaSource, session: ClientSession):
+    data = await readAll(await ha.read(backup))
+    url = reader.getUrl() + "download?slug=" + backup.slug()
+    async with session.get(url) as resp:
+        etag = resp.headers["ETag"]
+        last_modified = resp.headers["Last-Modified"]
+
+    # A matching validator gets the range
+    for validator in [etag, last_modified]:
+        async with session.get(url, headers={"Range": "bytes=10-19", "If-Range": validator}) as resp:
+            assert resp.status == 206
+            assert await resp.read() == data[10:20]
+
+    # But if the backup changed, it gets the whole thing
+    async with session.get(url, headers={"Range": "bytes=10-19", "If-Range": '"something-else"'}) as resp:
+        assert resp.status == 200
+        assert await resp.read() == data
+
+
+@pytest.mark.asyncio
+async def test_download_unsatisfiable_range(reader: ReaderHelper, ui_server, backup, ha: HaSource, session: ClientSession):
+    size = len(await readAll(await ha.read(backup)))
+    async with session.get(reader.getUrl() + "download?slug=" + backup.slug(), headers={"Range": "bytes={0}-".format(size)}) as resp:
+        assert resp.status == 416
+        assert resp.headers["Content-Range"] == "bytes */{0}".format(size)
+
+
 @pytest.mark.asyncio
 async def test_cancel_and_startsync(reader: ReaderHelper, coord: Coordinator):
     coord._sync_wait.set()
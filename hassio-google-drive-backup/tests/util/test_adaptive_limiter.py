@@ -0,0 +1,67 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from backup.util import AdaptiveLimiter
+from ..faketime import FakeTime
+
+
+@pytest.mark.asyncio
+async def test_caps_requests_in_flight(time: FakeTime):
+    limiter = AdaptiveLimiter(time, 1, 2)
+    await limiter.acquire()
+    await limiter.acquire()
+    assert limiter.inFlight() == 2
+
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+
+    limiter.release()
+    await waiting
+    assert limiter.inFlight() == 2
+
+
+@pytest.mark.asyncio
+async def test_additive_increase_multiplicative_decrease(time: FakeTime):
+    limiter = AdaptiveLimiter(time, 1, 8)
+    assert limiter.limit() == 8
+
+    generation = await limiter.acquire()
+    limiter.rateLimited(generation)
+    limiter.release()
+    assert limiter.limit() == 4
+
+    # Another response to a request sent before the cut doesn't cut it again
+    limiter.rateLimited(generation)
+    assert limiter.limit() == 4
+
+    # It takes about as many successes as the limit to raise it by one
+    for x in range(5):
+        await limiter.acquire()
+        limiter.succeeded()
+        limiter.release()
+    assert limiter.limit() == 5
+
+    for x in range(5):
+        limiter.rateLimited(await limiter.acquire())
+        limiter.release()
+    assert limiter.limit() == 1
+
+
+@pytest.mark.asyncio
+async def test_pauses_until_retry_after(time: FakeTime):
+    limiter = AdaptiveLimiter(time, 1, 8)
+    start = time.now()
+    limiter.rateLimited(await limiter.acquire(), 30)
+    limiter.release()
+
+    # A shorter wait doesn't cut the pause short
+    limiter.rateLimited(0, 10)
+    assert limiter.pausedUntil() == start + timedelta(seconds=30)
+
+    time.clearSleeps()
+    await limiter.acquire()
+    assert time.sleeps == [30]
+    assert limiter.pausedUntil() is None
@@ -0,0 +1,135 @@
+import asyncio
+
+from backup.config import Config, Setting
+from backup.util import BandwidthGovernor, Flow
+from backup.util.bandwidth_governor import parseLimitHours
+from ..faketime import FakeTime
+
+
+async def test_unlimited(time: FakeTime, config: Config):
+    governor = BandwidthGovernor(time, config)
+    assert governor.limit() == 0
+    await governor.consume(Flow.UPLOAD, 1024 * 1024 * 1024)
+    await governor.consume(Flow.UPLOAD, 1024 * 1024 * 1024)
+    assert time.sleeps == []
+
+
+async def test_limit(time: FakeTime, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, 100)
+    governor = BandwidthGovernor(time, config)
+
+    # The first transfer goes right away and the next ones wait to repay it
+    await governor.consume(Flow.UPLOAD, 300)
+    assert time.sleeps == []
+    await governor.consume(Flow.UPLOAD, 100)
+    assert time.sleeps == [3]
+    await governor.consume(Flow.DOWNLOAD, 50)
+    assert time.sleeps == [3, 1]
+
+
+async def test_burst(time: FakeTime, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, 100)
+    governor = BandwidthGovernor(time, config)
+    await governor.consume(Flow.UPLOAD, 100)
+
+    # Sitting idle only builds up a second's worth of bandwidth
+    time.advance(minutes=10)
+    await governor.consume(Flow.UPLOAD, 200)
+    await governor.consume(Flow.UPLOAD, 100)
+    assert time.sleeps == [1]
+
+
+async def test_priorities(time: FakeTime, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, 100)
+    governor = BandwidthGovernor(time, config)
+    await governor.consume(Flow.UPLOAD, 100)
+
+    order = []
+
+    async def transfer(flow: Flow):
+        await governor.consume(flow, 100)
+        order.append(flow)
+
+    # Hold everyone's sleep until all of the transfers are waiting, like they would be in real time
+    gate = asyncio.Event()
+    sleep = time.sleepAsync
+
+    async def gatedSleep(seconds, _exit_early=None):
+        await gate.wait()
+        await sleep(seconds)
+    time.sleepAsync = gatedSleep
+
+    tasks = [asyncio.create_task(transfer(flow)) for flow in [Flow.UPLOAD, Flow.DOWNLOAD, Flow.RESTORE]]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert order == [Flow.RESTORE, Flow.DOWNLOAD, Flow.UPLOAD]
+
+
+async def test_limit_hours(time: FakeTime, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, 100)
+    config.override(Setting.BANDWIDTH_LIMIT_HOURS, "06:00-22:00")
+    governor = BandwidthGovernor(time, config)
+
+    time.setNow(time.local(2020, 1, 1, 5, 59))
+    assert governor.limit() == 0
+    time.setNow(time.local(2020, 1, 1, 6, 0))
+    assert governor.limit() == 100
+    time.setNow(time.local(2020, 1, 1, 21, 59))
+    assert governor.limit() == 100
+    time.setNow(time.local(2020, 1, 1, 22, 0))
+    assert governor.limit() == 0
+
+
+async def test_limit_hours_over_midnight(time: FakeTime, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, 100)
+    config.override(Setting.BANDWIDTH_LIMIT_HOURS, "22:00-06:00")
+    governor = BandwidthGovernor(time, config)
+
+    time.setNow(time.local(2020, 1, 1, 23, 0))
+    assert governor.limit() == 100
+    time.setNow(time.local(2020, 1, 1, 3, 0))
+    assert governor.limit() == 100
+    time.setNow(time.local(2020, 1, 1, 12, 0))
+    assert governor.limit() == 0
+
+
+async def test_limit_ends_while_waiting(time: FakeTime, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, 100)
+    config.override(Setting.BANDWIDTH_LIMIT_HOURS, "06:00-22:00")
+    time.setNow(time.local(2020, 1, 1, 21, 59, 59))
+    governor = BandwidthGovernor(time, config)
+
+    # Waiting to repay the first transfer takes past the end of the limited hours
+    await governor.consume(Flow.UPLOAD, 1000)
+    await governor.consume(Flow.UPLOAD, 1000)
+    assert time.sleeps == [10]
+    await governor.consume(Flow.UPLOAD, 1000)
+    assert time.sleeps == [10]
+
+
+async def test_stream(time: FakeTime, config: Config):
+    config.override(Setting.BANDWIDTH_LIMIT_BYTES_PER_SECOND, 100)
+    governor = BandwidthGovernor(time, config)
+
+    async def source():
+        for x in range(3):
+            yield bytes(100)
+
+    chunks = [chunk async for chunk in governor.stream(Flow.DOWNLOAD, source())]
+    assert len(chunks) == 3
+    assert time.sleeps == [1, 1]
+
+
+def test_parse_limit_hours():
+    assert parseLimitHours("") is None
+    assert parseLimitHours("garbage") is None
+    assert parseLimitHours("06:00-22:30") == (6 * 60, 22 * 60 + 30)
+    assert parseLimitHours("22:00-06:00") == (22 * 60, 6 * 60)
+    assert parseLimitHours("00:00-23:59") == (0, 23 * 60 + 59)
+
+    # Times that aren't on the clock don't make a valid range
+    assert parseLimitHours("29:59-00:00") is None
+    assert parseLimitHours("06:00-24:00") is None
+    assert parseLimitHours("06:60-22:00") is None
+    assert parseLimitHours("06:00") is None
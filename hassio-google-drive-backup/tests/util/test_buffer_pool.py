@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from backup.util import BufferPool
+
+
+@pytest.mark.asyncio
+async def test_reuses_buffers():
+    pool = BufferPool(10, max_buffers=2)
+    first = await pool.acquire()
+    assert len(first) == 10
+    pool.release(first)
+    assert await pool.acquire() is first
+    assert pool.allocated() == 1
+
+    second = await pool.acquire()
+    assert second is not first
+    assert pool.allocated() == 2
+
+
+@pytest.mark.asyncio
+async def test_waits_for_release():
+    pool = BufferPool(10)
+    buffer = await pool.acquire()
+    waiter = asyncio.create_task(pool.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    pool.release(buffer)
+    assert await waiter is buffer
+    assert pool.allocated() == 1
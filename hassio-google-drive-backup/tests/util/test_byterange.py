@@ -0,0 +1,37 @@
+from backup.util import parseRangeHeader
+from backup.util.byterange import MAX_RANGES
+
+
+def test_missing_or_malformed():
+    assert parseRangeHeader(None, 100) is None
+    assert parseRangeHeader("", 100) is None
+    assert parseRangeHeader("items=0-10", 100) is None
+    assert parseRangeHeader("bytes=", 100) is None
+    assert parseRangeHeader("bytes=-", 100) is None
+    assert parseRangeHeader("bytes=a-b", 100) is None
+    assert parseRangeHeader("bytes=10-5", 100) is None
+
+
+def test_single_ranges():
+    assert parseRangeHeader("bytes=0-9", 100) == [(0, 10)]
+    assert parseRangeHeader("bytes=90-", 100) == [(90, 100)]
+    assert parseRangeHeader("bytes=-10", 100) == [(90, 100)]
+    assert parseRangeHeader("bytes=-1000", 100) == [(0, 100)]
+    assert parseRangeHeader("bytes=50-1000", 100) == [(50, 100)]
+
+
+def test_unsatisfiable():
+    assert parseRangeHeader("bytes=100-", 100) == []
+    assert parseRangeHeader("bytes=200-300", 100) == []
+    assert parseRangeHeader("bytes=-0", 100) == []
+    assert parseRangeHeader("bytes=-10", 0) == []
+
+
+def test_multiple_ranges():
+    assert parseRangeHeader("bytes=50-59, 0-9", 100) == [(0, 10), (50, 60)]
+    assert parseRangeHeader("bytes=0-9,5-20,21-30", 100) == [(0, 31)]
+    assert parseRangeHeader("bytes=0-9,200-300", 100) == [(0, 10)]
+
+    # Too many ranges just gets the whole thing
+    many = ",".join("{0}-{0}".format(x * 2) for x in range(MAX_RANGES + 1))
+    assert parseRangeHeader("bytes=" + many, 100) is None
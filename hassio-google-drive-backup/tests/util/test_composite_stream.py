@@ -0,0 +1,77 @@
+from backup.util import CompositeStream, StreamSegment, RangeStream
+from backup.util.asynchttpgetter import Stupid
+from ..faketime import FakeTime
+
+
+class BytesStream():
+    """A bare bones stream over some bytes that keeps track of how it gets used"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._position = 0
+        self.closed = False
+
+    async def setup(self):
+        return len(self.data)
+
+    def size(self):
+        return len(self.data)
+
+    def position(self, pos=None):
+        if pos is not None:
+            self._position = pos
+        return self._position
+
+    async def read(self, count):
+        data = self.data[self._position:self._position + count]
+        self._position += len(data)
+        return Stupid(data)
+
+    async def __aexit__(self, type, value, traceback):
+        self.closed = True
+
+
+async def test_read_across_segments(time: FakeTime):
+    opened = []
+
+    async def opener():
+        stream = BytesStream(b"0123456789")
+        opened.append(stream)
+        return stream
+
+    stream = CompositeStream([StreamSegment(3, data=b"abc"), StreamSegment(10, opener=opener), StreamSegment(2, data=b"yz")], time)
+    assert await stream.setup() == 15
+    assert stream.size() == 15
+
+    assert (await stream.read(2)).getvalue() == b"ab"
+    assert len(opened) == 0
+    assert (await stream.read(5)).getvalue() == b"c0123"
+    assert (await stream.read(100)).getvalue() == b"456789yz"
+    assert (await stream.read(100)).getvalue() == b""
+    assert stream.progress() == 100
+    assert len(opened) == 1
+    assert not opened[0].closed
+    await stream.close()
+    assert opened[0].closed
+
+
+async def test_seek(time: FakeTime):
+    async def opener():
+        return BytesStream(b"0123456789")
+
+    stream = CompositeStream([StreamSegment(3, data=b"abc"), StreamSegment(10, opener=opener)], time)
+    stream.position(8)
+    assert (await stream.read(3)).getvalue() == b"567"
+    stream.position(1)
+    assert (await stream.read(3)).getvalue() == b"bc0"
+    assert b"".join([bytes(chunk) async for chunk in stream.generator(4)]) == b"123456789"
+
+
+async def test_range_stream():
+    stream = RangeStream(BytesStream(b"0123456789"), 2, 5)
+    assert stream.size() == 5
+    assert (await stream.read(3)).getvalue() == b"234"
+    assert (await stream.read(3)).getvalue() == b"56"
+    assert (await stream.read(3)).getvalue() == b""
+    stream.position(1)
+    assert (await stream.read(100)).getvalue() == b"3456"
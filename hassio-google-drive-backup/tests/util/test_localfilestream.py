@@ -0,0 +1,50 @@
+import os
+import pytest
+from backup.exceptions import LogicError
+from backup.util import LocalFileStream
+from ..faketime import FakeTime
+
+
+@pytest.mark.asyncio
+async def test_reads(tmpdir, time: FakeTime):
+    path = os.path.join(tmpdir, "backup.tar")
+    with open(path, "wb") as f:
+        f.write(bytearray(range(10)))
+    stream = LocalFileStream(path, time)
+    async with stream:
+        assert stream.size() == 10
+        assert (await stream.read(4)).read() == bytearray(range(4))
+        stream.position(8)
+        assert (await stream.read(4)).read() == bytearray([8, 9])
+        assert (await stream.read(4)).read() == bytearray()
+
+    # The file is closed once the stream is
+    with pytest.raises(LogicError):
+        await stream.read(4)
+
+
+@pytest.mark.asyncio
+async def test_file_replaced_while_reading(tmpdir, time: FakeTime):
+    path = os.path.join(tmpdir, "backup.tar")
+    with open(path, "wb") as f:
+        f.write(bytearray(range(10)))
+    stream = LocalFileStream(path, time)
+    async with stream:
+        assert (await stream.read(4)).read() == bytearray(range(4))
+
+        # The supervisor deleting the backup and writing another one in its place shouldn't change what gets read
+        os.remove(path)
+        with open(path, "wb") as f:
+            f.write(bytearray([100] * 10))
+        assert (await stream.read(6)).read() == bytearray(range(4, 10))
+
+
+@pytest.mark.asyncio
+async def test_file_deleted_while_reading(tmpdir, time: FakeTime):
+    path = os.path.join(tmpdir, "backup.tar")
+    with open(path, "wb") as f:
+        f.write(bytearray(range(10)))
+    stream = LocalFileStream(path, time)
+    async with stream:
+        os.remove(path)
+        assert (await stream.read(10)).read() == bytearray(range(10))
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from backup.util import ParallelRangeStream
+from ..faketime import FakeTime
+
+DATA = bytes(range(100))
+
+
+class Fetcher():
+    def __init__(self, fail_at=None):
+        self.requested = []
+        self.running = 0
+        self.fail_at = fail_at
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def fetch(self, start, end):
+        self.requested.append(start)
+        self.running += 1
+        try:
+            await self.gate.wait()
+            if start == self.fail_at:
+                self.fail_at = None
+                raise ValueError("Failed")
+            return DATA[start:end]
+        finally:
+            self.running -= 1
+
+
+async def settle():
+    for x in range(20):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_reads_in_order(time: FakeTime):
+    fetcher = Fetcher()
+    fetcher.gate.clear()
+    stream = ParallelRangeStream(fetcher.fetch, len(DATA), time, connections=3, part_size=10)
+    async with stream:
+        reading = asyncio.create_task(stream.read(5))
+        await settle()
+        assert fetcher.running == 3
+        fetcher.gate.set()
+        assert (await reading).getvalue() == DATA[0:5]
+        assert (await stream.read(20)).getvalue() == DATA[5:25]
+        assert stream.position() == 25
+        assert stream.progress() == 25
+        assert b"".join([bytes(chunk) async for chunk in stream.generator(7)]) == DATA[25:]
+        assert (await stream.read(5)).getvalue() == b""
+    assert sorted(fetcher.requested) == list(range(0, 100, 10))
+
+
+@pytest.mark.asyncio
+async def test_bounded_read_ahead(time: FakeTime):
+    fetcher = Fetcher()
+    stream = ParallelRangeStream(fetcher.fetch, len(DATA), time, connections=2, part_size=10, max_parts=4)
+    async with stream:
+        # Without a consumer reading further, only max_parts parts get downloaded
+        await stream.read(1)
+        await settle()
+        assert stream.buffered() == 40
+        assert stream.downloading() == 0
+        assert sorted(fetcher.requested) == [0, 10, 20, 30]
+
+        # Reading past a part lets the next one start
+        await stream.read(14)
+        await settle()
+        assert stream.buffered() == 40
+        assert sorted(fetcher.requested) == [0, 10, 20, 30, 40]
+
+
+@pytest.mark.asyncio
+async def test_seek(time: FakeTime):
+    fetcher = Fetcher()
+    stream = ParallelRangeStream(fetcher.fetch, len(DATA), time, connections=2, part_size=10)
+    async with stream:
+        assert (await stream.read(5)).getvalue() == DATA[0:5]
+        stream.position(85)
+        assert (await stream.read(10)).getvalue() == DATA[85:95]
+        stream.position(3)
+        assert (await stream.read(10)).getvalue() == DATA[3:13]
+
+
+@pytest.mark.asyncio
+async def test_failed_part_retries_on_next_read(time: FakeTime):
+    fetcher = Fetcher(fail_at=20)
+    stream = ParallelRangeStream(fetcher.fetch, len(DATA), time, connections=3, part_size=10)
+    async with stream:
+        assert (await stream.read(20)).getvalue() == DATA[0:20]
+        with pytest.raises(ValueError):
+            await stream.read(10)
+        assert stream.position() == 20
+        assert (await stream.read(10)).getvalue() == DATA[20:30]
+
+
+@pytest.mark.asyncio
+async def test_failed_part_in_middle_of_read(time: FakeTime):
+    fetcher = Fetcher(fail_at=20)
+    stream = ParallelRangeStream(fetcher.fetch, len(DATA), time, connections=3, part_size=10)
+    async with stream:
+        assert (await stream.read(15)).getvalue() == DATA[0:15]
+
+        # The read gets part of its data from a part that downloaded fine, and the rest from one that failed
+        with pytest.raises(ValueError):
+            await stream.read(10)
+        assert stream.position() == 15
+        assert (await stream.read(10)).getvalue() == DATA[15:25]
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_downloads(time: FakeTime):
+    fetcher = Fetcher()
+    fetcher.gate.clear()
+    stream = ParallelRangeStream(fetcher.fetch, len(DATA), time, connections=3, part_size=10)
+    await stream.setup()
+    reading = asyncio.create_task(stream.read(5))
+    await settle()
+    assert fetcher.running == 3
+    reading.cancel()
+    await stream.close()
+    assert fetcher.running == 0
+    assert stream.downloading() == 0
+
+
+@pytest.mark.asyncio
+async def test_nothing_fetched_before_first_read(time: FakeTime):
+    fetcher = Fetcher()
+    stream = ParallelRangeStream(fetcher.fetch, len(DATA), time, connections=2, part_size=10)
+    async with stream:
+        await settle()
+        assert fetcher.requested == []
+
+        # Seeking before the first read means the beginning of the file never gets requested
+        stream.position(55)
+        assert (await stream.read(10)).getvalue() == DATA[55:65]
+        assert min(fetcher.requested) == 50
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from backup.util import ReadAheadBuffer
+
+
+@pytest.mark.asyncio
+async def test_take():
+    buffer = ReadAheadBuffer(10)
+    first = b"abc"
+    buffer.put(first)
+    buffer.put(b"defg")
+    assert buffer.buffered() == 7
+    assert buffer.space() == 3
+
+    # A whole chunk comes back as-is
+    assert buffer.take(3) is first
+    assert buffer.take(2) == b"de"
+    buffer.put(b"hi")
+    assert buffer.take(4) == b"fghi"
+    assert buffer.buffered() == 0
+
+
+@pytest.mark.asyncio
+async def test_take_into():
+    buffer = ReadAheadBuffer(10)
+    buffer.put(memoryview(b"abc"))
+    buffer.put(memoryview(b"def"))
+    into = bytearray(5)
+    buffer.takeInto(memoryview(into), 4)
+    assert into == bytearray(b"abcd\0")
+    buffer.skip(1)
+    assert buffer.buffered() == 1
+    assert buffer.take(1) == b"f"
+
+
+@pytest.mark.asyncio
+async def test_wait_for_data():
+    buffer = ReadAheadBuffer(2)
+    started = []
+    waiter = asyncio.create_task(buffer.waitFor(4, lambda: started.append(True)))
+    await asyncio.sleep(0)
+    assert started
+    assert not waiter.done()
+
+    # The reader is allowed past the limit while the consumer waits on more than it
+    assert buffer.space() == 4
+    buffer.put(b"ab")
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    buffer.put(b"cd")
+    assert await waiter == 4
+    assert buffer.space() == -2
+
+
+@pytest.mark.asyncio
+async def test_end():
+    buffer = ReadAheadBuffer(10)
+    buffer.put(b"ab")
+    buffer.end()
+    assert await buffer.waitFor(4, lambda: None) == 2
+    assert buffer.take(2) == b"ab"
+
+
+@pytest.mark.asyncio
+async def test_error_raised_once():
+    buffer = ReadAheadBuffer(10)
+    buffer.put(b"ab")
+    buffer.fail(Exception("boom"))
+
+    # Whatever came before the error can still be read
+    assert await buffer.waitFor(2, lambda: None) == 2
+    with pytest.raises(Exception):
+        await buffer.waitFor(3, lambda: None)
+    buffer.put(b"c")
+    assert await buffer.waitFor(3, lambda: None) == 3
+
+
+@pytest.mark.asyncio
+async def test_clear_drops_error():
+    buffer = ReadAheadBuffer(10)
+    buffer.put(b"ab")
+    buffer.fail(Exception("boom"))
+    buffer.clear()
+    assert buffer.buffered() == 0
+    buffer.put(b"cd")
+    assert await buffer.waitFor(2, lambda: None) == 2
+
+
+@pytest.mark.asyncio
+async def test_wait_for_space():
+    buffer = ReadAheadBuffer(2)
+    buffer.put(b"ab")
+    waiter = asyncio.create_task(buffer.waitForSpace())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    buffer.skip(1)
+    await waiter
+    assert buffer.space() == 1
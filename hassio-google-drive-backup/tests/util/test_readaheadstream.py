@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+from backup.util import ReadAheadStream
+from dev.request_interceptor import RequestInterceptor
+from ..conftest import Uploader
+
+
+async def settle():
+    for x in range(20):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_reads(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(10)))
+    async with getter:
+        stream = ReadAheadStream(getter, max_buffered=4, read_size=2)
+        assert stream.size() == 10
+        assert (await stream.read(3)).read() == bytearray([0, 1, 2])
+        assert stream.position() == 3
+        assert (await stream.read(5)).read() == bytearray([3, 4, 5, 6, 7])
+        assert (await stream.read(5)).read() == bytearray([8, 9])
+        assert (await stream.read(5)).read() == bytearray([])
+        await stream.close()
+
+
+@pytest.mark.asyncio
+async def test_reads_ahead(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(10)))
+    async with getter:
+        stream = ReadAheadStream(getter, max_buffered=4, read_size=2)
+        assert (await stream.read(2)).read() == bytearray([0, 1])
+
+        # The stream should fill up its buffer while the consumer is busy, but no more.
+        await settle()
+        assert stream.buffered() == 4
+        assert getter.position() == 6
+        assert (await stream.read(4)).read() == bytearray([2, 3, 4, 5])
+        await settle()
+        assert stream.buffered() == 4
+        await stream.close()
+
+
+@pytest.mark.asyncio
+async def test_seek(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(10)))
+    async with getter:
+        stream = ReadAheadStream(getter, max_buffered=4, read_size=2)
+        assert (await stream.read(2)).read() == bytearray([0, 1])
+        await settle()
+
+        # Seeking within the buffer just skips ahead
+        stream.position(4)
+        assert stream.buffered() == 2
+        assert (await stream.read(2)).read() == bytearray([4, 5])
+
+        # Seeking backward starts reading again from the new position
+        stream.position(1)
+        assert stream.buffered() == 0
+        assert (await stream.read(3)).read() == bytearray([1, 2, 3])
+
+        # Seek while a read is outstanding
+        stream.position(8)
+        assert (await stream.read(3)).read() == bytearray([8, 9])
+        stream.position(0)
+        assert (await stream.read(10)).read() == bytearray(range(10))
+        await stream.close()
+
+
+@pytest.mark.asyncio
+async def test_read_error(uploader: Uploader, server, interceptor: RequestInterceptor):
+    getter = await uploader.upload(bytearray(range(10)))
+    async with getter:
+        stream = ReadAheadStream(getter, max_buffered=4, read_size=2)
+        assert (await stream.read(2)).read() == bytearray([0, 1])
+        await settle()
+
+        # Force the underlying stream to make a new request, which will fail
+        interceptor.setError("^/readfile$", status=500)
+        stream.position(7)
+        with pytest.raises(Exception):
+            await stream.read(2)
+
+        # The stream should recover once the source does
+        interceptor.clear()
+        assert (await stream.read(2)).read() == bytearray([7, 8])
+        await stream.close()
+
+
+@pytest.mark.asyncio
+async def test_close_mid_read(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(10)))
+    async with getter:
+        stream = ReadAheadStream(getter, max_buffered=4, read_size=2)
+        assert (await stream.read(2)).read() == bytearray([0, 1])
+        await stream.close()
+
+        # The underlying stream should still be usable afterward
+        getter.position(2)
+        assert (await getter.read(3)).read() == bytearray([2, 3, 4])
+
+
+@pytest.mark.asyncio
+async def test_readinto(uploader: Uploader, server):
+    getter = await uploader.upload(bytearray(range(10)))
+    async with getter:
+        stream = ReadAheadStream(getter, max_buffered=4, read_size=3)
+        buffer = bytearray(6)
+        assert await stream.readinto(memoryview(buffer)) == 6
+        assert buffer == bytearray(range(6))
+        assert stream.position() == 6
+        assert await stream.readinto(memoryview(buffer)[1:]) == 4
+        assert buffer == bytearray([0, 6, 7, 8, 9, 5])
+        assert await stream.readinto(memoryview(buffer)) == 0
+        await stream.close()
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from backup.util import ResponseCache
+from ..faketime import FakeTime
+
+
+def test_get_and_put(time: FakeTime):
+    cache = ResponseCache(time, 100, timedelta(hours=1))
+    assert cache.get("a") is None
+    cache.put("a", "etag1", "body")
+    assert cache.get("a") == ("etag1", "body")
+    cache.put("a", "etag2", "other")
+    assert cache.get("a") == ("etag2", "other")
+    assert cache.size() == 5
+    cache.remove("a")
+    assert cache.get("a") is None
+    assert cache.size() == 0
+
+
+def test_expiration(time: FakeTime):
+    cache = ResponseCache(time, 100, timedelta(hours=1))
+    cache.put("a", "etag", "body")
+    time.advance(minutes=59)
+    assert cache.get("a") == ("etag", "body")
+
+    # Confirming it's still current restarts the clock
+    cache.refresh("a")
+    time.advance(minutes=59)
+    assert cache.get("a") == ("etag", "body")
+    time.advance(minutes=1)
+    assert cache.get("a") is None
+    assert cache.size() == 0
+
+
+def test_size_limit(time: FakeTime):
+    cache = ResponseCache(time, 10, timedelta(hours=1))
+    cache.put("a", "etag", "1234")
+    cache.put("b", "etag", "1234")
+
+    # Using "a" makes "b" the least recently used, so it goes first
+    cache.get("a")
+    cache.put("c", "etag", "1234")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.size() == 8
+
+    # Something too big to ever fit just doesn't get kept
+    cache.put("d", "etag", "12345678901")
+    assert cache.get("d") is None
+    assert cache.size() == 8
@@ -0,0 +1,42 @@
+import hashlib
+
+from backup.util import StreamChecksum
+
+
+def test_checksum():
+    data = bytes(range(256)) * 100
+    checksum = StreamChecksum()
+    checksum.update(0, data[:1000])
+    checksum.update(1000, memoryview(data)[1000:])
+    assert checksum.valid()
+    assert checksum.position() == len(data)
+    assert checksum.md5() == hashlib.md5(data).hexdigest()
+    assert checksum.sha256() == hashlib.sha256(data).hexdigest()
+
+
+def test_repeated_chunks():
+    data = bytes(range(256)) * 100
+    checksum = StreamChecksum()
+    checksum.update(0, data[:1000])
+
+    # Chunks sent again after seeking backward only count the bytes that are new
+    checksum.update(500, data[500:1000])
+    checksum.update(500, data[500:2000])
+    checksum.update(2000, data[2000:])
+    assert checksum.md5() == hashlib.md5(data).hexdigest()
+
+
+def test_skipped_chunk():
+    data = bytes(range(256)) * 100
+    checksum = StreamChecksum()
+    checksum.update(0, data[:1000])
+    checksum.update(2000, data[2000:])
+    assert not checksum.valid()
+    assert checksum.md5() is None
+    assert checksum.sha256() is None
+
+
+def test_resumed_in_the_middle():
+    checksum = StreamChecksum()
+    checksum.update(1000, bytes(1000))
+    assert not checksum.valid()
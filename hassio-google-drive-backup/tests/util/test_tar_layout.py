@@ -0,0 +1,63 @@
+import tarfile
+from io import BytesIO
+
+from backup.util import scanTarLayout, TarSegment, CompositeStream, StreamSegment
+from ..faketime import FakeTime
+
+
+def makeTar(files, format=tarfile.PAX_FORMAT):
+    stream = BytesIO()
+    with tarfile.open(fileobj=stream, mode="w", format=format) as tar:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, BytesIO(data))
+    return stream.getvalue()
+
+
+def streamOf(data: bytes, time: FakeTime):
+    return CompositeStream([StreamSegment(len(data), data=data)], time)
+
+
+def checkCoverage(segments, data):
+    position = 0
+    for segment in segments:
+        assert segment.start == position
+        position += segment.size
+    assert position == len(data)
+
+
+async def test_layout(time: FakeTime):
+    archive1 = bytes(range(256)) * 20
+    archive2 = bytes(reversed(range(256))) * 30
+    data = makeTar([("backup.json", b"{}"), ("./addon.tar.gz", archive1), ("./small.tar.gz", b"tiny"), ("./homeassistant.tar.gz", archive2)])
+    segments = await scanTarLayout(streamOf(data, time), 1000)
+    checkCoverage(segments, data)
+
+    files = [segment for segment in segments if segment.isFile()]
+    assert [segment.name for segment in files] == ["./addon.tar.gz", "./homeassistant.tar.gz"]
+    assert data[files[0].start:files[0].start + files[0].size] == archive1
+    assert data[files[1].start:files[1].start + files[1].size] == archive2
+
+    # Headers and small files stay in the segments between them
+    assert not segments[0].isFile()
+    assert segments[1] == files[0]
+
+
+async def test_long_names(time: FakeTime):
+    name = "./" + "a" * 200 + ".tar.gz"
+    content = bytes(5000)
+    for format in [tarfile.PAX_FORMAT, tarfile.GNU_FORMAT]:
+        data = makeTar([(name, content), ("other.tar", content)], format=format)
+        segments = await scanTarLayout(streamOf(data, time), 1000)
+        checkCoverage(segments, data)
+        assert [segment.name for segment in segments if segment.isFile()] == [name, "other.tar"]
+
+
+async def test_not_a_tar(time: FakeTime):
+    assert await scanTarLayout(streamOf(b"not a tar file" * 100, time)) is None
+
+
+async def test_nothing_to_split(time: FakeTime):
+    data = makeTar([("backup.json", b"{}")])
+    assert await scanTarLayout(streamOf(data, time), 1000) == [TarSegment(0, len(data))]
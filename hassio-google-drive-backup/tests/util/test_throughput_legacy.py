@@ -0,0 +1,42 @@
+from collections import deque
+
+import pytest
+
+from backup.util import ThroughputMeter
+from dev.benchmark_throughput import HISTORY, PERIOD, benchmark, legacySpeed
+from ..faketime import FakeTime
+
+# Checks the ThroughputMeter against how a transfer's speed was estimated before, which kept the last 50 reads
+# and integrated over all of them on every query.  dev/benchmark_throughput.py compares how long each takes.
+
+READS = 2000
+
+
+@pytest.mark.asyncio
+async def test_speed_matches_legacy_estimate(time: FakeTime):
+    meter = ThroughputMeter(time)
+    meter.start()
+    history = deque([[time.now(), 0]])
+    position = 0
+
+    for x in range(READS):
+        time.advance(seconds=0.1)
+        position += 1024
+        history.append([time.now(), position])
+        if len(history) > HISTORY:
+            history.popleft()
+        meter.add(1024)
+
+        legacy = legacySpeed(history, time.now(), PERIOD)
+        rate = meter.rate(PERIOD)
+
+        # At a steady rate both should agree
+        if legacy is not None:
+            assert rate == pytest.approx(legacy)
+
+
+def test_benchmark_runs():
+    # Timings vary too much from machine to machine to assert on, so this only makes sure the benchmark still works
+    legacy_seconds, meter_seconds = benchmark(100)
+    assert legacy_seconds > 0
+    assert meter_seconds > 0
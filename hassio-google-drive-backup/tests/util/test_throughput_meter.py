@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from backup.util import ThroughputMeter
+from ..faketime import FakeTime
+
+
+def test_no_reads(time: FakeTime):
+    meter = ThroughputMeter(time)
+    assert meter.rate() is None
+    meter.start()
+    assert meter.rate() is None
+    time.advance(seconds=1)
+    meter.add(10)
+    assert meter.rate() == 10
+    assert meter.total() == 10
+
+
+def test_steady_rate(time: FakeTime):
+    meter = ThroughputMeter(time)
+    meter.start()
+    for x in range(100):
+        time.advance(seconds=0.1)
+        meter.add(100)
+    assert meter.rate(timedelta(seconds=1)) == 1000
+    assert meter.rate(timedelta(seconds=5)) == 1000
+    assert meter.rate(timedelta(seconds=60)) == 1000
+
+
+def test_window_only_sees_recent_reads(time: FakeTime):
+    meter = ThroughputMeter(time)
+    meter.start()
+    for x in range(20):
+        time.advance(seconds=1)
+        meter.add(1000)
+    for x in range(20):
+        time.advance(seconds=1)
+        meter.add(10)
+    assert meter.rate(timedelta(seconds=10)) == 10
+    assert meter.rate(timedelta(seconds=30)) == (10 * 1000 + 20 * 10) / 30
+
+
+def test_reads_at_the_same_time(time: FakeTime):
+    meter = ThroughputMeter(time)
+    meter.start()
+    time.advance(seconds=2)
+    meter.add(10)
+    meter.add(10)
+    assert meter.rate() == 10
+    assert meter.total() == 20
+
+
+def test_decays_after_transfer_stops(time: FakeTime):
+    meter = ThroughputMeter(time)
+    meter.start()
+    time.advance(seconds=1)
+    meter.add(100)
+    time.advance(seconds=10)
+    assert meter.rate(timedelta(seconds=10)) == 100
+    time.advance(seconds=5)
+    assert meter.rate(timedelta(seconds=10)) == 50
+    time.advance(seconds=5)
+    assert meter.rate(timedelta(seconds=10)) == 0
+
+
+def test_longer_than_history(time: FakeTime):
+    meter = ThroughputMeter(time, bucket_seconds=1, bucket_count=10)
+    meter.start()
+    for x in range(100):
+        time.advance(seconds=1)
+        meter.add(5 if x < 50 else 50)
+    # Only the most recent buckets are kept, so a long window gets cut down to them
+    assert meter.rate(timedelta(seconds=60)) == 50
+
+
+def test_long_gap_between_reads(time: FakeTime):
+    meter = ThroughputMeter(time, bucket_seconds=1, bucket_count=10)
+    meter.start()
+    time.advance(seconds=1)
+    meter.add(10)
+    time.advance(seconds=1000)
+    meter.add(1000)
+    time.advance(seconds=1)
+    meter.add(10)
+    assert meter.rate(timedelta(seconds=2)) == 5.5